@@ -5,6 +5,7 @@ import os
 import logging
 from dotenv import load_dotenv
 import json # For displaying user profile nicely
+import itertools
 
 # --- Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -25,7 +26,7 @@ try:
     # Assuming db_connection.py is in the same directory or accessible via PYTHONPATH
     from db_connection import get_user_by_phone
     # rag_utils should contain the latest do_rag_query with multi-store routing
-    from rag_utils import do_rag_query 
+    from rag_utils import do_rag_query_stream
 except ImportError as e:
     st.error(f"Failed to import required modules: {e}. Ensure db_connection.py and rag_utils.py are present and correct.")
     logging.critical(f"Module import error: {e}", exc_info=True)
@@ -125,32 +126,33 @@ def main():
              st.warning("Please load user data using the sidebar first.")
              st.stop()
 
-        # Get response from RAG function
-        with st.spinner("Koda is thinking... (Querying knowledge base & LLM)"):
+        # Stream the response from the RAG function so the first tokens show up immediately
+        with st.chat_message("assistant"):
             try:
                 top_k_value = 5 # Or use st.number_input if you want it changeable per query
-                logging.info(f"Calling do_rag_query with: query='{prompt}', top_k={top_k_value}")
-                
-                # --- Call the updated RAG function ---
-                response = do_rag_query(
-                    user_query=prompt,
-                    user_profile=st.session_state.current_user_data, # Pass loaded user data
-                    top_k=top_k_value
-                )
-                st.session_state.last_answer = response # Store the answer
-                logging.info(f"Received response from do_rag_query.")
+                logging.info(f"Calling do_rag_query_stream with: query='{prompt}', top_k={top_k_value}")
+
+                # --- Call the streaming RAG function ---
+                with st.spinner("Koda is thinking... (Querying knowledge base & LLM)"):
+                    response_stream = do_rag_query_stream(
+                        user_query=prompt,
+                        user_profile=st.session_state.current_user_data, # Pass loaded user data
+                        top_k=top_k_value,
+                        semantic_cache=True # Free-form chat: reworded repeats may reuse an answer
+                    )
+                    first_chunk = next(response_stream, "") # Spinner covers routing/retrieval until the first token
+                st.session_state.last_answer = st.write_stream(itertools.chain([first_chunk], response_stream))
+                logging.info(f"Received response from do_rag_query_stream.")
 
             except Exception as e:
                 st.error(f"An error occurred while getting the answer: {e}")
-                logging.error(f"Error calling do_rag_query from app2.py: {e}", exc_info=True)
+                logging.error(f"Error calling do_rag_query_stream from app2.py: {e}", exc_info=True)
                 st.session_state.last_answer = f"Sorry, an internal error occurred. Details: {e}"
+                st.markdown(st.session_state.last_answer)
 
         # Add assistant response to chat history
         st.session_state.messages.append({"role": "assistant", "content": st.session_state.last_answer})
-        # Display assistant response
-        with st.chat_message("assistant"):
-            st.markdown(st.session_state.last_answer)
-            
+
         # Clear the query state after processing
         st.session_state.current_query = "" 
 
@@ -68,6 +68,25 @@ def get_user_by_phone(phone: str):
     finally:
         if conn: conn.close()
 
+def get_users_by_phones(phones: List[str]) -> Dict[str, Dict[str, Any]]:
+    """get_user_by_phone for many phones in one query: {phone: users_latest_state row} (phones without a row are absent)."""
+    phones = list(dict.fromkeys(phone for phone in phones if phone))
+    if not phones: return {}
+    conn = get_connection()
+    if not conn: return {}
+    try:
+        with conn.cursor() as cursor:
+            query = "SELECT * FROM users_latest_state WHERE phone IN %s"
+            cursor.execute(query, (phones,))
+            users_by_phone = {}
+            for user in cursor.fetchall(): users_by_phone.setdefault(user['phone'], user) # First row per phone, like LIMIT 1
+        return users_by_phone
+    except pymysql.Error as e:
+        logging.error(f"DB Error fetching users by {len(phones)} phones: {e}")
+        return {}
+    finally:
+        if conn: conn.close()
+
 def get_shortlists_by_user(user_id):
     """Retrieves shortlists for a user (simplified version for now)."""
     conn = get_connection()
@@ -501,12 +520,14 @@ def get_aitools_profile_users():
 
     return user_profiles
 
-def get_ielts_user_profile(user_id: str) -> Optional[Dict[str, Any]]:
+def get_ielts_user_profile(user_id: str, raise_errors: bool = False) -> Optional[Dict[str, Any]]:
     """
     Fetches the profile data for a specific user from ielts_users_profile.
 
     Args:
         user_id: The user's ID.
+        raise_errors: Raise on connection/query errors instead of returning None,
+            so callers can tell "no profile" apart from "lookup failed".
 
     Returns:
         A dictionary containing the IELTS profile data, or None if not found/error.
@@ -514,6 +535,7 @@ def get_ielts_user_profile(user_id: str) -> Optional[Dict[str, Any]]:
     conn = get_connection()
     profile_data = None
     if not conn:
+        if raise_errors: raise ConnectionError(f"No DB connection for IELTS profile of user {user_id}")
         return None
 
     try:
@@ -532,14 +554,52 @@ def get_ielts_user_profile(user_id: str) -> Optional[Dict[str, Any]]:
 
     except pymysql.Error as e:
         logging.error(f"DB Error fetching IELTS profile for user {user_id}: {e}")
+        if raise_errors: raise
     except Exception as e:
         logging.error(f"Unexpected error fetching IELTS profile for user {user_id}: {e}")
+        if raise_errors: raise
     finally:
         if conn:
             conn.close()
 
     return profile_data
 
+def _fetch_ielts_profiles_by_userids(cursor, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Runs the bulk ielts_users_profile query on an open cursor: {userid: profile}. pymysql errors propagate."""
+    query = """
+        SELECT
+            userid, ielts_attempts, DreamCountry, Funds, goal, mx_region,
+            ielts_status, study_abroad_status, work_status, category, subCategory
+        FROM ielts_users_profile
+        WHERE userid IN %s
+    """
+    cursor.execute(query, (user_ids,))
+    profiles = {}
+    for profile in cursor.fetchall(): profiles.setdefault(profile['userid'], profile) # First row per user, like LIMIT 1
+    return profiles
+
+def get_ielts_profiles_by_userids(user_ids: List[str], raise_errors: bool = False) -> Dict[str, Dict[str, Any]]:
+    """
+    get_ielts_user_profile for many users in one query: {userid: profile} (users without a profile are absent).
+    Errors return {} unless raise_errors, in which case they raise (an empty dict then always means "no profiles").
+    """
+    user_ids = list(dict.fromkeys(user_id for user_id in user_ids if user_id))
+    if not user_ids: return {}
+    conn = get_connection()
+    if not conn:
+        if raise_errors: raise ConnectionError(f"No DB connection for IELTS profiles of {len(user_ids)} users")
+        return {}
+    try:
+        with conn.cursor() as cursor:
+            return _fetch_ielts_profiles_by_userids(cursor, user_ids)
+    except pymysql.Error as e:
+        logging.error(f"DB Error fetching IELTS profiles for {len(user_ids)} users: {e}")
+        if raise_errors: raise
+        return {}
+    finally:
+        if conn: conn.close()
+
+
 def get_combined_chat_users_on_date(selected_date: datetime.date) -> List[Dict[str, Any]]:
     """
     Fetches users active in EITHER ai_counselor_conv_history OR shortlists
@@ -662,6 +722,68 @@ def get_combined_chat_users_on_date(selected_date: datetime.date) -> List[Dict[s
     return final_user_list
 
 
+def _parse_shortlist_query_profile(query_json_str: Optional[str], user_id: str) -> Dict[str, Any]:
+    """Parses a shortlist 'query' JSON into the displayable query profile (internal keys and nulls dropped)."""
+    try:
+        query_data = json.loads(query_json_str or '{}')
+        # Filter out internal/unwanted keys if necessary
+        keys_to_exclude = {'isDeFault', 'isSelectedCareer', 'isSelectedCountry', 'isSelectedCourse', 'shortlist_id', 'user_id', 'dateStrings'}
+        return {k: v for k, v in query_data.items() if k not in keys_to_exclude and v is not None}
+    except json.JSONDecodeError as e:
+        logging.warning(f"Failed to parse query JSON for user {user_id}'s latest shortlist (details fetch): {e}")
+        return {'error': 'parse_failed'}
+
+
+def get_combined_chat_users_with_profiles_on_date(selected_date: datetime.date) -> List[Dict[str, Any]]:
+    """
+    get_combined_chat_users_on_date, plus each user's IELTS profile and latest shortlist query profile,
+    fetched with one bulk query per table instead of two round-trips per selected user.
+
+    Adds to each user dict: 'ielts_profile' (dict, or None if no profile) and
+    'shortlist_profile_data' (parsed query profile, or None if the user has no shortlist).
+    If the bulk profile queries fail, the keys are left out so callers can fall back to per-user fetches.
+    """
+    users = get_combined_chat_users_on_date(selected_date)
+    user_ids = [user['user_id'] for user in users]
+    if not user_ids: return users
+
+    conn = get_connection()
+    if not conn: return users
+
+    try:
+        with conn.cursor() as cursor:
+            ielts_map = _fetch_ielts_profiles_by_userids(cursor, user_ids) # Same query as get_ielts_profiles_by_userids, on this connection
+
+            # Latest shortlist per user: each user's MAX(date_created) joined back to its row
+            query_shortlists = """
+                SELECT s.user_id, s.query AS query_json_str
+                FROM shortlists s
+                JOIN (
+                    SELECT user_id, MAX(date_created) AS max_created
+                    FROM shortlists
+                    WHERE user_id IN %s
+                    GROUP BY user_id
+                ) latest ON s.user_id = latest.user_id AND s.date_created = latest.max_created
+            """
+            cursor.execute(query_shortlists, (user_ids,))
+            shortlist_query_map = {}
+            for row in cursor.fetchall(): shortlist_query_map.setdefault(row['user_id'], row.get('query_json_str'))
+
+        for user in users:
+            user_id = user['user_id']
+            user['ielts_profile'] = ielts_map.get(user_id)
+            user['shortlist_profile_data'] = _parse_shortlist_query_profile(shortlist_query_map[user_id], user_id) if user_id in shortlist_query_map else None
+
+    except pymysql.Error as e:
+        logging.error(f"DB Error bulk-fetching profiles for chat users on {selected_date}: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error bulk-fetching profiles for chat users on {selected_date}: {e}")
+    finally:
+        if conn: conn.close()
+
+    return users
+
+
 def get_latest_shortlist_details(user_id: str) -> Optional[Dict[str, Any]]:
     """
     Retrieves the absolute latest shortlist entry for a user and parses
@@ -694,21 +816,10 @@ def get_latest_shortlist_details(user_id: str) -> Optional[Dict[str, Any]]:
 
         if result:
             shortlist_details = {}
-            query_data = {}
             top_courses = []
 
             # Parse 'query' JSON
-            try:
-                query_json_str = result.get('query_json_str', '{}') or '{}'
-                query_data = json.loads(query_json_str)
-                # Filter out internal/unwanted keys if necessary
-                keys_to_exclude = {'isDeFault', 'isSelectedCareer', 'isSelectedCountry', 'isSelectedCourse', 'shortlist_id', 'user_id', 'dateStrings'}
-                query_profile_data_filtered = {k: v for k, v in query_data.items() if k not in keys_to_exclude and v is not None}
-                shortlist_details['query_profile_data'] = query_profile_data_filtered
-
-            except json.JSONDecodeError as e:
-                logging.warning(f"Failed to parse query JSON for user {user_id}'s latest shortlist (details fetch): {e}")
-                shortlist_details['query_profile_data'] = {'error': 'parse_failed'}
+            shortlist_details['query_profile_data'] = _parse_shortlist_query_profile(result.get('query_json_str'), user_id)
 
 
             # Parse 'shortlist' JSON and extract top 5 courses (using robust logic)
@@ -2,12 +2,16 @@
 
 import gspread
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import streamlit as st
 import logging
 import os
 import pandas as pd
 import datetime
-from typing import List, Dict, Optional, Tuple, Any
+import re
+from typing import List, Dict, Optional, Tuple, Any, Union
 
 # --- Constants ---
 SHEET_URL = "https://docs.google.com/spreadsheets/d/16iNXwp9-TFUS0zPgvY3lobCWDHtslYUp7KS-a_kVgWA/edit?usp=sharing"
@@ -21,9 +25,14 @@ EXPECTED_HEADERS = [
 ]
 
 # --- Authentication ---
-@st.cache_resource(ttl=600) # Cache the client for 10 minutes
+SHEETS_CLIENT_TTL_S = 3300 # Just under the 1h access-token lifetime
+
+@st.cache_resource(ttl=SHEETS_CLIENT_TTL_S) # One client (and its keep-alive HTTP pool) shared across reruns and sessions
 def get_gspread_client() -> Optional[gspread.Client]:
-    """Authenticates with Google Sheets API using Service Account."""
+    """
+    Authenticates with Google Sheets API using Service Account. The client's session keeps connections alive
+    and retries idempotent requests on 429/5xx with backoff.
+    """
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive.file",
@@ -49,7 +58,10 @@ def get_gspread_client() -> Optional[gspread.Client]:
             logging.error("Credentials not found in secrets or local file.")
             return None
 
-        client = gspread.authorize(creds)
+        session = AuthorizedSession(creds)
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504]) # Default allowed_methods: no POST (append) retries
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retries))
+        client = gspread.Client(auth=creds, session=session)
         return client
 
     except Exception as e:
@@ -62,7 +74,7 @@ def get_gspread_client() -> Optional[gspread.Client]:
 # ... (other imports and functions like get_gspread_client) ...
 
 # --- CORRECTED get_worksheet function ---
-@st.cache_resource(ttl=600) # Cache the worksheet object
+@st.cache_resource(ttl=SHEETS_CLIENT_TTL_S) # Cache the worksheet object (per sheet URL/name), same lifetime as the client
 def get_worksheet(
     _client: gspread.Client, # Argument renamed with underscore for caching
     sheet_url: str = SHEET_URL,
@@ -138,14 +150,58 @@ def get_all_followups(worksheet: gspread.Worksheet) -> List[Dict[str, Any]]:
         logging.error(f"Error in get_all_followups: {e}", exc_info=True)
         return []
 
-def get_followups_due_today(worksheet: gspread.Worksheet) -> List[Dict[str, Any]]:
-    """Filters all followups to get records where Next_Action_Date is today."""
+SHEET_DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d-%b-%Y") # Same formats get_all_followups accepts
+
+def _is_iso_date_text(value: str) -> bool:
+    # 'YYYY-MM-DD' cells can be matched against an ISO date by plain string comparison, no strptime needed
+    return len(value) == 10 and value[4] == "-" and value[7] == "-"
+
+def _parse_sheet_date(value: Any) -> Optional[datetime.date]:
+    if not isinstance(value, str) or not value: return None
+    for fmt in SHEET_DATE_FORMATS:
+        try: return datetime.datetime.strptime(value, fmt).date()
+        except ValueError: continue
+    return None
+
+@st.cache_data(ttl=60, show_spinner=False) # Rapid reruns reuse the result; keyed on the day
+def get_due_today_fast(_worksheet: gspread.Worksheet, today_iso: str) -> List[Dict[str, Any]]:
+    """
+    get_followups_due_today without downloading the whole grid: one batchGet for the header row and the
+    Next_Action_Date column, then one batchGet for just the matching rows. Records are shaped like get_all_followups'.
+    Sheets errors propagate to the caller: st.cache_data doesn't cache exceptions, so a transient failure isn't replayed as "nothing due".
+    """
+    if not _worksheet: return []
+    title = _worksheet.title
+    spreadsheet = _worksheet.spreadsheet
+    date_col = gspread.utils.rowcol_to_a1(1, EXPECTED_HEADERS.index("Next_Action_Date") + 1).rstrip("0123456789")
+    header_range, date_range = spreadsheet.values_batch_get([f"'{title}'!1:1", f"'{title}'!{date_col}:{date_col}"])["valueRanges"]
+    headers = (header_range.get("values") or [[]])[0]
+    today = datetime.date.fromisoformat(today_iso)
+    is_due = lambda cell: cell == today_iso if _is_iso_date_text(cell) else _parse_sheet_date(cell) == today # Only non-ISO cells get parsed
+    due_rows = [row_index for row_index, cells in enumerate(date_range.get("values", [])[1:], start=2) if cells and isinstance(cells[0], str) and is_due(cells[0])]
+    logging.info(f"Found {len(due_rows)} records due today ({today_iso}) from the Next_Action_Date column.")
+    if not due_rows or not headers: return []
+
+    last_cell = lambda row_index: gspread.utils.rowcol_to_a1(row_index, len(headers))
+    row_ranges = spreadsheet.values_batch_get([f"'{title}'!A{row_index}:{last_cell(row_index)}" for row_index in due_rows])["valueRanges"]
+    due_today = []
+    for value_range in row_ranges:
+        row_values = (value_range.get("values") or [[]])[0]
+        record = dict(zip(headers, row_values + [""] * (len(headers) - len(row_values)))) # Trailing empty cells aren't returned
+        for date_col_name in ["Current_Action_Date", "Next_Action_Date"]:
+            if date_col_name in record: record[date_col_name] = _parse_sheet_date(record[date_col_name]) or record[date_col_name] or None # Unparseable stays a string
+        due_today.append(record)
+    return due_today
+
+def get_followups_due_today(worksheet: gspread.Worksheet, today_iso: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Filters all followups to get records where Next_Action_Date is today (pass today_iso to reuse the caller's date)."""
     all_records = get_all_followups(worksheet)
     if not all_records: return []
 
-    today = datetime.date.today()
+    today = datetime.date.fromisoformat(today_iso) if today_iso else datetime.date.today()
+    today_iso = today.isoformat()
     due_today = []
-    logging.info(f"Filtering for records due today: {today.isoformat()}")
+    logging.info(f"Filtering for records due today: {today_iso}")
 
     for record in all_records:
         next_action_date = record.get("Next_Action_Date")
@@ -153,6 +209,9 @@ def get_followups_due_today(worksheet: gspread.Worksheet) -> List[Dict[str, Any]
         if isinstance(next_action_date, datetime.date):
             if next_action_date == today:
                 due_today.append(record)
+        elif isinstance(next_action_date, str) and _is_iso_date_text(next_action_date): # ISO text: compare strings, skip strptime
+            if next_action_date == today_iso:
+                due_today.append(record)
         elif isinstance(next_action_date, str) and next_action_date: # Try parsing again if needed
             try:
                 parsed_date = datetime.datetime.strptime(next_action_date, "%Y-%m-%d").date() # Assuming YYYY-MM-DD
@@ -164,6 +223,44 @@ def get_followups_due_today(worksheet: gspread.Worksheet) -> List[Dict[str, Any]
     logging.info(f"Found {len(due_today)} records due today.")
     return due_today
 
+def _parse_row_dates(data_dict: Dict[str, Any]) -> Dict[str, Any]:
+    # Convert dates for consistency
+    for date_col in ["Current_Action_Date", "Next_Action_Date"]:
+         if date_col in data_dict and isinstance(data_dict[date_col], str) and data_dict[date_col]:
+              try: data_dict[date_col] = datetime.datetime.strptime(data_dict[date_col], "%Y-%m-%d").date()
+              except ValueError: pass # Keep as string if format is wrong
+         elif date_col in data_dict and not data_dict[date_col]: data_dict[date_col] = None # Handle empty string
+    return data_dict
+
+def build_phone_index(worksheet: gspread.Worksheet) -> Optional[Dict[str, int]]:
+    """
+    PhoneNumber -> row index (1-based, first matching row) from a single PhoneNumber column fetch,
+    so repeated lookups don't each search the sheet. None on error.
+    """
+    if not worksheet: return None
+    try:
+        phone_col = worksheet.col_values(EXPECTED_HEADERS.index("PhoneNumber") + 1)
+        phone_index = {}
+        for row_index, phone in enumerate(phone_col[1:], start=2): # Skip header row
+            if phone: phone_index.setdefault(phone, row_index)
+        logging.info(f"Indexed {len(phone_index)} phone numbers from worksheet '{worksheet.title}'.")
+        return phone_index
+    except Exception as e:
+        st.error(f"Error reading phone numbers from Google Sheet: {e}")
+        logging.error(f"Error in build_phone_index: {e}", exc_info=True)
+        return None
+
+def get_followup_by_row(worksheet: gspread.Worksheet, row_index: int) -> Optional[Dict[str, Any]]:
+    """One row as a dict keyed by EXPECTED_HEADERS (the header row is validated when the worksheet is opened)."""
+    if not worksheet or not row_index: return None
+    try:
+        row_values = worksheet.row_values(row_index)
+        return _parse_row_dates(dict(zip(EXPECTED_HEADERS, row_values))) if row_values else None
+    except Exception as e:
+        st.error(f"Error reading Google Sheet row {row_index}: {e}")
+        logging.error(f"Error in get_followup_by_row for row {row_index}: {e}", exc_info=True)
+        return None
+
 def find_followup_by_phone(worksheet: gspread.Worksheet, phone_number: str) -> Optional[Tuple[Dict[str, Any], int]]:
     """Finds the first row matching a phone number. Returns (data_dict, row_index)."""
     if not worksheet or not phone_number: return None
@@ -177,14 +274,8 @@ def find_followup_by_phone(worksheet: gspread.Worksheet, phone_number: str) -> O
             # Get all values in that row, then zip with headers
             row_values = worksheet.row_values(row_index)
             headers = worksheet.row_values(1) # Get headers again
-            data_dict = dict(zip(headers, row_values))
+            data_dict = _parse_row_dates(dict(zip(headers, row_values)))
             logging.info(f"Found record for {phone_number} at row {row_index}")
-             # Convert dates for consistency
-            for date_col in ["Current_Action_Date", "Next_Action_Date"]:
-                 if date_col in data_dict and isinstance(data_dict[date_col], str) and data_dict[date_col]:
-                      try: data_dict[date_col] = datetime.datetime.strptime(data_dict[date_col], "%Y-%m-%d").date()
-                      except ValueError: pass # Keep as string if format is wrong
-                 elif date_col in data_dict and not data_dict[date_col]: data_dict[date_col] = None # Handle empty string
             return data_dict, row_index
         else:
             logging.info(f"No record found for phone number: {phone_number}")
@@ -214,7 +305,9 @@ def update_followup(worksheet: gspread.Worksheet, row_index: int, data_dict: Dic
         row_values = [data_dict.get(header, '') for header in headers]
 
         logging.info(f"Updating row {row_index} with data: {row_values}")
-        worksheet.update(f'A{row_index}', [row_values]) # Update entire row starting from column A
+        # Whole row in one values.update call over an explicit A:<last column> range (one request / quota unit per save)
+        row_range = f"A{row_index}:{gspread.utils.rowcol_to_a1(row_index, len(row_values))}"
+        worksheet.update(range_name=row_range, values=[row_values]) # Keywords: positional order differs between gspread 5 and 6
         logging.info(f"Row {row_index} updated successfully.")
         return True
     except Exception as e:
@@ -223,8 +316,8 @@ def update_followup(worksheet: gspread.Worksheet, row_index: int, data_dict: Dic
         return False
 
 
-def add_followup(worksheet: gspread.Worksheet, data_dict: Dict[str, Any]) -> bool:
-    """Appends a new row to the worksheet."""
+def add_followup(worksheet: gspread.Worksheet, data_dict: Dict[str, Any]) -> Union[int, bool]:
+    """Appends a new row to the worksheet. Returns the new row's index (True if it can't be read back), False on error."""
     if not worksheet: return False
     try:
         headers = EXPECTED_HEADERS
@@ -239,9 +332,12 @@ def add_followup(worksheet: gspread.Worksheet, data_dict: Dict[str, Any]) -> boo
         row_values = [data_dict.get(header, '') for header in headers]
 
         logging.info(f"Appending new row with data: {row_values}")
-        worksheet.append_row(row_values, value_input_option='USER_ENTERED') # USER_ENTERED tries to interpret types
-        logging.info("New row appended successfully.")
-        return True
+        response = worksheet.append_row(row_values, value_input_option='USER_ENTERED') # USER_ENTERED tries to interpret types
+        # The append response names the written range (e.g. "Sheet1!A42:G42"), so the new row index needs no re-read
+        updated_range = ((response or {}).get('updates') or {}).get('updatedRange', '')
+        match = re.search(r'![A-Z]+(\d+)', updated_range)
+        logging.info(f"New row appended successfully ({updated_range or 'range not reported'}).")
+        return int(match.group(1)) if match else True
     except Exception as e:
         st.error(f"Error adding row to Google Sheet: {e}")
         logging.error(f"Error in add_followup: {e}", exc_info=True)
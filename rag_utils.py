@@ -1,24 +1,36 @@
 #!/usr/bin/env python3
 
 import os
+import hashlib
 import json
+try: import orjson # Optional: C-accelerated serializer for the per-query profile JSON
+except ImportError: orjson = None
 from dotenv import load_dotenv
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+from collections import OrderedDict
+from typing import Iterator, List, Dict, Any, Optional, Tuple
 import tempfile
+import pickle
+import queue
+import shutil
+import threading
 import time
-import re # For parsing router output
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import boto3
+import faiss
+import httpx
+import numpy as np
+import tiktoken
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
-from tenacity import retry, stop_after_attempt, wait_random_exponential
 
 # LangChain Imports
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS as LCFAISS
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableLambda, RunnableParallel
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.documents import Document
 
@@ -42,6 +54,14 @@ ROUTING_LLM_MODEL = 'gpt-4o-mini'
 logging.info(f"Using Answering LLM: {ANSWERING_LLM_MODEL}, Routing LLM: {ROUTING_LLM_MODEL}")
 
 DEFAULT_TOP_K = 5
+OPENAI_MAX_RETRIES = 2 # Retries (with backoff) done by the OpenAI client itself for every LLM/embedding call
+MAX_SEARCH_BATCH_SIZE = 32 # Max queries coalesced into one FAISS search
+MAX_BATCH_DELAY_MS = float(os.getenv("MAX_BATCH_DELAY_MS", "10")) # How long a search waits for concurrent queries (other sessions) to join it
+CONTEXT_TOKEN_BUDGET = int(os.getenv('RAG_CONTEXT_TOKENS', '3000')) # Max prompt tokens spent on retrieved documents
+RESPONSE_CACHE_MAX_ENTRIES = 512 # do_rag_query answers kept in memory (LRU)
+ROUTER_MIN_SIMILARITY = 0.25 # Embedding router: best store must be at least this similar to the query...
+ROUTER_MIN_MARGIN = 0.03 # ...and this much ahead of the runner-up, else the routing LLM decides
+SEMANTIC_CACHE_THRESHOLD = 0.95 # Cosine similarity above which a previous answer is reused for a reworded query (semantic_cache=True callers only)
 
 # --- Vector Store Definitions ---
 # (Keep VECTOR_STORE_IDS and VECTOR_STORE_DESCRIPTIONS as they were)
@@ -66,62 +86,270 @@ S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
 AWS_REGION = os.getenv("AWS_REGION")
 if not S3_BUCKET_NAME:
     raise ValueError("FATAL: S3_BUCKET_NAME environment variable is not set.")
+# Indexes are kept on local disk (not a temp dir) so FAISS can mmap them where supported (see _load_faiss_mmap),
+# and so restarts skip the S3 download when the ETags still match
+# Optional recall/latency knob for IVF indexes (unset = keep the nprobe stored in the index)
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE")) if os.getenv("FAISS_NPROBE") else None
+# Split cores between web workers so their FAISS OpenMP pools don't oversubscribe the machine. faiss is already
+# imported (OpenMP initialized), so setting OMP_NUM_THREADS here would be ignored: size the pool via the API.
+# An OMP_NUM_THREADS set before startup is honoured as the thread count.
+FAISS_OMP_THREADS = int(os.getenv("OMP_NUM_THREADS") or max(1, (os.cpu_count() or 1) // max(1, int(os.getenv("WEB_WORKERS", "1")))))
+faiss.omp_set_num_threads(FAISS_OMP_THREADS)
+USE_GPU_FAISS = os.getenv("USE_GPU_FAISS") == "1" # Copy indexes to GPU 0 on load when a CUDA build of faiss sees a GPU
+# Large index.faiss files are fetched as parallel byte-range GETs
+S3_TRANSFER_CONFIG = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=8, use_threads=True)
+VECTOR_STORE_CACHE_DIR = os.getenv("VECTOR_STORE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "kandor_vector_stores"))
 
 # --- Global Variables / Caching ---
 # (Keep as is)
 _embedding_model_instance: Optional[OpenAIEmbeddings] = None
 _vector_stores: Dict[str, Optional[LCFAISS]] = {}
-_retriever_cache: Dict[str, VectorStoreRetriever] = {}
+_vector_store_locks: Dict[str, threading.Lock] = {vs_id: threading.Lock() for vs_id in VECTOR_STORE_IDS} # One per store: a query racing the warmer waits instead of loading twice
+_retriever_cache: Dict[Tuple[str, int], VectorStoreRetriever] = {}
+_retriever_cache_lock = threading.Lock()
+_client_init_lock = threading.Lock() # Guards first-time creation of the embedding model and S3 client
 _answering_llm: Optional[ChatOpenAI] = None
 _routing_llm: Optional[ChatOpenAI] = None
+_token_encoding: Optional[tiktoken.Encoding] = None
+_search_queues: Dict[str, "queue.Queue[Tuple[str, Optional[np.ndarray], int, Future]]"] = {} # Per-store queue feeding its micro-batching worker
+_search_queues_lock = threading.Lock()
+# do_rag_query response cache. Exact tier: sha256(scope + query) -> answer. Semantic tier (opt-in, free-form
+# questions only): one normalized query embedding per opted-in entry, matched against entries with the same scope (profile + top_k)
+_response_cache: "OrderedDict[bytes, str]" = OrderedDict()
+_semantic_cache_vectors: Optional[np.ndarray] = None
+_semantic_cache_rows: List[Tuple[bytes, bytes]] = [] # (scope key, exact key) per row of _semantic_cache_vectors
+_response_cache_lock = threading.Lock()
+_router_store_vectors: Optional[np.ndarray] = None # Normalized VECTOR_STORE_DESCRIPTIONS embeddings, rows in VECTOR_STORE_IDS order
+_router_vectors_lock = threading.Lock()
+_gpu_resources = None # faiss.StandardGpuResources, kept alive for as long as GPU indexes exist
+_gpu_search_lock = threading.Lock() # GPU indexes are not thread-safe: one search at a time
+_s3_client = None # botocore S3 client, shared (thread-safe) so loads reuse pooled keep-alive connections
+
+# Shared HTTP/2 keep-alive pools for all OpenAI clients, so each call reuses a warm connection
+_http_limits = httpx.Limits(max_connections=100, max_keepalive_connections=100, keepalive_expiry=60)
+_shared_http_client = httpx.Client(http2=True, limits=_http_limits)
+_shared_async_http_client = httpx.AsyncClient(http2=True, limits=_http_limits)
 
 # --- Initialization Functions ---
 # (Keep get_embedding_model, load_faiss_vector_store, get_faiss_retriever as they were)
 def get_embedding_model() -> OpenAIEmbeddings:
     # ... (no changes needed) ...
     global _embedding_model_instance
-    if _embedding_model_instance is None:
+    if _embedding_model_instance is not None: return _embedding_model_instance
+    with _client_init_lock:
+        if _embedding_model_instance is not None: return _embedding_model_instance
         logging.info(f"Initializing OpenAI Embeddings with model: {EMBEDDING_MODEL}")
-        _embedding_model_instance = OpenAIEmbeddings(model=EMBEDDING_MODEL, openai_api_key=OPENAI_API_KEY)
+        _embedding_model_instance = OpenAIEmbeddings(
+            model=EMBEDDING_MODEL,
+            openai_api_key=OPENAI_API_KEY,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=_shared_http_client,
+            http_async_client=_shared_async_http_client
+        )
     return _embedding_model_instance
 
+def get_s3_client():
+    """Initializes (once) and returns the shared S3 client."""
+    global _s3_client
+    if _s3_client is not None: return _s3_client
+    with _client_init_lock:
+        if _s3_client is not None: return _s3_client
+        logging.info("Initializing shared S3 client")
+        session = boto3.Session(aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"), aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"))
+        client_config = BotoConfig(max_pool_connections=32, tcp_keepalive=True, retries={'mode': 'adaptive', 'max_attempts': 5})
+        _s3_client = session.client('s3', region_name=AWS_REGION or None, config=client_config)
+    return _s3_client
+
 def load_faiss_vector_store(vector_store_id: str) -> LCFAISS:
-    # ... (no changes needed) ...
     global _vector_stores
     if vector_store_id in _vector_stores and _vector_stores[vector_store_id] is not None: return _vector_stores[vector_store_id]
     if vector_store_id not in VECTOR_STORE_IDS: raise ValueError(f"Unknown vector_store_id: {vector_store_id}.")
+    with _vector_store_locks[vector_store_id]:
+        if _vector_stores.get(vector_store_id) is not None: return _vector_stores[vector_store_id] # Loaded while we waited
+        return _load_faiss_vector_store_uncached(vector_store_id)
+
+def _load_faiss_vector_store_uncached(vector_store_id: str) -> LCFAISS:
+    """Fetches (disk cache or S3) and loads one store; callers hold its lock."""
     s3_vector_prefix = VECTOR_STORE_IDS[vector_store_id]
     embeddings = get_embedding_model()
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # ... (S3 download logic remains the same) ...
-        try:
-            s3_client_args = {}
-            if AWS_REGION: s3_client_args['region_name'] = AWS_REGION
-            session = boto3.Session(aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"), aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"))
-            s3_client = session.client('s3', **s3_client_args)
-            local_faiss_path = os.path.join(tmpdir, "index.faiss"); local_pkl_path = os.path.join(tmpdir, "index.pkl")
-            s3_faiss_key = f"{s3_vector_prefix}/index.faiss"; s3_pkl_key = f"{s3_vector_prefix}/index.pkl"
-            logging.info(f"Downloading {s3_faiss_key}..."); s3_client.download_file(S3_BUCKET_NAME, s3_faiss_key, local_faiss_path)
-            logging.info(f"Downloading {s3_pkl_key}..."); s3_client.download_file(S3_BUCKET_NAME, s3_pkl_key, local_pkl_path)
-        except ClientError as e: logging.error(f"S3 Download Error for '{vector_store_id}': {e}", exc_info=True); raise FileNotFoundError(f"FAISS files not found for '{vector_store_id}'.") from e
-        except Exception as e: logging.error(f"Unexpected S3 Error for '{vector_store_id}': {e}", exc_info=True); raise
-        # ... (FAISS load logic remains the same) ...
-        try:
-            vs = LCFAISS.load_local(tmpdir, embeddings, allow_dangerous_deserialization=True)
-            _vector_stores[vector_store_id] = vs
-            logging.info(f"FAISS index '{vector_store_id}' loaded successfully.")
-            return vs
-        except Exception as e: logging.error(f"FAISS Load Error for '{vector_store_id}': {e}", exc_info=True); _vector_stores[vector_store_id] = None; raise
+    store_cache_dir = os.path.join(VECTOR_STORE_CACHE_DIR, s3_vector_prefix)
+    try:
+        s3_client = get_s3_client()
+        s3_faiss_key = f"{s3_vector_prefix}/index.faiss"; s3_pkl_key = f"{s3_vector_prefix}/index.pkl"
+        # Local copies live in <cache>/<prefix>/<faiss etag>_<pkl etag>/, so a cheap HEAD tells us if they're current
+        faiss_etag = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_faiss_key)['ETag'].strip('"')
+        pkl_etag = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_pkl_key)['ETag'].strip('"')
+        local_dir = os.path.join(store_cache_dir, f"{faiss_etag}_{pkl_etag}")
+        if os.path.exists(os.path.join(local_dir, "index.faiss")) and os.path.exists(os.path.join(local_dir, "index.pkl")):
+            logging.info(f"Using disk-cached FAISS files for '{vector_store_id}' ({local_dir}).")
+        else:
+            _download_vector_store_files(s3_client, s3_faiss_key, s3_pkl_key, store_cache_dir, local_dir)
+    except ClientError as e: logging.error(f"S3 Download Error for '{vector_store_id}': {e}", exc_info=True); raise FileNotFoundError(f"FAISS files not found for '{vector_store_id}'.") from e
+    except Exception as e: logging.error(f"Unexpected S3 Error for '{vector_store_id}': {e}", exc_info=True); raise
+    try:
+        vs = _load_faiss_mmap(local_dir, embeddings)
+        _vector_stores[vector_store_id] = vs
+        logging.info(f"FAISS index '{vector_store_id}' loaded successfully from {local_dir}.")
+        return vs
+    except Exception as e: logging.error(f"FAISS Load Error for '{vector_store_id}': {e}", exc_info=True); _vector_stores[vector_store_id] = None; raise
+
+def _download_vector_store_files(s3_client, s3_faiss_key: str, s3_pkl_key: str, store_cache_dir: str, local_dir: str) -> None:
+    """Downloads both index files into a scratch dir and renames it to local_dir, so local_dir is never half-written."""
+    os.makedirs(store_cache_dir, exist_ok=True)
+    download_dir = tempfile.mkdtemp(prefix=".download-", dir=store_cache_dir)
+    try:
+        # Both objects download concurrently, so the total is the slower transfer rather than the sum
+        logging.info(f"Downloading {s3_faiss_key} and {s3_pkl_key}...")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            download_futures = [
+                executor.submit(s3_client.download_file, S3_BUCKET_NAME, s3_key, os.path.join(download_dir, file_name), Config=S3_TRANSFER_CONFIG)
+                for s3_key, file_name in ((s3_faiss_key, "index.faiss"), (s3_pkl_key, "index.pkl"))
+            ]
+            for future in download_futures: future.result() # Re-raises any download error
+        try: os.replace(download_dir, local_dir)
+        except OSError:
+            if not os.path.isdir(local_dir): raise # Otherwise another process finished the same version first
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+    # Drop superseded versions; processes still mapping them keep their (unlinked) pages
+    for entry in os.listdir(store_cache_dir):
+        entry_path = os.path.join(store_cache_dir, entry)
+        if entry_path != local_dir and not entry.startswith(".download-"): shutil.rmtree(entry_path, ignore_errors=True)
+
+def _load_faiss_mmap(folder_path: str, embeddings: OpenAIEmbeddings) -> LCFAISS:
+    """
+    Equivalent of LCFAISS.load_local, memory-mapping the index where faiss supports it so its pages are
+    loaded on demand and shared between processes via the OS page cache:
+    - IVF indexes: IO_FLAG_MMAP maps the inverted lists.
+    - Flat (IndexFlat*) indexes: IO_FLAG_MMAP_IFC maps the codes, on faiss builds that have it.
+    IO_FLAG_MMAP does not map flat codes, so without IO_FLAG_MMAP_IFC they are read into the process heap.
+    """
+    index_path = os.path.join(folder_path, "index.faiss")
+    with open(index_path, "rb") as f: is_ivf = f.read(2) in (b"Iw", b"Iv") # IVF fourccs (IwFl, IwPQ, IwSq, legacy IvFl, ...) start with "Iw"/"Iv"
+    if is_ivf: index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    elif hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        _prefetch_file(index_path) # Flat search touches every page of the mapping
+    else:
+        logging.info(f"faiss {getattr(faiss, '__version__', '?')} can't memory-map flat indexes (no IO_FLAG_MMAP_IFC); reading {index_path} into memory.")
+        index = faiss.read_index(index_path)
+    with open(os.path.join(folder_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f) # Trusted: our own S3 bucket (same as allow_dangerous_deserialization)
+    _tune_faiss_index(index)
+    index.search(np.zeros((1, index.d), dtype=np.float32), 1) # Dummy query: spins up the OpenMP pool before the first real one
+    index = _maybe_move_index_to_gpu(index)
+    return LCFAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def _prefetch_file(path: str) -> None:
+    """Asks the kernel to start reading the whole file into the page cache (async readahead, no-op where unsupported)."""
+    if not hasattr(os, "posix_fadvise"): return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try: os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally: os.close(fd)
+    except OSError as e: logging.warning(f"Could not prefetch {path}: {e}")
+
+def _maybe_move_index_to_gpu(index: faiss.Index) -> faiss.Index:
+    """Returns a GPU copy of the index if USE_GPU_FAISS is set and a GPU is available, else the index unchanged."""
+    global _gpu_resources
+    if not USE_GPU_FAISS: return index
+    if not hasattr(faiss, "get_num_gpus") or faiss.get_num_gpus() == 0:
+        logging.warning("USE_GPU_FAISS=1 but no GPU is visible to faiss (CPU build or no CUDA device); keeping index on CPU.")
+        return index
+    with _gpu_search_lock:
+        if _gpu_resources is None: _gpu_resources = faiss.StandardGpuResources()
+        gpu_index = faiss.index_cpu_to_gpu(_gpu_resources, 0, index)
+    logging.info(f"Moved FAISS index ({index.ntotal} vectors) to GPU 0.")
+    return gpu_index
+
+def _tune_faiss_index(index: faiss.Index) -> None:
+    """For IVF indexes, applies FAISS_NPROBE and lets OpenMP threads split the inverted-list scan of a single query."""
+    if index.metric_type != faiss.METRIC_INNER_PRODUCT:
+        logging.info(f"FAISS index {type(index).__name__} uses L2 distance; rebuilding it as inner product over normalized vectors (e.g. IndexFlatIP) gives the same ranking for OpenAI embeddings.")
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is None: return # Flat indexes: search is one BLAS pass already parallelized by OpenMP
+    ivf_index.parallel_mode = 2
+    if FAISS_NPROBE: ivf_index.nprobe = FAISS_NPROBE
+    logging.info(f"Tuned IVF index: nlist={ivf_index.nlist}, nprobe={ivf_index.nprobe}, parallel_mode=2")
 
 def get_faiss_retriever(vector_store_id: str, k: int = DEFAULT_TOP_K) -> VectorStoreRetriever:
     # ... (no changes needed) ...
     global _retriever_cache
-    cache_key = f"{vector_store_id}_k{k}"
-    if cache_key not in _retriever_cache:
-        logging.info(f"Creating FAISS retriever for '{vector_store_id}', k={k}")
-        vs = load_faiss_vector_store(vector_store_id)
-        _retriever_cache[cache_key] = vs.as_retriever(search_type="similarity", search_kwargs={"k": k})
-    return _retriever_cache[cache_key]
+    cache_key = (vector_store_id, k)
+    retriever = _retriever_cache.get(cache_key)
+    if retriever is not None: return retriever
+    vs = load_faiss_vector_store(vector_store_id) # Outside the lock: this one is per-store and may take a while
+    with _retriever_cache_lock:
+        if cache_key not in _retriever_cache:
+            logging.info(f"Creating FAISS retriever for '{vector_store_id}', k={k}")
+            _retriever_cache[cache_key] = vs.as_retriever(search_type="similarity", search_kwargs={"k": k})
+        return _retriever_cache[cache_key]
+
+def retrieve_documents_batch(
+    vector_store_id: str, queries: List[str], k: int = DEFAULT_TOP_K,
+    query_vectors: Optional[List[Optional[np.ndarray]]] = None
+) -> List[List[Document]]:
+    """
+    Retrieves top-k docs for several queries against one store: a single embeddings request
+    and a single vectorized FAISS search, instead of one retriever.invoke per query.
+    query_vectors: embeddings the caller already has (None entries get embedded here).
+    """
+    if not queries: return []
+    vs = load_faiss_vector_store(vector_store_id)
+    known_vectors = query_vectors or [None] * len(queries)
+    missing = [i for i, vector in enumerate(known_vectors) if vector is None]
+    new_vectors = iter(get_embedding_model().embed_documents([queries[i] for i in missing])) if missing else iter(())
+    query_vectors = np.ascontiguousarray([vector if vector is not None else next(new_vectors) for vector in known_vectors], dtype=np.float32)
+    return _search_faiss(vs, query_vectors, k)
+
+def _search_faiss(vs: LCFAISS, query_vectors: np.ndarray, k: int) -> List[List[Document]]:
+    """Searches the raw FAISS index with pre-computed (nq, d) query embeddings, materializing Documents only for the hits."""
+    query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32).reshape(-1, vs.index.d)
+    # Inner-product stores hold L2-normalized vectors (cosine ranking); normalize queries the same way
+    if vs.index.metric_type == faiss.METRIC_INNER_PRODUCT: faiss.normalize_L2(query_vectors)
+    if _gpu_resources is not None:
+        with _gpu_search_lock: _, indices = vs.index.search(query_vectors, k)
+    else: _, indices = vs.index.search(query_vectors, k)
+    # FAISS pads with -1 when the index holds fewer than k vectors
+    return [[vs.docstore.search(vs.index_to_docstore_id[i]) for i in row if i != -1] for row in indices]
+
+def _batched_search(vector_store_id: str, user_query: str, k: int = DEFAULT_TOP_K, query_vector: Optional[np.ndarray] = None) -> List[Document]:
+    """
+    Retrieves docs for one query via the store's micro-batching worker, which merges queries
+    arriving from concurrent sessions within MAX_BATCH_DELAY_MS into one embedding call + FAISS search.
+    Pass query_vector if the query is already embedded so it isn't embedded again.
+    """
+    if vector_store_id not in VECTOR_STORE_IDS: raise ValueError(f"Unknown vector_store_id: {vector_store_id}.")
+    if MAX_BATCH_DELAY_MS <= 0 and query_vector is not None: # Batching disabled: search inline, no worker hop
+        return _search_faiss(load_faiss_vector_store(vector_store_id), query_vector, k)[0]
+    with _search_queues_lock:
+        search_queue = _search_queues.get(vector_store_id)
+        if search_queue is None:
+            search_queue = _search_queues[vector_store_id] = queue.Queue()
+            threading.Thread(target=_search_batch_worker, args=(vector_store_id, search_queue), name=f"faiss-batcher-{vector_store_id}", daemon=True).start()
+    result_future: Future = Future()
+    search_queue.put((user_query, query_vector, k, result_future))
+    return result_future.result() # Re-raises retrieval errors (e.g. FileNotFoundError) in the caller
+
+def _search_batch_worker(vector_store_id: str, search_queue: "queue.Queue[Tuple[str, Optional[np.ndarray], int, Future]]") -> None:
+    """Runs forever: collects a batch of pending searches for one store and answers them together."""
+    while True:
+        batch = [search_queue.get()] # Block until there's work
+        deadline = time.monotonic() + MAX_BATCH_DELAY_MS / 1000
+        while len(batch) < MAX_SEARCH_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: break
+            try: batch.append(search_queue.get(timeout=remaining))
+            except queue.Empty: break
+        max_k = max(k for _, _, k, _ in batch)
+        try:
+            docs_per_query = retrieve_documents_batch(
+                vector_store_id, [user_query for user_query, _, _, _ in batch], k=max_k,
+                query_vectors=[query_vector for _, query_vector, _, _ in batch]
+            )
+            for (_, _, k, result_future), docs in zip(batch, docs_per_query): result_future.set_result(docs[:k])
+        except Exception as e:
+            for _, _, _, result_future in batch: result_future.set_exception(e)
 
 # Updated get_llm to handle potentially different timeout/settings for gpt-4o
 def get_llm(model_name: str) -> ChatOpenAI:
@@ -137,7 +365,10 @@ def get_llm(model_name: str) -> ChatOpenAI:
                 model_name=model_name,
                 temperature=0.2, # Slightly lower temp for more factual focus
                 openai_api_key=OPENAI_API_KEY,
-                request_timeout=request_timeout
+                request_timeout=request_timeout,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=_shared_http_client,
+                http_async_client=_shared_async_http_client
             )
         return _answering_llm
     elif model_name == ROUTING_LLM_MODEL:
@@ -147,7 +378,10 @@ def get_llm(model_name: str) -> ChatOpenAI:
                 model_name=model_name,
                 temperature=0.0,
                 openai_api_key=OPENAI_API_KEY,
-                request_timeout=45
+                request_timeout=45,
+                max_retries=OPENAI_MAX_RETRIES,
+                http_client=_shared_http_client,
+                http_async_client=_shared_async_http_client
             )
          return _routing_llm
     else:
@@ -155,26 +389,55 @@ def get_llm(model_name: str) -> ChatOpenAI:
          return get_llm(ANSWERING_LLM_MODEL)
 
 
-# --- LLM Router ---
-# (Keep route_query_to_store as is - uses ROUTING_LLM_MODEL)
-@retry(stop=stop_after_attempt(2), wait=wait_random_exponential(multiplier=1, max=10))
-def route_query_to_store(user_query: str) -> Optional[str]:
-    # ... (no changes needed) ...
-    routing_llm = get_llm(ROUTING_LLM_MODEL)
-    descriptions_str = ""; valid_keys = list(VECTOR_STORE_IDS.keys())
-    for key in valid_keys: descriptions_str += f"- {key}: {VECTOR_STORE_DESCRIPTIONS.get(key, 'No description')}\n"
-    prompt = ChatPromptTemplate.from_messages([("system", "..."), ("human", "{query}")]) # Keep prompt structure
-    # Simplified prompt content for brevity
-    system_prompt = (
-        "You are an expert query router for a study abroad knowledge base. "
-        "Your task is to determine the single most relevant knowledge base for a given user query. "
-        "Choose from the following available knowledge base IDs:\n\n"
-        f"{descriptions_str}\n"
-        f"Based on the user's query, identify the knowledge base ID from the list above that is most likely to contain the answer. "
-        f"Respond ONLY with the chosen knowledge base ID (e.g., '{valid_keys[0]}', '{valid_keys[1]}') and nothing else."
-    )
-    prompt = ChatPromptTemplate.from_messages([("system", system_prompt), ("human", "{query}")])
-    chain = prompt | routing_llm | StrOutputParser()
+# --- Router ---
+# Static across the process lifetime, so the routing prompt is built once at import
+_ROUTER_KEYS = list(VECTOR_STORE_IDS.keys())
+_ROUTER_DESCRIPTIONS_STR = "".join(f"- {key}: {VECTOR_STORE_DESCRIPTIONS.get(key, 'No description')}\n" for key in _ROUTER_KEYS)
+_ROUTER_SYSTEM_PROMPT = (
+    "You are an expert query router for a study abroad knowledge base. "
+    "Your task is to determine the single most relevant knowledge base for a given user query. "
+    "Choose from the following available knowledge base IDs:\n\n"
+    f"{_ROUTER_DESCRIPTIONS_STR}\n"
+    f"Based on the user's query, identify the knowledge base ID from the list above that is most likely to contain the answer. "
+    f"Respond ONLY with the chosen knowledge base ID (e.g., '{_ROUTER_KEYS[0]}', '{_ROUTER_KEYS[1]}') and nothing else."
+)
+_ROUTER_PROMPT = ChatPromptTemplate.from_messages([("system", _ROUTER_SYSTEM_PROMPT), ("human", "{query}")])
+_router_chain = None # _ROUTER_PROMPT | routing LLM | parser, built on first LLM-routed query
+
+def _get_router_store_vectors() -> np.ndarray:
+    """Embeds the store descriptions once (one API call) and returns them L2-normalized."""
+    global _router_store_vectors
+    with _router_vectors_lock:
+        if _router_store_vectors is None:
+            vectors = np.asarray(get_embedding_model().embed_documents([VECTOR_STORE_DESCRIPTIONS[key] for key in VECTOR_STORE_IDS]), dtype=np.float32)
+            _router_store_vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return _router_store_vectors
+
+def route_query_to_store(user_query: str, query_vector: Optional[np.ndarray] = None) -> Optional[str]:
+    """
+    Picks the vector store for a query by cosine similarity between the query embedding and the
+    store descriptions; only ambiguous queries (low similarity or close runner-up) go to the routing LLM.
+    query_vector: the query's normalized embedding if the caller already has it.
+    """
+    try:
+        if query_vector is None: query_vector = _embed_query_normalized(user_query)
+        if query_vector is not None:
+            similarities = _get_router_store_vectors() @ query_vector
+            best, runner_up = np.argsort(similarities)[::-1][:2]
+            if similarities[best] >= ROUTER_MIN_SIMILARITY and similarities[best] - similarities[runner_up] >= ROUTER_MIN_MARGIN:
+                chosen_key = list(VECTOR_STORE_IDS)[best]
+                logging.info(f"Routing decision (embedding, cosine {similarities[best]:.3f}): Chose key '{chosen_key}' for query: '{user_query}'")
+                return chosen_key
+            logging.info(f"Embedding router ambiguous (best {similarities[best]:.3f}, runner-up {similarities[runner_up]:.3f}); asking routing LLM.")
+    except Exception as e: logging.warning(f"Embedding router failed, falling back to routing LLM: {e}")
+    return _route_query_with_llm(user_query)
+
+# Transient API errors are retried by the OpenAI client (OPENAI_MAX_RETRIES), same as the answering call
+def _route_query_with_llm(user_query: str) -> Optional[str]:
+    """Asks the routing LLM which knowledge base fits the query (fallback for the embedding router)."""
+    global _router_chain
+    if _router_chain is None: _router_chain = _ROUTER_PROMPT | get_llm(ROUTING_LLM_MODEL) | StrOutputParser()
+    chain = _router_chain
     logging.info(f"Routing query: '{user_query}'")
     try:
         llm_response = chain.invoke({"query": user_query})
@@ -190,53 +453,60 @@ def route_query_to_store(user_query: str) -> Optional[str]:
 
 # --- RAG Query Logic ---
 
-# (Keep format_retrieved_docs as is)
-def format_retrieved_docs(docs: List[Document]) -> str:
-    # ... (no changes needed) ...
+def get_token_encoding() -> tiktoken.Encoding:
+    """Returns the (cached) tiktoken encoding matching the answering LLM."""
+    global _token_encoding
+    if _token_encoding is None:
+        try: _token_encoding = tiktoken.encoding_for_model(ANSWERING_LLM_MODEL)
+        except KeyError: _token_encoding = tiktoken.get_encoding("o200k_base") # Unknown model name, use gpt-4o's encoding
+    return _token_encoding
+
+def _truncate_to_token_budget(text: str, budget_tokens: int) -> str:
+    """Cuts text down to budget_tokens, preferring to stop at a paragraph boundary."""
+    encoding = get_token_encoding()
+    kept_paragraphs = []; used_tokens = 0
+    for paragraph in text.split("\n\n"):
+        paragraph_tokens = len(encoding.encode(paragraph)) + 1 # +1 for the separator
+        if used_tokens + paragraph_tokens > budget_tokens: break
+        kept_paragraphs.append(paragraph); used_tokens += paragraph_tokens
+    if kept_paragraphs: return "\n\n".join(kept_paragraphs)
+    # First paragraph alone is over budget: hard cut on tokens
+    return encoding.decode(encoding.encode(text)[:budget_tokens])
+
+SOURCE_ID_KEYS = ('university_id', 'profession_id', 'course_id', 'serial_no', 'source_file') # Metadata keys tried, in order, to label a doc's source
+
+def format_retrieved_docs(docs: List[Document], budget_tokens: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Formats retrieved docs for the answering prompt within a token budget. Each doc gets a fair
+    share of what is left (remaining // docs still to place), so one long doc can't crowd out
+    the rest; short docs hand their unused share on to later ones.
+    """
     formatted_strings = []
     if not docs: return "No relevant documents found in the specified knowledge base."
+    encoding = get_token_encoding()
+    remaining_tokens = budget_tokens; truncated_count = 0
     for i, doc in enumerate(docs):
         content = doc.metadata.get("blurb_text", doc.page_content)
-        source_id_keys = ['university_id', 'profession_id', 'course_id', 'serial_no', 'source_file']
-        source_id = next((f"{key}: {doc.metadata[key]}" for key in source_id_keys if key in doc.metadata and doc.metadata[key]), f"source: {doc.metadata.get('source_file', 'N/A')}")
-        formatted_strings.append(f"--- Document {i+1} ---\nSource Info: {source_id}\n\nContent Chunk:\n{content}\n--- End Document {i+1} ---")
+        metadata = doc.metadata
+        source_id = next((f"{key}: {metadata[key]}" for key in SOURCE_ID_KEYS if metadata.get(key)), "source: N/A")
+        header = f"--- Document {i+1} ---\nSource Info: {source_id}\n\nContent Chunk:\n"
+        footer = f"\n--- End Document {i+1} ---"
+        overhead_tokens = len(encoding.encode(header + footer))
+        content_budget = remaining_tokens // (len(docs) - i) - overhead_tokens
+        if content_budget <= 0: logging.info(f"Context token budget ({budget_tokens}) exhausted; dropped {len(docs) - i} document(s)."); break
+        content_tokens = len(encoding.encode(content))
+        if content_tokens > content_budget:
+            content_snippet = _truncate_to_token_budget(content, content_budget); truncated_count += 1
+            content_tokens = len(encoding.encode(content_snippet))
+        else: content_snippet = content
+        formatted_strings.append(f"{header}{content_snippet}{footer}")
+        remaining_tokens -= overhead_tokens + content_tokens
+    if truncated_count: logging.info(f"Truncated {truncated_count} of {len(docs)} document(s) to fit the {budget_tokens}-token context budget.")
     return "\n\n".join(formatted_strings)
 
 
-def do_rag_query(
-    user_query: str,
-    user_profile: Optional[Dict[str, Any]] = None, # MUST contain data like highestLevel, DreamCountry etc.
-    top_k: int = DEFAULT_TOP_K,
-) -> str:
-    """
-    Performs RAG using specific FAISS stores selected by an LLM router.
-    Uses potentially enhanced LLM and prompt for answering.
-    """
-    try:
-        # Use the potentially updated ANSWERING_LLM_MODEL (e.g., gpt-4o)
-        answering_llm = get_llm(ANSWERING_LLM_MODEL)
-
-        # --- Routing Step --- (No changes needed) ---
-        routing_start_time = time.time()
-        chosen_vector_store_id = route_query_to_store(user_query)
-        routing_end_time = time.time(); logging.info(f"Routing took {routing_end_time - routing_start_time:.2f} seconds.")
-        if not chosen_vector_store_id: return "Sorry, I could not determine the relevant knowledge base for your query."
-
-        # --- Retrieval Step --- (No changes needed) ---
-        retrieval_start_time = time.time()
-        logging.info(f"Retrieval phase: Retrieving top {top_k} documents from store '{chosen_vector_store_id}'")
-        retriever = get_faiss_retriever(vector_store_id=chosen_vector_store_id, k=top_k)
-        try: final_docs = retriever.invoke(user_query)
-        except FileNotFoundError: return f"Error: The knowledge base '{chosen_vector_store_id}' is currently unavailable."
-        except Exception as e: logging.error(f"Error retrieving documents from store '{chosen_vector_store_id}': {e}", exc_info=True); return f"Error: Could not retrieve information from the '{chosen_vector_store_id}' knowledge base."
-        retrieval_end_time = time.time(); logging.info(f"Retrieved {len(final_docs)} documents from '{chosen_vector_store_id}' in {retrieval_end_time - retrieval_start_time:.2f} seconds.")
-
-        # --- Formatting & LLM Call Step ---
-        logging.info(f"Formatting {len(final_docs)} final documents for LLM.")
-        context_str = format_retrieved_docs(final_docs)
-
-        # === ENHANCED Answering Prompt Template ===
-        template = """
+# === ENHANCED Answering Prompt Template ===
+ANSWER_PROMPT_TEMPLATE = """
 You are an expert AI counselor providing study-abroad guidance. Your goal is to answer the user's query accurately and relevantly based *only* on the provided context documents and the user's profile.
 
 **CRITICAL INSTRUCTIONS:**
@@ -257,34 +527,232 @@ Retrieved Context Documents:
 User Query: {question}
 
 Answer:
-        """.strip()
-        prompt_template = ChatPromptTemplate.from_template(template)
+""".strip()
+_ANSWER_PROMPT = ChatPromptTemplate.from_template(ANSWER_PROMPT_TEMPLATE) # Parsed once; only the variables change per query
+_generation_chain = None # _ANSWER_PROMPT | answering LLM | parser, see get_generation_chain
+
+def get_generation_chain():
+    """Returns the (cached) answering chain, built on first use so the LLM client stays lazily initialized."""
+    global _generation_chain
+    if _generation_chain is None: _generation_chain = _ANSWER_PROMPT | get_llm(ANSWERING_LLM_MODEL) | StrOutputParser()
+    return _generation_chain
+
+def _serialize_user_profile(user_profile: Optional[Dict[str, Any]]) -> str:
+    # orjson without indent: the LLM does not need pretty-printed JSON and this runs on every query
+    if orjson is None: return json.dumps(user_profile or {}, sort_keys=True, separators=(",", ":"), default=str)
+    return orjson.dumps(user_profile or {}, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS, default=str).decode()
+
+def _build_answer_inputs(user_query: str, context_str: str, user_profile_str: str) -> Dict[str, str]:
+    """Prepares the ANSWER_PROMPT_TEMPLATE inputs for one query."""
+    return {"context": context_str, "question": user_query, "user_profile_json": user_profile_str}
+
+# --- Response Cache ---
+def _get_cached_response(exact_key: bytes, scope_key: bytes, query_vector: Optional[np.ndarray]) -> Optional[str]:
+    """Exact-match lookup first, then (if query_vector given) the closest same-scope semantic match."""
+    with _response_cache_lock:
+        if exact_key in _response_cache:
+            _response_cache.move_to_end(exact_key)
+            return _response_cache[exact_key]
+        if query_vector is None or _semantic_cache_vectors is None: return None
+        similarities = _semantic_cache_vectors @ query_vector
+        for row in np.argsort(similarities)[::-1]:
+            if similarities[row] < SEMANTIC_CACHE_THRESHOLD: break
+            row_scope_key, row_exact_key = _semantic_cache_rows[row]
+            if row_scope_key == scope_key:
+                _response_cache.move_to_end(row_exact_key)
+                logging.info(f"Semantic cache hit (cosine {similarities[row]:.3f}).")
+                return _response_cache[row_exact_key]
+    return None
+
+def _cache_response(exact_key: bytes, scope_key: bytes, query_vector: Optional[np.ndarray], response: str) -> None:
+    global _semantic_cache_vectors
+    with _response_cache_lock:
+        _response_cache[exact_key] = response
+        _response_cache.move_to_end(exact_key)
+        if query_vector is not None:
+            new_row = query_vector[np.newaxis, :]
+            _semantic_cache_vectors = new_row if _semantic_cache_vectors is None else np.vstack([_semantic_cache_vectors, new_row])
+            _semantic_cache_rows.append((scope_key, exact_key))
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            evicted_key, _ = _response_cache.popitem(last=False)
+            stale_rows = [row for row, (_, row_exact_key) in enumerate(_semantic_cache_rows) if row_exact_key == evicted_key]
+            if stale_rows:
+                _semantic_cache_vectors = np.delete(_semantic_cache_vectors, stale_rows, axis=0)
+                for row in reversed(stale_rows): del _semantic_cache_rows[row]
+                if not _semantic_cache_rows: _semantic_cache_vectors = None
+
+def _embed_query_normalized(user_query: str) -> Optional[np.ndarray]:
+    """Unit-length query embedding (semantic cache + router); None if embedding fails."""
+    try:
+        vector = np.asarray(get_embedding_model().embed_query(user_query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+    except Exception as e:
+        logging.warning(f"Could not embed query for semantic cache lookup: {e}")
+        return None
 
-        user_profile_str = json.dumps(user_profile or {}, indent=2, default=str)
+# do_rag_query reports failures as answer text starting with one of these (the answering LLM's own text never does)
+RAG_FAILURE_PREFIXES = ("Error: ", "Sorry, I could not determine the relevant knowledge base", "Sorry, an unexpected error occurred")
 
-        # Prepare inputs for the prompt
-        prompt_inputs = {
-            "context": context_str,
-            "question": user_query,
-            "user_profile_json": user_profile_str
-        }
+def is_rag_failure(answer: Optional[str]) -> bool:
+    """True if a do_rag_query/do_rag_query_batch answer is one of its failure messages (so it shouldn't be cached)."""
+    return bool(answer) and answer.startswith(RAG_FAILURE_PREFIXES)
 
-        # Build and invoke the generation part of the chain
-        generation_chain = prompt_template | answering_llm | StrOutputParser()
+def _embed_queries_normalized(user_queries: List[str]) -> List[Optional[np.ndarray]]:
+    """_embed_query_normalized for several queries in one embeddings request; all None if embedding fails."""
+    try:
+        vectors = np.asarray(get_embedding_model().embed_documents(user_queries), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True); norms[norms == 0] = 1.0
+        return list(vectors / norms)
+    except Exception as e:
+        logging.warning(f"Could not embed batched queries: {e}")
+        return [None] * len(user_queries)
 
-        logging.info(f"Invoking Answering LLM ({ANSWERING_LLM_MODEL}) with formatted context...")
+def do_rag_query(
+    user_query: str,
+    user_profile: Optional[Dict[str, Any]] = None, # MUST contain data like highestLevel, DreamCountry etc.
+    top_k: int = DEFAULT_TOP_K,
+    semantic_cache: bool = False,
+) -> str:
+    """
+    Performs RAG using specific FAISS stores selected by an LLM router.
+    Uses potentially enhanced LLM and prompt for answering.
+    Blocking wrapper around do_rag_query_stream; returns the full answer (or an error message).
+    """
+    return "".join(do_rag_query_stream(user_query, user_profile, top_k, semantic_cache=semantic_cache))
+
+
+def do_rag_query_stream(
+    user_query: str,
+    user_profile: Optional[Dict[str, Any]] = None,
+    top_k: int = DEFAULT_TOP_K,
+    semantic_cache: bool = False,
+) -> Iterator[str]:
+    """
+    Streaming do_rag_query: yields answer chunks as the LLM produces them (use with st.write_stream).
+    Cached answers and error messages are yielded as a single chunk.
+    semantic_cache=True also reuses answers to near-identical (reworded) questions. Only for free-form user
+    questions: templated queries that differ by an entity name (university, notes, ...) embed almost
+    identically, so they must stay on the exact-match tier.
+    """
+    try:
+        # --- Response Cache (exact, then semantic) ---
+        user_profile_str = _serialize_user_profile(user_profile)
+        scope_key = hashlib.sha256(f"{top_k}\x00{user_profile_str}".encode()).digest()
+        exact_key = hashlib.sha256(scope_key + user_query.encode()).digest()
+        cached_response = _get_cached_response(exact_key, scope_key, None)
+        if cached_response is not None: logging.info("Exact-match response cache hit."); yield cached_response; return
+        query_vector = _embed_query_normalized(user_query)
+        semantic_vector = query_vector if semantic_cache else None # Looked up / indexed only for opted-in callers
+        if semantic_vector is not None:
+            cached_response = _get_cached_response(exact_key, scope_key, semantic_vector)
+            if cached_response is not None: yield cached_response; return
+
+        # --- Routing Step --- (No changes needed) ---
+        routing_start_time = time.time()
+        chosen_vector_store_id = route_query_to_store(user_query, query_vector)
+        routing_end_time = time.time(); logging.info(f"Routing took {routing_end_time - routing_start_time:.2f} seconds.")
+        if not chosen_vector_store_id: yield "Sorry, I could not determine the relevant knowledge base for your query."; return
+
+        # --- Retrieval Step (micro-batched with concurrent sessions) ---
+        retrieval_start_time = time.time()
+        logging.info(f"Retrieval phase: Retrieving top {top_k} documents from store '{chosen_vector_store_id}'")
+        # Reuses the embedding computed for cache lookup/routing: no second embeddings round-trip
+        try: final_docs = _batched_search(chosen_vector_store_id, user_query, top_k, query_vector)
+        except FileNotFoundError: yield f"Error: The knowledge base '{chosen_vector_store_id}' is currently unavailable."; return
+        except Exception as e: logging.error(f"Error retrieving documents from store '{chosen_vector_store_id}': {e}", exc_info=True); yield f"Error: Could not retrieve information from the '{chosen_vector_store_id}' knowledge base."; return
+        retrieval_end_time = time.time(); logging.info(f"Retrieved {len(final_docs)} documents from '{chosen_vector_store_id}' in {retrieval_end_time - retrieval_start_time:.2f} seconds.")
+
+        # --- Formatting & LLM Call Step ---
+        logging.info(f"Formatting {len(final_docs)} final documents for LLM.")
+        context_str = format_retrieved_docs(final_docs)
+
+        prompt_inputs = _build_answer_inputs(user_query, context_str, user_profile_str)
+        generation_chain = get_generation_chain()
+
+        logging.info(f"Streaming Answering LLM ({ANSWERING_LLM_MODEL}) with formatted context...")
         llm_start_time = time.time()
-        response = generation_chain.invoke(prompt_inputs)
+        response_chunks = []
+        for chunk in generation_chain.stream(prompt_inputs):
+            if not response_chunks: logging.info(f"First answer token after {time.time() - llm_start_time:.2f} seconds.")
+            response_chunks.append(chunk)
+            yield chunk
         llm_end_time = time.time()
         logging.info(f"LLM invocation successful in {llm_end_time - llm_start_time:.2f} seconds.")
 
-        return response
+        _cache_response(exact_key, scope_key, semantic_vector, "".join(response_chunks))
 
     except (FileNotFoundError, PermissionError, ConnectionError) as e:
         # Catch errors related to loading vector stores if they weren't caught earlier
         logging.error(f"Failed RAG setup/connection: {e}", exc_info=True)
-        return f"Error: Could not load/access required knowledge base files. Details: {e}"
+        yield f"Error: Could not load/access required knowledge base files. Details: {e}"
     except Exception as e:
         logging.error(f"An unexpected error occurred during RAG query execution: {e}", exc_info=True)
-        return f"Sorry, an unexpected error occurred processing your request. Details: {e}"
+        yield f"Sorry, an unexpected error occurred processing your request. Details: {e}"
+
 
+def do_rag_query_batch(
+    user_queries: List[str],
+    user_profile: Optional[Dict[str, Any]] = None,
+    top_k: int = DEFAULT_TOP_K,
+) -> List[str]:
+    """
+    Batched do_rag_query for several queries about the same user profile. Queries routed to the
+    same store share one embedding call + FAISS search, and the answering LLM calls run
+    concurrently via chain.batch. Returns answers in input order (error strings on failure, like do_rag_query).
+    """
+    answers: List[str] = [""] * len(user_queries)
+    try:
+        query_vectors = _embed_queries_normalized(user_queries) # One embeddings request, reused for routing and retrieval
+        queries_by_store: Dict[str, List[int]] = {}
+        for idx, (user_query, query_vector) in enumerate(zip(user_queries, query_vectors)):
+            chosen_vector_store_id = route_query_to_store(user_query, query_vector)
+            if not chosen_vector_store_id: answers[idx] = "Sorry, I could not determine the relevant knowledge base for your query."
+            else: queries_by_store.setdefault(chosen_vector_store_id, []).append(idx)
+
+        user_profile_str = _serialize_user_profile(user_profile)
+        pending_indices: List[int] = []; prompt_inputs_list: List[Dict[str, str]] = []
+        for vector_store_id, query_indices in queries_by_store.items():
+            retrieval_start_time = time.time()
+            try: docs_per_query = retrieve_documents_batch(vector_store_id, [user_queries[i] for i in query_indices], k=top_k, query_vectors=[query_vectors[i] for i in query_indices])
+            except FileNotFoundError:
+                for i in query_indices: answers[i] = f"Error: The knowledge base '{vector_store_id}' is currently unavailable."
+                continue
+            except Exception as e:
+                logging.error(f"Error batch-retrieving documents from store '{vector_store_id}': {e}", exc_info=True)
+                for i in query_indices: answers[i] = f"Error: Could not retrieve information from the '{vector_store_id}' knowledge base."
+                continue
+            logging.info(f"Batch-retrieved documents for {len(query_indices)} queries from '{vector_store_id}' in {time.time() - retrieval_start_time:.2f} seconds.")
+            for i, docs in zip(query_indices, docs_per_query):
+                pending_indices.append(i)
+                prompt_inputs_list.append(_build_answer_inputs(user_queries[i], format_retrieved_docs(docs), user_profile_str))
+
+        if prompt_inputs_list:
+            generation_chain = get_generation_chain()
+            llm_start_time = time.time()
+            responses = generation_chain.batch(prompt_inputs_list, return_exceptions=True)
+            logging.info(f"Batch LLM invocation for {len(prompt_inputs_list)} queries finished in {time.time() - llm_start_time:.2f} seconds.")
+            for i, response in zip(pending_indices, responses):
+                if isinstance(response, Exception):
+                    logging.error(f"Answering LLM failed for batched query '{user_queries[i]}': {response}")
+                    answers[i] = f"Sorry, an unexpected error occurred processing your request. Details: {response}"
+                else: answers[i] = response
+        return answers
+
+    except Exception as e:
+        logging.error(f"An unexpected error occurred during batched RAG query execution: {e}", exc_info=True)
+        return [answer or f"Sorry, an unexpected error occurred processing your request. Details: {e}" for answer in answers]
+
+
+# --- Startup Prefetch ---
+def _warm_all_stores() -> None:
+    """Loads every vector store concurrently so the first query per store doesn't pay the S3/FAISS load."""
+    start_time = time.time()
+    def _warm_one(vector_store_id: str) -> None:
+        try: load_faiss_vector_store(vector_store_id)
+        except Exception as e: logging.warning(f"Background prefetch of vector store '{vector_store_id}' failed (will retry on first query): {e}")
+    with ThreadPoolExecutor(max_workers=len(VECTOR_STORE_IDS)) as executor:
+        list(executor.map(_warm_one, VECTOR_STORE_IDS.keys()))
+    logging.info(f"Vector store prefetch finished in {time.time() - start_time:.2f} seconds.")
+
+if os.getenv("WARM_VECTOR_STORES") == "1": # Opt-in: set WARM_VECTOR_STORES=1 in the deployment env
+    threading.Thread(target=_warm_all_stores, name="vector-store-prefetch", daemon=True).start()
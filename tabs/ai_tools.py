@@ -2,21 +2,280 @@
 
 import streamlit as st
 import logging
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import numpy as np
+import pandas as pd
 
 # --- Import Core Logic ---
 try:
     from db_connection import get_aitools_profile_users
-    from rag_utils import do_rag_query # Assuming RAG is needed for suggestions
+    from rag_utils import do_rag_query, is_rag_failure # Assuming RAG is needed for suggestions
 except ImportError as e:
     st.error(f"(AI Tools Tab) Failed to import required modules: {e}. Check file structure.")
     logging.error(f"(AI Tools Tab) Module import error: {e}", exc_info=True)
     st.write("Error: Core modules not found. Tab cannot function.")
     st.stop()
 
+# --- Cached RAG Suggestions ---
+# A suggestion only depends on a small slice of the profile (not the user), so users sharing a slice
+# share one RAG call. st.cache_data in front of a SQLite file (like the Shortlist tab's), so restarts and
+# other workers keep the hit rate; both tiers expire so knowledge-base updates show up within a day.
+RAG_SUGGESTION_TOP_K = 2
+SUGGESTION_SNIPPET_CHARS = 200
+RAG_MEMORY_CACHE_TTL_S = 3600
+RAG_DISK_CACHE_TTL_S = 86400
+RAG_CACHE_PATH = os.getenv("AITOOLS_RAG_CACHE_PATH", os.path.join(".cache", "aitools_rag_cache.sqlite"))
+_rag_disk_cache = None
+_rag_disk_cache_lock = threading.Lock()
+_rag_stats = {"lookups": 0, "disk_hits": 0, "rag_calls": 0}
+_rag_stats_lock = threading.Lock()
+
+def _get_rag_disk_cache() -> sqlite3.Connection:
+    global _rag_disk_cache
+    if _rag_disk_cache is None:
+        os.makedirs(os.path.dirname(RAG_CACHE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(RAG_CACHE_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL") # Safe to share between WEB_WORKERS processes
+        conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, ts INTEGER)")
+        conn.commit()
+        _rag_disk_cache = conn
+    return _rag_disk_cache
+
+def _rag_disk_cache_get(key: str) -> Optional[str]:
+    try:
+        with _rag_disk_cache_lock:
+            row = _get_rag_disk_cache().execute("SELECT value FROM kv WHERE key = ? AND ts > ?", (key, int(time.time()) - RAG_DISK_CACHE_TTL_S)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logging.warning(f"AI Tools RAG disk cache read failed: {e}")
+        return None
+
+def _rag_disk_cache_put(key: str, value: str) -> None:
+    try:
+        with _rag_disk_cache_lock:
+            conn = _get_rag_disk_cache()
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, ts) VALUES (?, ?, ?)", (key, value, int(time.time())))
+            conn.commit()
+    except sqlite3.Error as e:
+        logging.warning(f"Could not persist AI Tools RAG suggestion: {e}")
+
+def _count_rag_stat(name: str) -> None:
+    with _rag_stats_lock: _rag_stats[name] += 1
+
+@st.cache_data(ttl=RAG_MEMORY_CACHE_TTL_S, max_entries=2048, show_spinner=False)
+def _cached_rag(kind: str, career_key, level_key, category_key, subcat_key, top_k: int, _career, _level, _category, _subcat) -> str:
+    """
+    Returns the RAG suggestion snippet for a profile slice (kind: 'career' or 'subject'), or "" if the
+    knowledge base had nothing. Keyed on the normalized *_key args only; the underscore args are the raw
+    values the prompt is built from (first caller's spelling). Raises on RAG failure, so errors are never cached.
+    """
+    career, level, category, subcat = _career, _level, _category, _subcat
+    disk_key = hashlib.sha1(repr((kind, career_key, level_key, category_key, subcat_key, top_k)).encode("utf-8")).hexdigest()
+    cached = _rag_disk_cache_get(disk_key)
+    if cached is not None:
+        _count_rag_stat("disk_hits")
+        return cached
+
+    if kind == "career":
+        rag_query = f"What are some good countries and general course types for a career as a {career}, considering someone looking for {level or 'any level'} education?"
+    else:
+        rag_query = f"What are typical career paths and good study destinations for {subcat or category} (field: {category}) at the {level or 'any'} level?"
+    rag_context_profile = { # Only the keyed fields, so a cached answer never carries another user's details
+        "aitools_category": category, "aitools_subCategory": subcat,
+        "aitools_career": career, "aitools_highestLevel": level,
+    }
+    suggestions = do_rag_query(user_query=rag_query, user_profile=rag_context_profile, top_k=top_k)
+    if is_rag_failure(suggestions): raise RuntimeError(suggestions) # Not cached; retried on the next request
+    # Messages only show the first SUGGESTION_SNIPPET_CHARS, so only that much is kept in memory and on disk
+    suggestions = "" if "not available" in suggestions.lower() else suggestions[:SUGGESTION_SNIPPET_CHARS]
+    _count_rag_stat("rag_calls")
+    _rag_disk_cache_put(disk_key, suggestions)
+    return suggestions
+
+def _normalize_slice_value(value):
+    """
+    Cache-key form of a slice value: folds case and whitespace/separator runs so near-identical spellings
+    ('Computer  Science', 'computer-science') share a key. Other punctuation is kept ('C++', 'C#', '.NET' stay distinct).
+    """
+    if value is None: return None
+    return re.sub(r"[\s\-_/,]+", " ", str(value).casefold()).strip() or None
+
+def get_rag_suggestion(kind: str, career, level, category, subcat) -> str:
+    """Cached RAG suggestion for a profile slice: keyed on the normalized values, asked with the raw ones (see _cached_rag)."""
+    raw_values = (career, level, category, subcat)
+    suggestion = _cached_rag(kind, *(_normalize_slice_value(v) for v in raw_values), RAG_SUGGESTION_TOP_K, *raw_values)
+    _count_rag_stat("lookups")
+    return suggestion
+
+def _normalize_rag_job(job: tuple) -> tuple:
+    """Cache key of a get_rag_suggestion job, so jobs sharing a key are deduplicated."""
+    kind, *slice_values = job
+    return (kind, *(_normalize_slice_value(v) for v in slice_values))
+
+def get_rag_cache_stats() -> dict:
+    """Hit/miss counts across the memory and disk tiers (this process). RAG calls are actual do_rag_query calls."""
+    with _rag_stats_lock: stats = dict(_rag_stats)
+    return {"memory_hits": stats["lookups"] - stats["disk_hits"] - stats["rag_calls"], "disk_hits": stats["disk_hits"], "rag_calls": stats["rag_calls"]}
+
+# Only the RAG suggestions are network-bound (bulk "Generate for all" fetches its distinct ones concurrently);
+# template-only message generation is instant and runs inline
+_RAG_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="aitools-rag")
+
+# Profile fields shown in the details panel, in display order
+_DISPLAY_LABELS = {
+    'category': 'Category', 'subCategory': 'Sub Category', 'selectedPlan': 'Budget Plan', 'career': 'Career',
+    'countries': 'Countries', 'highestLevel': 'Highest Level', 'course': 'Course',
+}
+
+# --- User List Loading ---
+LOW_CARDINALITY_FIELDS = ('category', 'subCategory', 'countries', 'highestLevel', 'selectedPlan') # Few distinct values shared by many users
+
+@st.cache_resource(ttl=600, show_spinner=False) # One shared, read-only copy for every session: no per-rerun unpickling
+def _load_aitools_users() -> tuple[pd.DataFrame, dict, dict]:
+    """
+    Loads the AI Tools users once as a userid-indexed DataFrame, plus the radio label -> userid map
+    and userid -> radio index map (restores the selection without scanning the list).
+    """
+    users_list = get_aitools_profile_users()
+    if not users_list: return pd.DataFrame(), {}, {}
+    for user in users_list: # Intern repeated values so rows share one string object
+        for field in LOW_CARDINALITY_FIELDS:
+            value = user.get(field)
+            if isinstance(value, str): user[field] = sys.intern(value)
+    users_df = pd.DataFrame(users_list).drop_duplicates(subset="userid").set_index("userid")
+    users_df = users_df.astype(object).where(users_df.notna(), None) # NaN -> None, like the original row dicts
+    labels = users_df["username"].fillna("N/A").astype(str) + " (" + users_df["phone"].fillna("N/A").astype(str) + ")"
+    label_to_uid = dict(zip(labels.tolist(), users_df.index.tolist()))
+    uid_to_index = {uid: i for i, uid in enumerate(label_to_uid.values())}
+    return users_df, label_to_uid, uid_to_index
+
+def _get_profile(users_df: pd.DataFrame, userid) -> Optional[dict]:
+    """Returns a copy of the user's profile row as a dict (with userid), or None. users_df is shared: never mutate it."""
+    if userid not in users_df.index: return None
+    return {**users_df.loc[userid].to_dict(), "userid": userid}
+
+# --- Message Templates ---
+# Which messages a profile gets depends only on which fields are filled in, so the branch ladder is
+# resolved once per field-presence mask at import. Each template takes the fields dict built in
+# generate_ai_tools_messages and returns the finished message.
+_CAREER, _COUNTRIES, _COURSE, _FIELD, _PLAN, _LEVEL = 1, 2, 4, 8, 16, 32 # _FIELD = category or subCategory
+MESSAGE_COUNT = 10
+
+def _explore_message(f: dict) -> str:
+    if not f["non_null_info"]: return f"Hi {f['username']}, thanks for using the AI tools! Let us know what you're trying to figure out!"
+    interests = ", ".join([f"{label}: '{value}'" for label, value in f["non_null_info"]])
+    return f"Hi {f['username']}, thanks for using the AI tools! Looks like you're exploring options related to: {interests}."
+
+def _career_rag_message(f: dict) -> str:
+    if not f["use_rag"]: return f"Focusing on becoming a {f['career']}? We can research the best countries and study paths for this role."
+    # Use RAG to suggest countries/courses (cached per career/level/field)
+    try:
+        suggestions = get_rag_suggestion("career", f["career"], f["highestLevel"], f["category"], f["subCategory"])
+        if suggestions:
+            return f"Focusing on becoming a {f['career']}? We can help explore options. Some suggestions based on AI: {suggestions}..."
+        return f"Focusing on becoming a {f['career']}? We can research the best countries and study paths for this role."
+    except Exception as e:
+        logging.warning(f"RAG failed for career suggestions: {e}")
+        return f"Focusing on becoming a {f['career']}? We can help research suitable countries and study paths."
+
+def _subject_rag_message(f: dict) -> str:
+    if not f["use_rag"]: return f"Interested in {f['subject']} (in {f['category']})? We can explore potential careers and ideal study destinations for this field."
+    # Use RAG (cached per field/level)
+    try:
+        suggestions = get_rag_suggestion("subject", None, f["highestLevel"], f["category"], f["subCategory"])
+        if suggestions:
+            return f"Interested in {f['subject']} (in {f['category']})? Potential paths & places based on AI: {suggestions}..."
+        return f"Interested in {f['subject']} (in {f['category']})? We can explore potential careers and ideal study destinations for this field."
+    except Exception as e:
+        logging.warning(f"RAG failed for subject suggestions: {e}")
+        return f"Interested in {f['subject']} (in {f['category']})? We can explore potential careers and ideal study destinations."
+
+def _course_message(f: dict) -> str:
+    related = f" (related to {f['category']})" if f["category"] and f["course"] != f["category"] else ""
+    location = f" in {f['countries']}" if f["countries"] else ""
+    return f"You mentioned interest in '{f['course']}'.{related}{location}. We can find universities offering this specific program or similar ones."
+
+def _focus_template(mask: int):
+    """Message 2-4: the career, subject or country the user is focused on (None if none is set)."""
+    career, countries, course, field = mask & _CAREER, mask & _COUNTRIES, mask & _COURSE, mask & _FIELD
+    if career:
+        if not countries and not course: return _career_rag_message
+        if not countries: return lambda f: f"Focusing on becoming a {f['career']}? We can help identify the best countries to study '{f['course'] or f['subCategory'] or f['category']}' to reach that goal."
+        if not course and field: return lambda f: f"Focusing on becoming a {f['career']}? Let's find the right courses in {f['countries']} related to '{f['subject']}' that lead to this career."
+        return lambda f: f"Focusing on becoming a {f['career']}? Let's ensure your chosen path aligns well with this goal!"
+    if field:
+        if not countries: return _subject_rag_message
+        return lambda f: f"Interested in {f['subject']} (in {f['category']})? We can research potential career outcomes after studying this in {f['countries']}."
+    if countries: return lambda f: f"Thinking about studying in {f['countries']}? What subjects or career paths are you considering there? Knowing this helps us find the best opportunities."
+    return None
+
+def _connect_template(mask: int):
+    """Message 8: ties together career, field and country when several are set."""
+    career, countries, field = mask & _CAREER, mask & _COUNTRIES, mask & _FIELD
+    if career and field and countries: return lambda f: f"Combining your interest in {f['career']}, {f['subject']}, and {f['countries']} - let's find programs that perfectly match all three!"
+    if career and field: return lambda f: f"Let's bridge your interest in {f['subject']} with your {f['career']} goal. We can find programs that offer the right skills."
+    if field and countries: return lambda f: f"Studying {f['subject']} in {f['countries']} offers great opportunities. Let's find the best universities there for you."
+    return None
+
+def _build_message_templates(mask: int) -> list:
+    templates = [_explore_message, _focus_template(mask)]
+    if mask & _PLAN: templates.append(lambda f: f"Noted your budget preference: {f['selectedPlan']}. We'll keep this in mind when suggesting universities and programs.")
+    if mask & _LEVEL: templates.append(lambda f: f"Looking for {f['highestLevel']} programs? We can filter options based on this level and your field of interest ({f['category'] or f['subCategory'] or 'any field'}).")
+    if mask & _COURSE: templates.append(_course_message)
+    templates += [
+        _connect_template(mask),
+        lambda f: "Kandor's AI tools are just the start! Our counselors can provide personalized guidance based on your exploration. What's your main question right now?",
+        lambda f: "Exploring study abroad options is a big step! Keep using the AI tools, and don't hesitate to ask us specific questions.",
+    ]
+    return [t for t in templates if t is not None][:MESSAGE_COUNT]
+
+MESSAGE_TEMPLATES = {mask: _build_message_templates(mask) for mask in range(64)}
+
+def _info_mask(career, countries, course, category, subCategory, selectedPlan, highestLevel) -> int:
+    """Field-presence mask selecting a profile's MESSAGE_TEMPLATES entry."""
+    return ((_CAREER if career else 0) | (_COUNTRIES if countries else 0) | (_COURSE if course else 0)
+            | (_FIELD if category or subCategory else 0) | (_PLAN if selectedPlan else 0) | (_LEVEL if highestLevel else 0))
+
+def _profile_mask(profile_data: dict) -> int:
+    get = profile_data.get
+    return _info_mask(get('career'), get('countries'), get('course'), get('category'), get('subCategory'), get('selectedPlan'), get('highestLevel'))
+
+# (column, bit) pairs of _info_mask, for computing masks column-wise over a whole DataFrame
+_MASK_COLUMNS = (('career', _CAREER), ('countries', _COUNTRIES), ('course', _COURSE), ('category', _FIELD),
+                 ('subCategory', _FIELD), ('selectedPlan', _PLAN), ('highestLevel', _LEVEL))
+
+def _profile_masks(users_df: pd.DataFrame) -> np.ndarray:
+    """_profile_mask for every row at once: each column's presence vector is OR-ed into its bit."""
+    masks = np.zeros(len(users_df), dtype=np.int32)
+    for column, bit in _MASK_COLUMNS:
+        if column not in users_df.columns: continue
+        values = users_df[column]
+        masks |= np.where((values.notna() & (values != '')).to_numpy(), bit, 0).astype(np.int32)
+    return masks
+
+def _rag_job(profile_data: dict, mask: Optional[int] = None) -> Optional[tuple]:
+    """get_rag_suggestion args this profile's messages will need, or None (mirrors _focus_template)."""
+    if mask is None: mask = _profile_mask(profile_data)
+    career_rag = mask & _CAREER and not mask & (_COUNTRIES | _COURSE)
+    subject_rag = not mask & _CAREER and mask & _FIELD and not mask & _COUNTRIES
+    if not (career_rag or subject_rag): return None
+    get = profile_data.get
+    return ("career", get('career'), get('highestLevel'), get('category'), get('subCategory')) if career_rag else ("subject", None, get('highestLevel'), get('category'), get('subCategory'))
+
 # --- Helper Function for Message Generation ---
-def generate_ai_tools_messages(profile_data: dict) -> list[str]:
-    """Generates insightful messages based on non-NULL fields in aitools_profile."""
-    messages = []
+def generate_ai_tools_messages(profile_data: dict, use_rag: bool = False) -> list[str]:
+    """
+    Generates insightful messages based on non-NULL fields in aitools_profile. Template-only (instant)
+    unless use_rag, which adds AI suggestions to the focus message (see enhanceable_message_index).
+    """
     if not profile_data:
         return ["Error: No profile data provided."]
 
@@ -33,126 +292,112 @@ def generate_ai_tools_messages(profile_data: dict) -> list[str]:
 
     logging.info(f"Generating AI Tools messages for User: {userid} ({username})")
 
-    # Identify non-null fields to understand user's focus/confusion
-    present_fields = {
-        'category': category, 'subCategory': subCategory, 'plan': selectedPlan,
-        'career': career, 'countries': countries, 'level': highestLevel, 'course': course
+    # Identify non-null fields to understand user's focus/confusion: (label, value) pairs straight from the locals
+    non_null_info = tuple((label, value) for label, value in (
+        ('Category', category), ('Subcategory', subCategory), ('Plan', selectedPlan),
+        ('Career', career), ('Countries', countries), ('Level', highestLevel), ('Course', course),
+    ) if value is not None and value != '')
+
+    mask = _info_mask(career, countries, course, category, subCategory, selectedPlan, highestLevel)
+    fields = {
+        'username': username, 'category': category, 'subCategory': subCategory, 'subject': subCategory or category,
+        'selectedPlan': selectedPlan, 'career': career, 'countries': countries, 'highestLevel': highestLevel,
+        'course': course, 'non_null_info': non_null_info, 'use_rag': use_rag,
     }
-    non_null_info = {k: v for k, v in present_fields.items() if v is not None and v != ''}
-
-    # Construct profile subset for RAG context if needed
-    rag_context_profile = {
-        "aitools_category": category, "aitools_subCategory": subCategory,
-        "aitools_career": career, "aitools_countries": countries,
-        "aitools_highestLevel": highestLevel, "aitools_course": course,
-        "aitools_budget": selectedPlan
-        # Add other relevant profile fields if joining with users_latest_state provides more
-    }
-
-    # --- Generate Messages based on available info ---
-
-    # Message 1: Acknowledge exploration
-    explore_msg = f"Hi {username}, thanks for using the AI tools!"
-    if non_null_info:
-        explore_msg += " Looks like you're exploring options related to: "
-        explore_msg += ", ".join([f"{k.replace('_',' ').title()}: '{v}'" for k, v in non_null_info.items()]) + "."
+    messages = [template(fields) for template in MESSAGE_TEMPLATES[mask]]
+    pad = MESSAGE_COUNT - len(messages)
+    if pad > 0: messages.extend([f"We're here to help clarify your path, {username}. What's on your mind?"] * pad)
+    return messages
+
+def enhanceable_message_index(profile_data: dict) -> Optional[int]:
+    """Index of the message use_rag would change (the career/subject focus message), or None."""
+    templates = MESSAGE_TEMPLATES[_profile_mask(profile_data)]
+    return next((i for i, template in enumerate(templates) if template in (_career_rag_message, _subject_rag_message)), None)
+
+def generate_ai_tools_messages_bulk(users_df: pd.DataFrame) -> list[list[str]]:
+    """
+    generate_ai_tools_messages for every row of users_df (userid-indexed, as from _load_aitools_users).
+    Masks are computed column-wise for all rows; the distinct RAG suggestions the rows need are then
+    fetched once each, concurrently, before the messages are assembled from the warm cache.
+    """
+    profiles = [{**row, "userid": uid} for uid, row in zip(users_df.index.tolist(), users_df.to_dict("records"))]
+    masks = _profile_masks(users_df).tolist()
+    jobs = {} # cache key -> first raw job with that key (the raw values are what the prompt is built from)
+    for job in map(_rag_job, profiles, masks):
+        if job: jobs.setdefault(_normalize_rag_job(job), job)
+    jobs = jobs.values()
+    logging.info(f"Bulk AI Tools generation: {len(profiles)} users need {len(jobs)} distinct RAG suggestions")
+    for future in [_RAG_POOL.submit(get_rag_suggestion, *job) for job in jobs]:
+        try: future.result()
+        except Exception as e: logging.warning(f"Bulk RAG prefetch failed: {e}") # Retried (and reported) per message below
+    return [generate_ai_tools_messages(profile, use_rag=True) for profile in profiles]
+
+
+def _render_messages(messages: list[str], selected_userid, profile_data: dict) -> None:
+    """
+    Shows the generated messages as static code blocks (built-in copy button, no widget state to
+    diff on rerun), with an AI-enhance button on the focus message.
+    """
+    enhance_index = enhanceable_message_index(profile_data)
+    for i, msg in enumerate(messages, 1):
+        st.markdown(f"**Message {i}**")
+        if i - 1 == enhance_index and st.button(f"Enhance message {i} with AI", key=f"aitools_enh_{selected_userid}_{i}"):
+            with st.spinner("Asking the knowledge base..."):
+                try:
+                    messages[i - 1] = msg = generate_ai_tools_messages(profile_data, use_rag=True)[i - 1] # Updates the cached list in place
+                    st.session_state["ai_tools_rag_stats"] = get_rag_cache_stats()
+                except Exception as e:
+                    st.error(f"AI enhancement failed: {e}")
+                    logging.error(f"AI Tools enhancement error for {selected_userid}: {e}", exc_info=True)
+        st.code(msg, language=None, wrap_lines=True)
+
+
+@st.fragment
+def _render_details(users_df: pd.DataFrame, selected_userid) -> None:
+    """Right-hand panel (profile + messages). A fragment, so interacting with it doesn't rerun the user list."""
+    if not selected_userid:
+        st.info("Select a user from the list on the left.")
     else:
-        explore_msg += " Let us know what you're trying to figure out!"
-    messages.append(explore_msg)
+        # Find the selected user's full profile data (O(1) index lookup)
+        selected_profile_data = _get_profile(users_df, selected_userid)
 
-    # Message 2: Focus on Career goal if present
-    if career:
-        msg = f"Focusing on becoming a {career}?"
-        if not countries and not course:
-            # Use RAG to suggest countries/courses
-            rag_query = f"What are some good countries and general course types for a career as a {career}, considering someone looking for {highestLevel or 'any level'} education?"
-            try:
-                suggestions = do_rag_query(user_query=rag_query, user_profile=rag_context_profile, top_k=2)
-                if suggestions and "not available" not in suggestions.lower():
-                    msg += f" We can help explore options. Some suggestions based on AI: {suggestions[:200]}..."
-                else:
-                    msg += " We can research the best countries and study paths for this role."
-            except Exception as e:
-                logging.warning(f"RAG failed for career suggestions: {e}")
-                msg += " We can help research suitable countries and study paths."
-        elif not countries:
-             msg += f" We can help identify the best countries to study '{course or subCategory or category}' to reach that goal."
-        elif not course and (category or subCategory):
-             msg += f" Let's find the right courses in {countries} related to '{subCategory or category}' that lead to this career."
-        else:
-            msg += " Let's ensure your chosen path aligns well with this goal!"
-        messages.append(msg)
-
-    # Message 3: Focus on Subject/Specialization if present
-    elif category or subCategory:
-        subject = subCategory or category
-        msg = f"Interested in {subject} (in {category})?"
-        if not career and not countries:
-            # Use RAG
-            rag_query = f"What are typical career paths and good study destinations for {subject} (field: {category}) at the {highestLevel or 'any'} level?"
-            try:
-                suggestions = do_rag_query(user_query=rag_query, user_profile=rag_context_profile, top_k=2)
-                if suggestions and "not available" not in suggestions.lower():
-                    msg += f" Potential paths & places based on AI: {suggestions[:200]}..."
-                else:
-                     msg += " We can explore potential careers and ideal study destinations for this field."
-            except Exception as e:
-                logging.warning(f"RAG failed for subject suggestions: {e}")
-                msg += " We can explore potential careers and ideal study destinations."
-        elif not career:
-             msg += f" We can research potential career outcomes after studying this in {countries}."
-        elif not countries:
-             msg += f" Let's find the best countries to study {subject} to become a {career}."
+        if not selected_profile_data:
+            st.error("Selected user data not found.")
         else:
-             msg += f" {countries} is a great choice for this field!"
-        messages.append(msg)
-
-    # Message 4: Focus on Country if present
-    elif countries:
-        msg = f"Thinking about studying in {countries}?"
-        if not category and not subCategory and not career:
-            msg += " What subjects or career paths are you considering there? Knowing this helps us find the best opportunities."
-        elif category or subCategory:
-             msg += f" It's a good destination for fields like {category or subCategory}. Let's find specific programs."
-        elif career:
-             msg += f" We can explore how studying in {countries} helps achieve your goal of becoming a {career}."
-        messages.append(msg)
-
-    # Message 5: Budget Signal
-    if selectedPlan:
-        messages.append(f"Noted your budget preference: {selectedPlan}. We'll keep this in mind when suggesting universities and programs.")
-
-    # Message 6: Education Level
-    if highestLevel:
-         messages.append(f"Looking for {highestLevel} programs? We can filter options based on this level and your field of interest ({category or subCategory or 'any field'}).")
-
-    # Message 7: Specific Course Mentioned
-    if course:
-        msg = f"You mentioned interest in '{course}'."
-        if category and course != category: msg += f" (related to {category})"
-        if countries: msg += f" in {countries}"
-        msg += ". We can find universities offering this specific program or similar ones."
-        messages.append(msg)
-
-    # Message 8: Connecting pieces
-    if career and (category or subCategory) and countries:
-         messages.append(f"Combining your interest in {career}, {subCategory or category}, and {countries} - let's find programs that perfectly match all three!")
-    elif career and (category or subCategory):
-         messages.append(f"Let's bridge your interest in {subCategory or category} with your {career} goal. We can find programs that offer the right skills.")
-    elif (category or subCategory) and countries:
-         messages.append(f"Studying {subCategory or category} in {countries} offers great opportunities. Let's find the best universities there for you.")
-
-    # Message 9: Value Prop / Next Step
-    messages.append("Kandor's AI tools are just the start! Our counselors can provide personalized guidance based on your exploration. What's your main question right now?")
-
-    # Message 10: General Encouragement
-    messages.append("Exploring study abroad options is a big step! Keep using the AI tools, and don't hesitate to ask us specific questions.")
-
-    # Fill remaining messages
-    # ... (fill logic) ...
-    while len(messages) < 10: messages.append(f"We're here to help clarify your path, {username}. What's on your mind?")
-
-    return messages[:10]
+            st.subheader(f"User Insights for: {selected_profile_data.get('username', selected_userid)}")
+
+            # Display non-null profile fields
+            st.markdown("**User's Explored Interests:**")
+            displayed_info = False
+            for field, label in _DISPLAY_LABELS.items():
+                value = selected_profile_data.get(field)
+                if value is not None and value != '':
+                    st.markdown(f"- **{label}:** {value}")
+                    displayed_info = True
+            if not displayed_info:
+                st.markdown("- *No specific interests recorded via AI tools yet.*")
+
+            st.divider()
+
+            # --- Message Generation and Display ---
+            st.subheader("Suggested Follow-up Messages")
+            # Check cache first
+            cached_messages = st.session_state.get("ai_tools_generated_messages", {}).get(selected_userid)
+
+            if cached_messages:
+                st.success(f"Showing {len(cached_messages)} cached messages:")
+                _render_messages(cached_messages, selected_userid, selected_profile_data)
+            else:
+                # Generate automatically on selection (template-only, so inline; AI suggestions are opt-in per message)
+                messages = None
+                try:
+                    messages = generate_ai_tools_messages(selected_profile_data)
+                    # Cache messages
+                    st.session_state.setdefault("ai_tools_generated_messages", {})[selected_userid] = messages
+                except Exception as e:
+                    st.error(f"Failed to generate messages: {e}")
+                    logging.error(f"AI Tools message generation error for {selected_userid}: {e}", exc_info=True)
+                if messages: _render_messages(messages, selected_userid, selected_profile_data) # Same run, no st.rerun() needed
 
 
 # --- Main Rendering Function for the Tab ---
@@ -161,23 +406,24 @@ def render():
     st.markdown("View users who have used AI exploration tools and generate helpful follow-up messages based on their indicated interests.")
 
     # --- Initialize State for this tab ---
-    if "ai_tools_users_list" not in st.session_state: st.session_state["ai_tools_users_list"] = None
     if "ai_tools_selected_userid" not in st.session_state: st.session_state["ai_tools_selected_userid"] = None
     if "ai_tools_generated_messages" not in st.session_state: st.session_state["ai_tools_generated_messages"] = {} # Cache per userid
 
     # --- Load User List ---
-    # Load once or provide a refresh button
-    if st.session_state["ai_tools_users_list"] is None:
-        with st.spinner("Loading AI Tools user list..."):
-            try:
-                st.session_state["ai_tools_users_list"] = get_aitools_profile_users()
-            except Exception as e:
-                st.error(f"Failed to load user list: {e}")
-                st.session_state["ai_tools_users_list"] = [] # Set empty list on error
-
-    users_list = st.session_state["ai_tools_users_list"]
-
-    if not users_list:
+    # Cached across reruns: the DataFrame and label map are built once, not on every interaction
+    with st.spinner("Loading AI Tools user list..."):
+        try:
+            users_df, user_options, uid_to_index = _load_aitools_users()
+        except Exception as e:
+            st.error(f"Failed to load user list: {e}")
+            users_df, user_options, uid_to_index = pd.DataFrame(), {}, {}
+
+    with st.sidebar:
+        st.header("AI Tools RAG Cache")
+        rag_stats = st.session_state.get("ai_tools_rag_stats") or get_rag_cache_stats()
+        st.caption(f"Memory hits: {rag_stats['memory_hits']} · Disk hits: {rag_stats['disk_hits']} · RAG calls: {rag_stats['rag_calls']}")
+
+    if users_df.empty:
         st.warning("No users found in the AI Tools profile table or failed to load.")
         return # Stop rendering if no users
 
@@ -186,8 +432,22 @@ def render():
 
     with col_users:
         st.subheader("Select User")
-        # Create display options
-        user_options = {f"{user.get('username', 'N/A')} ({user.get('phone', 'N/A')})": user.get('userid') for user in users_list}
+        if st.button("Refresh user list", key="ai_tools_refresh_users"):
+            _load_aitools_users.clear()
+            _cached_rag.clear() # Suggestions are re-read from disk (still within RAG_DISK_CACHE_TTL_S) or re-asked
+            st.rerun()
+        if st.button("Generate for all visible users", key="ai_tools_generate_all"):
+            generated = st.session_state.setdefault("ai_tools_generated_messages", {})
+            pending_uids = [uid for uid in users_df.index.tolist() if uid not in generated]
+            with st.spinner(f"Generating messages for {len(pending_uids)} users..."):
+                try:
+                    all_messages = generate_ai_tools_messages_bulk(users_df.loc[pending_uids])
+                    generated.update(zip(pending_uids, all_messages))
+                    st.session_state["ai_tools_rag_stats"] = get_rag_cache_stats()
+                    st.success(f"Generated messages for {len(pending_uids)} users.")
+                except Exception as e:
+                    st.error(f"Bulk generation failed: {e}")
+                    logging.error(f"AI Tools bulk generation error: {e}", exc_info=True)
         display_list = list(user_options.keys())
 
         # Callback to handle selection change
@@ -201,16 +461,7 @@ def render():
                       # Message generation happens in the other column based on selection change.
 
         # Find current index for radio button
-        current_selection_index = None
-        selected_uid_from_state = st.session_state.get("ai_tools_selected_userid")
-        if selected_uid_from_state:
-             # Find the display name corresponding to the selected user ID
-             for display_name, uid in user_options.items():
-                  if uid == selected_uid_from_state:
-                      try:
-                          current_selection_index = display_list.index(display_name)
-                      except ValueError: pass # Should not happen
-                      break
+        current_selection_index = uid_to_index.get(st.session_state.get("ai_tools_selected_userid"))
 
         st.radio(
             "Users:",
@@ -221,55 +472,7 @@ def render():
         )
 
     with col_details_messages:
-        selected_userid = st.session_state.get("ai_tools_selected_userid")
-
-        if not selected_userid:
-            st.info("Select a user from the list on the left.")
-        else:
-            # Find the selected user's full profile data from the list
-            selected_profile_data = next((user for user in users_list if user.get('userid') == selected_userid), None)
-
-            if not selected_profile_data:
-                st.error("Selected user data not found.")
-            else:
-                st.subheader(f"User Insights for: {selected_profile_data.get('username', selected_userid)}")
-
-                # Display non-null profile fields
-                st.markdown("**User's Explored Interests:**")
-                displayed_info = False
-                fields_to_display = ['category', 'subCategory', 'selectedPlan', 'career', 'countries', 'highestLevel', 'course']
-                for field in fields_to_display:
-                    value = selected_profile_data.get(field)
-                    if value is not None and value != '':
-                        # Simple formatting for display
-                        label = field.replace('_', ' ').replace('selectedPlan', 'Budget Plan').title()
-                        st.markdown(f"- **{label}:** {value}")
-                        displayed_info = True
-                if not displayed_info:
-                    st.markdown("- *No specific interests recorded via AI tools yet.*")
-
-                st.divider()
-
-                # --- Message Generation and Display ---
-                st.subheader("Suggested Follow-up Messages")
-                # Check cache first
-                cached_messages = st.session_state.get("ai_tools_generated_messages", {}).get(selected_userid)
-
-                if cached_messages:
-                    st.success(f"Showing {len(cached_messages)} cached messages:")
-                    for i, msg in enumerate(cached_messages, 1):
-                        st.text_area(f"Message {i}", value=msg, height=100, key=f"aitools_msg_{selected_userid}_{i}", help="Copy message text.")
-                else:
-                    # Generate button or generate automatically? Let's generate automatically on selection for now.
-                    with st.spinner("Generating insightful messages..."):
-                         try:
-                             messages = generate_ai_tools_messages(selected_profile_data)
-                             # Cache messages
-                             st.session_state.setdefault("ai_tools_generated_messages", {})[selected_userid] = messages
-                             st.rerun() # Rerun to display newly generated messages
-                         except Exception as e:
-                             st.error(f"Failed to generate messages: {e}")
-                             logging.error(f"AI Tools message generation error for {selected_userid}: {e}", exc_info=True)
+        _render_details(users_df, st.session_state.get("ai_tools_selected_userid"))
 
 # If running standalone for testing
 if __name__ == "__main__":
@@ -3,8 +3,15 @@
 import streamlit as st
 import logging
 import datetime
-from dateutil.relativedelta import relativedelta
-from typing import Optional, Dict, Any, List # Added List
+import functools
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import pandas as pd
+from typing import Optional, Dict, Any, List, Tuple # Added List
 
 # --- Import Core Logic ---
 try:
@@ -13,7 +20,7 @@ try:
         get_latest_shortlist_data_and_uni_name, # Use the updated function
         get_user_by_id
     )
-    from rag_utils import do_rag_query, VECTOR_STORE_IDS
+    from rag_utils import do_rag_query, is_rag_failure, VECTOR_STORE_IDS
 except ImportError as e:
     st.error(f"(College Explorer Tab) Failed to import required modules: {e}. Check file structure.")
     logging.error(f"(College Explorer Tab) Module import error: {e}", exc_info=True)
@@ -21,57 +28,223 @@ except ImportError as e:
     st.stop() # Stop if core DB/RAG utils can't be loaded
 
 
+# --- Cached University Details (RAG) ---
+# One case-insensitive pass over the RAG answer: each matching line is classified by the group (= uni_details key)
+# of its first keyword, instead of lowercasing every line and testing each keyword separately
+_DETAIL_LINE_RE = re.compile(r"(?im)^.*?(?:(?P<admissions>admission)|(?P<fees>fee|tuition|cost)|(?P<acceptance>accept.*?rate)|(?P<location>locat|city)).*$")
+
+UNI_DETAIL_KEYS = ('admissions', 'fees', 'acceptance', 'location')
+DETAIL_SCAN_MAX_CHARS = 4096 # Useful detail lines sit near the top of the answer; don't scan huge outputs
+_JSON_OBJECT_RE = re.compile(r"\{.*\}", re.DOTALL) # Outermost {...}, ignoring any ```json fence or preamble
+
+def _parse_uni_details_json(uni_info_raw: str) -> Optional[dict]:
+    """uni_details from a JSON answer ({admissions, fees, acceptance, location}), or None if it isn't one."""
+    match = _JSON_OBJECT_RE.search(uni_info_raw or "")
+    if not match: return None
+    try: parsed = json.loads(match.group(0))
+    except ValueError: return None
+    if not isinstance(parsed, dict): return None
+    uni_details = {key: str(parsed[key]).strip() for key in UNI_DETAIL_KEYS if parsed.get(key)}
+    if uni_details: uni_details['raw'] = " ".join(uni_details.values()) # Readable text for the "more details" message
+    return uni_details
+
+@functools.lru_cache(maxsize=256)
+def _parse_uni_details(uni_info_raw: str) -> tuple[tuple[str, str], ...]:
+    """Pure parse of a RAG answer into (key, text) pairs: JSON first, free-text line classification as fallback."""
+    structured = _parse_uni_details_json(uni_info_raw)
+    if structured is not None: return tuple(structured.items())
+    if "not available" in uni_info_raw.lower(): return ()
+    # Free-text answer (model ignored the JSON instruction): fall back to line classification
+    uni_details = {'raw': uni_info_raw}
+    for match in _DETAIL_LINE_RE.finditer(uni_info_raw[:DETAIL_SCAN_MAX_CHARS]):
+        uni_details.setdefault(match.lastgroup, match.group(0)) # First (most specific) match wins
+        if len(uni_details) > len(UNI_DETAIL_KEYS): break # All four keys found (plus 'raw')
+    return tuple(uni_details.items()) # Immutable, so the cached value can't be mutated by callers
+
+# Process-wide (all sessions and the prefetch threads), keyed on university/degree/country only
+UNI_RAG_CACHE_TTL_S = 3600
+UNI_RAG_CACHE_MAX_ENTRIES = 512
+_uni_rag_cache: "OrderedDict[tuple, Tuple[float, tuple]]" = OrderedDict() # key -> (stored at, parsed details)
+_uni_rag_cache_lock = threading.Lock()
+_uni_rag_inflight: Dict[tuple, Future] = {} # key -> lookup in progress (single-flight: later callers wait on it)
+RAG_INFLIGHT_WAIT_S = 30 # Max wait on another caller's lookup; past it the messages fall back to their generic wording
+
+def _fetch_uni_details(uni_name: str, uni_id: Optional[str], degree: str, user_country: str) -> dict:
+    """
+    RAG lookup of a university's admissions/fees/acceptance/location, parsed into a dict (plus 'raw').
+    Depends only on the university, degree and country (not the user), so it is shared across users
+    and sessions. Raises if the RAG call failed, so failures are not cached.
+    """
+    cache_key = (uni_name, uni_id, degree, user_country)
+    with _uni_rag_cache_lock:
+        hit = _uni_rag_cache.get(cache_key)
+        if hit and time.monotonic() - hit[0] < UNI_RAG_CACHE_TTL_S:
+            _uni_rag_cache.move_to_end(cache_key)
+            return dict(hit[1])
+        inflight = _uni_rag_inflight.get(cache_key)
+        if inflight is None: _uni_rag_inflight[cache_key] = owned = Future()
+    if inflight is not None: return dict(inflight.result(timeout=RAG_INFLIGHT_WAIT_S)) # Same lookup already running (e.g. the prefetch)
+    try:
+        uni_details = _query_uni_details(uni_name, uni_id, degree, user_country) # RAG call runs outside the lock
+    except Exception as e:
+        with _uni_rag_cache_lock: del _uni_rag_inflight[cache_key]
+        owned.set_exception(e) # Waiters see the failure too; nothing is cached
+        raise
+    with _uni_rag_cache_lock:
+        _uni_rag_cache[cache_key] = (time.monotonic(), uni_details)
+        _uni_rag_cache.move_to_end(cache_key)
+        while len(_uni_rag_cache) > UNI_RAG_CACHE_MAX_ENTRIES: _uni_rag_cache.popitem(last=False)
+        del _uni_rag_inflight[cache_key]
+    owned.set_result(uni_details)
+    return dict(uni_details)
+
+def _query_uni_details(uni_name: str, uni_id: Optional[str], degree: str, user_country: str) -> tuple[tuple[str, str], ...]:
+    uni_query = f"Provide details about {uni_name}"
+    if uni_id: uni_query += f" (ID: {uni_id})"
+    uni_query += f", including general admission requirements, estimated fees (annual tuition & living costs if possible), location highlights, and student acceptance rate if available. Mention details relevant to {degree} programs if possible. "
+    uni_query += "Respond ONLY with a JSON object with keys admissions, fees, acceptance, location (one or two sentences each); use null if unknown."
+    uni_info_raw = do_rag_query(user_query=uni_query, user_profile={"countries": [user_country]}, top_k=3)
+    if is_rag_failure(uni_info_raw): raise RuntimeError(uni_info_raw) # Not cached; retried on the next lookup
+    uni_details = _parse_uni_details(uni_info_raw) if uni_info_raw else ()
+    if not uni_details: logging.warning(f"RAG query for university details ({uni_name}) returned limited info.")
+    return uni_details
+
+
+# --- Cached DB lookups (shared across sessions; interaction rows repeat between viewers) ---
+@st.cache_data(ttl=600, show_spinner=False)
+def _cached_get_user_by_id(uid: str) -> Optional[Dict[str, Any]]:
+    return get_user_by_id(uid)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _cached_get_shortlist(uid: str, date_iso: str, uni_id: str) -> Optional[Dict[str, Any]]:
+    # Date passed as ISO string so the cache key is a plain hashable value
+    return get_latest_shortlist_data_and_uni_name(uid, datetime.date.fromisoformat(date_iso), uni_id)
+
+
+def _get_or_fetch_interaction_data(cache_key: str, user_id: str, uni_id: str, selected_date_obj: datetime.date) -> Dict[str, Any]:
+    """Returns the profile/shortlist bundle for an interaction, fetching and storing it in session state on first use."""
+    fetched_data = st.session_state.get("college_explorer_fetched_data", {}).get(cache_key)
+    if fetched_data: return fetched_data
+    with st.spinner("Fetching user profile and shortlist data..."):
+        user_profile = None; shortlist_data = None; uni_name = f"ID: {uni_id}"; course_name = "N/A"
+        try: user_profile = _cached_get_user_by_id(user_id)
+        except Exception as e: logging.error(f"Failed fetch profile {user_id}: {e}")
+        try:
+            shortlist_data = _cached_get_shortlist(user_id, selected_date_obj.isoformat(), uni_id)
+            if shortlist_data:
+                uni_name = shortlist_data.get('interacted_university_name', uni_name)
+                course_name = shortlist_data.get('interacted_course_name', course_name)
+        except Exception as e: logging.error(f"Failed fetch shortlist {user_id}/{selected_date_obj}: {e}")
+    fetched_data = {'user_profile': user_profile, 'shortlist_data': shortlist_data, 'interacted_university_name': uni_name, 'interacted_course_name': course_name}
+    st.session_state["college_explorer_fetched_data"][cache_key] = fetched_data
+    return fetched_data
+
+
 # --- Helper Function for Message Generation ---
-# (This function definition remains unchanged from the previous correct version)
+# Ten message slots, formatted with format_map. A tuple slot lists (detail_key, template) alternatives,
+# the first whose uni_details value is present is used ({detail} = that value, truncated).
+_MESSAGE_TEMPLATES: tuple[Any, ...] = (
+    "Hi {username}, saw you were looking into {uni}! It's a popular choice, especially for programs like '{course}'. How can we assist further?",
+    "Thinking about the '{course}' program (or similar {degree} fields) at {uni}? Let's explore if it's the right fit for your goals in {country}.",
+    (('admissions', "Admission insight for {uni}: {detail}..."),
+     ('acceptance', "Regarding {uni}'s selectivity: {detail}..."),
+     (None, "We can help find specific admission requirements for '{course}' at {uni}.")),
+    (('fees', "Estimated Costs at {uni}: {detail}... Does this work with your financial plan?"),
+     (None, "Let's research the budget needed for the '{course}' program at {uni}.")),
+    (('location', "Living near {uni}: {detail}... Think about the campus and city environment!"),
+     (None, "Researching the campus location and city life around {uni} is important.")),
+    "What specifically interests you most about '{course}' at {uni}? Faculty, research, modules?",
+    "What makes {uni} stand out for you compared to other options for {degree}?",
+    (('raw', "More details we found on {uni}: {detail}..."),
+     (None, "Want a more detailed report on {uni}, focusing on the {degree} department?")),
+    "Ready to move forward with {uni}? Kandor can guide you through the application process for '{course}'.",
+    "Focusing on {uni} is a big step! What questions do you have about applying or preparing?",
+)
+_DETAIL_SNIPPET_CHARS: Dict[str, int] = {'raw': 300} # Others are cut at 250
+
+def _shortlist_degree_and_country(query_profile_data: dict) -> tuple[str, str]:
+    shortlist_countries = query_profile_data.get('countries', [])
+    return query_profile_data.get('degreeTitle', 'your field'), (shortlist_countries[0] if shortlist_countries else 'your target country')
+
+def _assemble_messages(ctx: Dict[str, str], uni_details: Dict[str, str]) -> List[str]:
+    """Pure template assembly (no Streamlit/RAG), kept separate and fully typed so it can be profiled or compiled on its own."""
+    messages: List[str] = []
+    for template in _MESSAGE_TEMPLATES:
+        if isinstance(template, str): messages.append(template.format_map(ctx)); continue
+        for detail_key, alternative in template: # First available detail wins; (None, ...) is the fallback
+            if detail_key is None or uni_details.get(detail_key):
+                detail = uni_details.get(detail_key, "") if detail_key else ""
+                messages.append(alternative.format_map({**ctx, "detail": detail[:_DETAIL_SNIPPET_CHARS.get(detail_key or "", 250)]}))
+                break
+    return messages
+
 def generate_college_explorer_messages(
         user_profile: dict, target_university_name: str, target_course_name: str,
         target_university_id: Optional[str], query_profile_data: dict
     ) -> list[str]:
     """Generates messages focused on the TARGET university and course selected by the user."""
-    messages = []
     if not user_profile or not target_university_name: return ["Error: Missing user profile or target university data."]
     username = user_profile.get('username', 'there'); user_id = user_profile.get('userid')
-    shortlist_degree = query_profile_data.get('degreeTitle', 'your field')
-    shortlist_countries = query_profile_data.get('countries', [])
-    shortlist_country = shortlist_countries[0] if shortlist_countries else 'your target country'
+    shortlist_degree, shortlist_country = _shortlist_degree_and_country(query_profile_data)
     logging.info(f"Generating messages for User: {user_id} ({username}), Target Uni: {target_university_name}, Target Course: {target_course_name}, Target Degree: {shortlist_degree}")
     uni_details = {}
-    try:
-        uni_query = f"Provide details about {target_university_name}"
-        if target_university_id: uni_query += f" (ID: {target_university_id})"
-        uni_query += f", including general admission requirements, estimated fees (annual tuition & living costs if possible), location highlights, and student acceptance rate if available. Mention details relevant to {shortlist_degree} programs if possible."
-        uni_info_raw = do_rag_query(user_query=uni_query, user_profile=user_profile, top_k=3)
-        if uni_info_raw and "not available" not in uni_info_raw.lower() and "error" not in uni_info_raw.lower():
-            uni_details['raw'] = uni_info_raw
-            lines = uni_info_raw.split('\n')
-            for line in lines:
-                if "admission" in line.lower(): uni_details['admissions'] = line
-                if "fee" in line.lower() or "tuition" in line.lower() or "cost" in line.lower(): uni_details['fees'] = line
-                if "accept" in line.lower() and "rate" in line.lower(): uni_details['acceptance'] = line
-                if "locat" in line.lower() or "city" in line.lower(): uni_details['location'] = line
-        else: logging.warning(f"RAG query for university details ({target_university_name}) returned limited info or failed.")
+    try: uni_details = _fetch_uni_details(target_university_name, target_university_id, shortlist_degree, shortlist_country)
     except Exception as e: logging.error(f"RAG Error fetching details for {target_university_name}: {e}")
     # --- Message Templates ---
-    messages.append(f"Hi {username}, saw you were looking into {target_university_name}! It's a popular choice, especially for programs like '{target_course_name}'. How can we assist further?")
-    messages.append(f"Thinking about the '{target_course_name}' program (or similar {shortlist_degree} fields) at {target_university_name}? Let's explore if it's the right fit for your goals in {shortlist_country}.")
-    if uni_details.get('admissions'): messages.append(f"Admission insight for {target_university_name}: {uni_details['admissions'][:250]}...")
-    elif uni_details.get('acceptance'): messages.append(f"Regarding {target_university_name}'s selectivity: {uni_details['acceptance'][:250]}...")
-    else: messages.append(f"We can help find specific admission requirements for '{target_course_name}' at {target_university_name}.")
-    if uni_details.get('fees'): messages.append(f"Estimated Costs at {target_university_name}: {uni_details['fees'][:250]}... Does this work with your financial plan?")
-    else: messages.append(f"Let's research the budget needed for the '{target_course_name}' program at {target_university_name}.")
-    if uni_details.get('location'): messages.append(f"Living near {target_university_name}: {uni_details['location'][:250]}... Think about the campus and city environment!")
-    else: messages.append(f"Researching the campus location and city life around {target_university_name} is important.")
-    messages.append(f"What specifically interests you most about '{target_course_name}' at {target_university_name}? Faculty, research, modules?")
-    # Need top_courses for this message, retrieve from shortlist_data if needed, or adapt message
-    # Example: messages.append(f"How does {target_university_name} compare to other options you considered for {shortlist_degree}?")
-    messages.append(f"What makes {target_university_name} stand out for you compared to other options for {shortlist_degree}?") # Adapted message
-    if uni_details.get('raw'): messages.append(f"More details we found on {target_university_name}: {uni_details['raw'][:300]}...")
-    else: messages.append(f"Want a more detailed report on {target_university_name}, focusing on the {shortlist_degree} department?")
-    messages.append(f"Ready to move forward with {target_university_name}? Kandor can guide you through the application process for '{target_course_name}'.")
-    messages.append(f"Focusing on {target_university_name} is a big step! What questions do you have about applying or preparing?")
-    # Fill remaining messages
-    while len(messages) < 10: messages.append(f"Let us know if you have more questions about {target_university_name} or '{target_course_name}'!")
-    return messages[:10]
+    ctx = {"username": username, "uni": target_university_name, "course": target_course_name, "degree": shortlist_degree, "country": shortlist_country}
+    return _assemble_messages(ctx, uni_details)
+
+_UNI_DETAILS_POOL = ThreadPoolExecutor(max_workers=5) # RAG calls are I/O bound; 5 = one per top shortlist option
+
+def _prefetch_uni_details(target_data: dict, query_profile_data: dict) -> Optional[Future]:
+    """Starts _fetch_uni_details for the selected shortlist option in the background (Generate then joins it)."""
+    if not target_data.get("university_name") or target_data.get("university_name") == 'N/A': return None
+    degree, country = _shortlist_degree_and_country(query_profile_data)
+    return _UNI_DETAILS_POOL.submit(_fetch_uni_details, target_data["university_name"], target_data.get("university_id"), degree, country)
+
+def generate_many(targets: List[Dict[str, Any]]) -> List[list[str]]:
+    """
+    Generates messages for several targets (each a dict of generate_college_explorer_messages kwargs).
+    The university-detail RAG lookups run concurrently first, so the per-target generation below hits the cache.
+    """
+    futures = []
+    for target in targets:
+        if not target.get('user_profile') or not target.get('target_university_name'): continue
+        degree, country = _shortlist_degree_and_country(target.get('query_profile_data') or {})
+        futures.append(_UNI_DETAILS_POOL.submit(_fetch_uni_details, target['target_university_name'], target.get('target_university_id'), degree, country))
+    for future in futures:
+        try: future.result()
+        except Exception as e: logging.error(f"RAG prefetch failed for a College Explorer target: {e}") # Retried (and logged) per target below
+    return [generate_college_explorer_messages(**target) for target in targets]
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _build_date_options(today_iso: str) -> tuple[Dict[str, datetime.date], List[str], int]:
+    """Last 30 days as {"YYYY-MM-DD (Weekday)": date}, newest first, its label list and yesterday's position. Built once per day."""
+    today = datetime.date.fromisoformat(today_iso)
+    thirty_days_ago = today - datetime.timedelta(days=29)
+    date_range = [thirty_days_ago + datetime.timedelta(days=x) for x in range((today - thirty_days_ago).days + 1)]
+    date_options = {d.strftime("%Y-%m-%d (%A)"): d for d in sorted(date_range, reverse=True)}
+    yesterday_str = (today - datetime.timedelta(days=1)).strftime("%Y-%m-%d (%A)")
+    date_keys = list(date_options)
+    return date_options, date_keys, (date_keys.index(yesterday_str) if yesterday_str in date_options else 0)
+
+
+INTERACTION_COLUMNS = ['user_id', 'username', 'phone', 'university_id', 'interaction_time']
+
+def _interactions_frame(interactions: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Interactions as a DataFrame with a vectorized 'display' label column (object dtype keeps DB values as plain Python types)."""
+    df = pd.DataFrame(interactions, columns=INTERACTION_COLUMNS, dtype=object)
+    df['display'] = (df['username'].fillna('N/A').astype(str) + ' (' + df['phone'].fillna('N/A').astype(str) + ') -> Uni ID: '
+                     + df['university_id'].astype(str) + ' @ ' + df['interaction_time'].fillna('--:--').astype(str))
+    return df
+
+def _build_interaction_options(interactions_df: pd.DataFrame) -> tuple[List[str], Dict[str, int]]:
+    """Radio labels for the interactions (in order) and label -> first index. Built once per fetch, not per rerun."""
+    display_options_list = interactions_df['display'].tolist()
+    interaction_options_map = {}
+    for i, display_name in enumerate(display_options_list): interaction_options_map.setdefault(display_name, i) # First occurrence wins, like list.index
+    return display_options_list, interaction_options_map
 
 
 # --- Main Rendering Function for the Tab ---
@@ -81,83 +254,77 @@ def render():
 
     # --- Date Selection ---
     st.subheader("Select Interaction Date")
-    today = datetime.date.today()
-    thirty_days_ago = today - relativedelta(days=29)
-    date_range = [thirty_days_ago + datetime.timedelta(days=x) for x in range((today - thirty_days_ago).days + 1)]
-    date_options = {d.strftime("%Y-%m-%d (%A)"): d for d in sorted(date_range, reverse=True)}
-    yesterday_str = (today - relativedelta(days=1)).strftime("%Y-%m-%d (%A)")
-    default_index = 0
-    if yesterday_str in date_options: default_index = list(date_options.keys()).index(yesterday_str)
+    date_options, date_keys, default_index = _build_date_options(datetime.date.today().isoformat())
 
     selected_date_str = st.selectbox(
-        "Select Date:", options=list(date_options.keys()),
+        "Select Date:", options=date_keys,
         key="college_explorer_date_selector", index=default_index
     )
     selected_date_obj = date_options[selected_date_str]
 
     # --- Initialize State ---
     if "college_explorer_interactions" not in st.session_state: st.session_state["college_explorer_interactions"] = {}
+    if "college_explorer_interaction_options" not in st.session_state: st.session_state["college_explorer_interaction_options"] = {} # date -> (radio labels, label -> index)
     if "college_explorer_selected_interaction_index" not in st.session_state: st.session_state["college_explorer_selected_interaction_index"] = None
     if "college_explorer_fetched_data" not in st.session_state: st.session_state["college_explorer_fetched_data"] = {}
     if "college_explorer_target_selection" not in st.session_state: st.session_state["college_explorer_target_selection"] = None
+    if "college_explorer_target_display" not in st.session_state: st.session_state["college_explorer_target_display"] = None # Display text of the stored target
     if "college_explorer_generated_messages" not in st.session_state: st.session_state["college_explorer_generated_messages"] = {}
     if "college_explorer_loaded_date" not in st.session_state: st.session_state["college_explorer_loaded_date"] = None
+    if "college_explorer_shortlist_options" not in st.session_state: st.session_state["college_explorer_shortlist_options"] = {} # cache_key -> (options dict, selectbox options, option positions)
 
     # --- Fetch Interactions Button ---
     if st.button(f"Find University Interactions for {selected_date_str}", key="college_explorer_find_button"):
         st.session_state["college_explorer_selected_interaction_index"] = None
         st.session_state["college_explorer_target_selection"] = None
+        st.session_state["college_explorer_target_display"] = None
         st.session_state["college_explorer_fetched_data"] = {}
+        st.session_state["college_explorer_shortlist_options"] = {}
+        for futures_key in [k for k in st.session_state if str(k).startswith("college_explorer_rag_futures_")]: del st.session_state[futures_key]
         st.session_state["college_explorer_generated_messages"] = {}
         st.session_state["college_explorer_loaded_date"] = selected_date_str
 
         with st.spinner(f"Searching for university interactions on {selected_date_str}..."):
             try:
                 interactions = get_users_by_university_interaction(selected_date_obj)
-                st.session_state.setdefault("college_explorer_interactions", {})[selected_date_str] = interactions
+                interactions_df = _interactions_frame(interactions)
+                st.session_state["college_explorer_interactions"][selected_date_str] = interactions_df
+                st.session_state["college_explorer_interaction_options"][selected_date_str] = _build_interaction_options(interactions_df)
                 if not interactions: st.info(f"No relevant university interactions found for {selected_date_str}.")
             except Exception as e:
                 st.error(f"Database error fetching interactions: {e}")
                 logging.error(f"Error calling get_users_by_university_interaction for {selected_date_obj}: {e}", exc_info=True)
-                st.session_state.setdefault("college_explorer_interactions", {})[selected_date_str] = []
+                st.session_state["college_explorer_interactions"][selected_date_str] = _interactions_frame([])
+                st.session_state["college_explorer_interaction_options"][selected_date_str] = ([], {})
 
     # --- Display Interactions and Message Area ---
     loaded_date = st.session_state.get("college_explorer_loaded_date")
-    interactions_list = []
+    interactions_df = None
     if loaded_date == selected_date_str:
-        interactions_list = st.session_state.get("college_explorer_interactions", {}).get(selected_date_str, [])
+        interactions_df = st.session_state.get("college_explorer_interactions", {}).get(selected_date_str)
 
     if loaded_date == selected_date_str:
-        if interactions_list:
+        if interactions_df is not None and not interactions_df.empty:
             st.subheader(f"University Interactions from {selected_date_str}")
             col_interactions, col_messages_area = st.columns([2, 3])
 
             with col_interactions:
                 st.markdown("**Select Interaction:**")
                 # --- Use Index for Selection ---
-                interaction_options_map = {} # Maps display name to index
-                display_options_list = [] # Ordered list of display names for radio options
-                for i, interaction in enumerate(interactions_list):
-                    # Display Uni ID initially, name/course comes after selection
-                    display_name = f"{interaction.get('username', 'N/A')} ({interaction.get('phone', 'N/A')}) -> Uni ID: {interaction.get('university_id')} @ {interaction.get('interaction_time', '--:--')}"
-                    interaction_options_map[display_name] = i
-                    display_options_list.append(display_name)
+                # Display Uni ID initially, name/course comes after selection (labels built once when interactions were fetched)
+                display_options_list, interaction_options_map = st.session_state["college_explorer_interaction_options"][selected_date_str]
 
                 # --- CORRECTED Callback ---
                 def handle_interaction_selection_change():
                     selected_display_name = st.session_state.college_explorer_interaction_selector_radio # Get selected display name string
-                    new_selected_index = None
-                    if selected_display_name in display_options_list:
-                        try:
-                            new_selected_index = display_options_list.index(selected_display_name) # Find integer index
-                        except ValueError:
-                            new_selected_index = None
-                            logging.warning(f"Selected display name '{selected_display_name}' not found in options list.")
+                    new_selected_index = interaction_options_map.get(selected_display_name) # O(1) integer index
+                    if new_selected_index is None: logging.warning(f"Selected display name '{selected_display_name}' not found in options list.")
 
                     current_index = st.session_state.get("college_explorer_selected_interaction_index")
                     if new_selected_index is not None and current_index != new_selected_index:
                         st.session_state["college_explorer_selected_interaction_index"] = new_selected_index # Store INTEGER index
                         st.session_state["college_explorer_target_selection"] = None # Reset target uni selection
+                        st.session_state["college_explorer_target_display"] = None
                         # Clear potentially outdated fetched data/messages for the previous selection (optional)
                         # cache_key_to_clear = f"{current_index}_{loaded_date}" # Example if needed
                         # st.session_state.get("college_explorer_fetched_data", {}).pop(cache_key_to_clear, None)
@@ -178,47 +345,31 @@ def render():
             with col_messages_area:
                 selected_index = st.session_state.get("college_explorer_selected_interaction_index")
 
-                if selected_index is not None and selected_index < len(interactions_list):
-                    selected_interaction = interactions_list[selected_index]
+                if selected_index is not None and selected_index < len(interactions_df):
+                    selected_interaction = interactions_df.iloc[selected_index]
                     user_id = selected_interaction.get('user_id')
                     uni_id = selected_interaction.get('university_id') # The ID from event_logs
                     cache_key = f"{selected_index}_{selected_date_str}" # Cache key based on index/date
 
                     # --- Step 1: Fetch (or get from cache) Profile & Shortlist Data ---
-                    fetched_data = st.session_state.get("college_explorer_fetched_data", {}).get(cache_key)
-
-                    if not fetched_data:
-                        # ... (Fetching logic remains the same as previous correct version) ...
-                        st.info("Fetching user profile and shortlist data...")
-                        with st.spinner("Loading details..."):
-                            user_profile = None; shortlist_data = None; uni_name = f"ID: {uni_id}"; course_name = "N/A"
-                            try: user_profile = get_user_by_id(user_id)
-                            except Exception as e: logging.error(f"Failed fetch profile {user_id}: {e}")
-                            try:
-                                shortlist_data = get_latest_shortlist_data_and_uni_name(user_id, selected_date_obj, uni_id)
-                                if shortlist_data:
-                                    uni_name = shortlist_data.get('interacted_university_name', uni_name)
-                                    course_name = shortlist_data.get('interacted_course_name', course_name)
-                            except Exception as e: logging.error(f"Failed fetch shortlist {user_id}/{selected_date_obj}: {e}")
-                            fetched_data = {'user_profile': user_profile, 'shortlist_data': shortlist_data, 'interacted_university_name': uni_name, 'interacted_course_name': course_name}
-                            st.session_state.setdefault("college_explorer_fetched_data", {})[cache_key] = fetched_data
-                            st.rerun()
-
-                    else: # Data is fetched/cached
-                        user_profile = fetched_data.get('user_profile')
-                        shortlist_data = fetched_data.get('shortlist_data')
-
-                        if not user_profile or not shortlist_data:
-                            st.warning("Could not load necessary user profile or shortlist data for this interaction.")
+                    fetched_data = _get_or_fetch_interaction_data(cache_key, user_id, uni_id, selected_date_obj)
+                    user_profile = fetched_data.get('user_profile')
+                    shortlist_data = fetched_data.get('shortlist_data')
+
+                    if not user_profile or not shortlist_data:
+                        st.warning("Could not load necessary user profile or shortlist data for this interaction.")
+                    else:
+                        # --- Step 2: Display Top 5 Shortlist Options ---
+                        st.subheader("Top Shortlist Options (from Interaction Date):")
+                        top_courses = shortlist_data.get('top_shortlisted_courses', [])
+
+                        if not top_courses or (len(top_courses)==1 and "Error" in top_courses[0]['name']):
+                             st.warning("No shortlist courses found or shortlist failed to parse.")
                         else:
-                            # --- Step 2: Display Top 5 Shortlist Options ---
-                            st.subheader("Top Shortlist Options (from Interaction Date):")
-                            top_courses = shortlist_data.get('top_shortlisted_courses', [])
-
-                            if not top_courses or (len(top_courses)==1 and "Error" in top_courses[0]['name']):
-                                 st.warning("No shortlist courses found or shortlist failed to parse.")
-                            else:
-                                 # --- Step 3: Select Target University/Course ---
+                             # --- Step 3: Select Target University/Course ---
+                             # Built once per interaction (top_courses is fixed for a cache_key), reused on reruns
+                             shortlist_options_cache = st.session_state["college_explorer_shortlist_options"]
+                             if cache_key not in shortlist_options_cache:
                                  shortlist_display_options = {}
                                  for idx, course_info in enumerate(top_courses):
                                      uni_name = course_info.get('university', 'N/A')
@@ -232,94 +383,116 @@ def render():
                                          "course_name": course_name,
                                          "university_id": uni_id_from_shortlist
                                      }
-
-                                 target_selector_key = f"college_explorer_target_selector_{cache_key}"
-                                 # Use st.session_state.get to check existing selection for persistence
-                                 current_target_selection_data = st.session_state.get("college_explorer_target_selection")
-                                 current_target_display = None
-                                 if current_target_selection_data:
-                                     # Find the display text matching the stored selection data
-                                     for dt, data in shortlist_display_options.items():
-                                         if data == current_target_selection_data:
-                                             current_target_display = dt
-                                             break
-
-                                 selected_target_display = st.selectbox(
-                                     "Choose a shortlisted option to generate messages for:",
-                                     options=["-- Select --"] + list(shortlist_display_options.keys()),
-                                     # Set index based on current selection if it exists in options
-                                     index= (list(shortlist_display_options.keys()).index(current_target_display) + 1) if current_target_display else 0,
-                                     key=target_selector_key
-                                 )
-
-                                 # --- Step 4: Store Selection and Show Generate Button ---
-                                 if selected_target_display != "-- Select --":
-                                     selected_target_data = shortlist_display_options[selected_target_display]
-                                     # Store the choice if it changed
-                                     if st.session_state.get("college_explorer_target_selection") != selected_target_data:
-                                        st.session_state["college_explorer_target_selection"] = selected_target_data
-                                        # Clear messages when target changes
-                                        message_cache_key = f"{cache_key}_{selected_target_display}"
-                                        st.session_state.get("college_explorer_generated_messages", {}).pop(message_cache_key, None)
-
-
-                                     # Display Generate button only after a target is selected
-                                     st.markdown("---")
-                                     generate_button_key = f"college_generate_btn_{cache_key}_{selected_target_display}" # Unique button key
-                                     if st.button("Generate Messages", key=generate_button_key):
-                                         # --- Step 5: Generate Messages ---
-                                         target_uni_name = selected_target_data.get("university_name")
-                                         target_course_name = selected_target_data.get("course_name")
-                                         target_uni_id = selected_target_data.get("university_id")
-                                         query_profile_data = shortlist_data.get('query_profile_data', {})
-
-                                         if target_uni_name and target_course_name:
-                                             with st.spinner("AI is crafting messages..."):
-                                                 try:
-                                                     messages = generate_college_explorer_messages(
-                                                         user_profile=user_profile,
-                                                         target_university_name=target_uni_name,
-                                                         target_course_name=target_course_name,
-                                                         target_university_id=target_uni_id,
-                                                         query_profile_data=query_profile_data
-                                                     )
-                                                     message_cache_key = f"{cache_key}_{selected_target_display}"
-                                                     st.session_state.setdefault("college_explorer_generated_messages", {})[message_cache_key] = messages
-                                                 except Exception as e:
-                                                     st.error(f"Error during message generation: {e}")
-                                                     logging.error(f"Msg gen error for target {target_uni_name}: {e}", exc_info=True)
-                                                     # Store error message to display
-                                                     message_cache_key = f"{cache_key}_{selected_target_display}"
-                                                     st.session_state.setdefault("college_explorer_generated_messages", {})[message_cache_key] = [f"Error generating: {e}"]
-
-                                         else:
-                                              st.warning("Invalid target selection data.")
-
-                                 # --- Step 6: Display Generated Messages ---
-                                 selected_target = st.session_state.get("college_explorer_target_selection")
-                                 # Check if the currently selected display option matches the stored target data
-                                 if selected_target and selected_target_display != "-- Select --" and selected_target == shortlist_display_options[selected_target_display]:
-                                      message_cache_key = f"{cache_key}_{selected_target_display}"
-                                      generated_messages = st.session_state.get("college_explorer_generated_messages", {}).get(message_cache_key)
-
-                                      if generated_messages:
-                                           st.markdown("---")
-                                           st.subheader("Generated Messages:")
-                                           # Check if the first message indicates an error
-                                           if isinstance(generated_messages, list) and generated_messages and "Error" in generated_messages[0]:
-                                                st.error(generated_messages[0])
-                                           else:
-                                                st.success(f"Showing {len(generated_messages)} messages for **{selected_target.get('university_name')} - {selected_target.get('course_name')}**:")
-                                                for i, msg in enumerate(generated_messages, 1):
-                                                    msg_display_key = f"college_msg_{message_cache_key}_{i}" # Unique key
-                                                    st.text_area(f"Message {i}", value=msg, height=110, key=msg_display_key, help="You can copy this message.")
+                                 shortlist_select_options = ["-- Select --"] + list(shortlist_display_options)
+                                 shortlist_options_cache[cache_key] = (shortlist_display_options, shortlist_select_options, {display: position for position, display in enumerate(shortlist_select_options)})
+                             shortlist_display_options, shortlist_select_options, shortlist_option_positions = shortlist_options_cache[cache_key]
+                             rag_futures_key = f"college_explorer_rag_futures_{cache_key}" # display text -> prefetch started for that target
+
+                             target_selector_key = f"college_explorer_target_selector_{cache_key}"
+                             # Restore the stored selection by its display text ("-- Select --" is position 0)
+                             current_target_index = shortlist_option_positions.get(st.session_state.get("college_explorer_target_display"), 0)
+
+                             selected_target_display = st.selectbox(
+                                 "Choose a shortlisted option to generate messages for:",
+                                 options=shortlist_select_options,
+                                 # Set index based on current selection if it exists in options
+                                 index=current_target_index,
+                                 key=target_selector_key
+                             )
+
+                             # --- Step 4: Store Selection and Show Generate Button ---
+                             if selected_target_display != "-- Select --":
+                                 selected_target_data = shortlist_display_options[selected_target_display]
+                                 # Fetch the selected target's university details while the operator reads / presses Generate
+                                 started_prefetches = st.session_state.setdefault(rag_futures_key, {})
+                                 if selected_target_display not in started_prefetches:
+                                     started_prefetches[selected_target_display] = _prefetch_uni_details(selected_target_data, shortlist_data.get('query_profile_data', {}))
+                                 # Store the choice if it changed
+                                 if st.session_state.get("college_explorer_target_selection") != selected_target_data:
+                                    st.session_state["college_explorer_target_selection"] = selected_target_data
+                                    st.session_state["college_explorer_target_display"] = selected_target_display
+                                    # Messages are keyed per target, so earlier results (e.g. from "Generate for all") stay valid
+
+
+                                 # Display Generate button only after a target is selected
+                                 st.markdown("---")
+                                 generate_button_key = f"college_generate_btn_{cache_key}_{selected_target_display}" # Unique button key
+                                 if st.button("Generate Messages", key=generate_button_key):
+                                     # --- Step 5: Generate Messages ---
+                                     target_uni_name = selected_target_data.get("university_name")
+                                     target_course_name = selected_target_data.get("course_name")
+                                     target_uni_id = selected_target_data.get("university_id")
+                                     query_profile_data = shortlist_data.get('query_profile_data', {})
+
+                                     if target_uni_name and target_course_name:
+                                         with st.spinner("AI is crafting messages..."):
+                                             try:
+                                                 messages = generate_college_explorer_messages(
+                                                     user_profile=user_profile,
+                                                     target_university_name=target_uni_name,
+                                                     target_course_name=target_course_name,
+                                                     target_university_id=target_uni_id,
+                                                     query_profile_data=query_profile_data
+                                                 )
+                                                 message_cache_key = f"{cache_key}_{selected_target_display}"
+                                                 st.session_state["college_explorer_generated_messages"][message_cache_key] = messages
+                                             except Exception as e:
+                                                 st.error(f"Error during message generation: {e}")
+                                                 logging.error(f"Msg gen error for target {target_uni_name}: {e}", exc_info=True)
+                                                 # Store error message to display
+                                                 message_cache_key = f"{cache_key}_{selected_target_display}"
+                                                 st.session_state["college_explorer_generated_messages"][message_cache_key] = [f"Error generating: {e}"]
+
+                                     else:
+                                          st.warning("Invalid target selection data.")
+
+                             # Generate for every shortlist option at once (RAG lookups run in parallel)
+                             if st.button("Generate for all shortlist options", key=f"college_generate_all_btn_{cache_key}"):
+                                 query_profile_data = shortlist_data.get('query_profile_data', {})
+                                 all_targets = [(display, data) for display, data in shortlist_display_options.items() if data.get("university_name") and data.get("course_name")]
+                                 with st.spinner(f"AI is crafting messages for {len(all_targets)} options..."):
+                                     try:
+                                         all_messages = generate_many([{
+                                             "user_profile": user_profile,
+                                             "target_university_name": data.get("university_name"),
+                                             "target_course_name": data.get("course_name"),
+                                             "target_university_id": data.get("university_id"),
+                                             "query_profile_data": query_profile_data
+                                         } for _, data in all_targets])
+                                         generated_store = st.session_state["college_explorer_generated_messages"]
+                                         for (display, _), messages in zip(all_targets, all_messages): generated_store[f"{cache_key}_{display}"] = messages
+                                         st.success(f"Generated messages for {len(all_targets)} options. Select one above to view them.")
+                                     except Exception as e:
+                                         st.error(f"Error during message generation: {e}")
+                                         logging.error(f"Bulk msg gen error for {cache_key}: {e}", exc_info=True)
+
+                             # --- Step 6: Display Generated Messages ---
+                             selected_target = st.session_state.get("college_explorer_target_selection")
+                             # Check if the currently selected display option matches the stored target data
+                             if selected_target and selected_target_display != "-- Select --" and selected_target == shortlist_display_options[selected_target_display]:
+                                  message_cache_key = f"{cache_key}_{selected_target_display}"
+                                  generated_messages = st.session_state.get("college_explorer_generated_messages", {}).get(message_cache_key)
+
+                                  if generated_messages:
+                                       st.markdown("---")
+                                       st.subheader("Generated Messages:")
+                                       # Check if the first message indicates an error
+                                       if isinstance(generated_messages, list) and generated_messages and "Error" in generated_messages[0]:
+                                            st.error(generated_messages[0])
+                                       else:
+                                            st.success(f"Showing {len(generated_messages)} messages for **{selected_target.get('university_name')} - {selected_target.get('course_name')}**:")
+                                            # st.code blocks (copy button, no widget state) instead of text_areas; not hand-built
+                                            # fences, which a message containing ``` (e.g. from a RAG detail) would break out of
+                                            for i, msg in enumerate(generated_messages, 1):
+                                                 st.markdown(f"**Message {i}**")
+                                                 st.code(msg, language=None, wrap_lines=True)
 
 
                 else: # No interaction selected
                     st.info("Select a user/university interaction from the list on the left.")
 
         # Handle case where interaction list is empty after fetch for the selected date
-        elif loaded_date == selected_date_str and not interactions_list:
+        elif loaded_date == selected_date_str:
             # Message shown inside button logic if fetch returned empty
              pass
 
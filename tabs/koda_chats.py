@@ -3,19 +3,22 @@
 import streamlit as st
 import logging
 import datetime
-from dateutil.relativedelta import relativedelta
+import hashlib
 import json
+import os
+try: import orjson # Optional: faster parsing of the (often tens of KB) conversation histories
+except ImportError: orjson = None
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, Any, List
 
 # --- Import Core Logic ---
 try:
     # Import NEW DB functions
-    from db_connection import get_combined_chat_users_on_date, get_ielts_user_profile, get_latest_shortlist_details
-    # Use a potentially more capable model for summarization
-    from langchain_openai import ChatOpenAI
-    from langchain_core.prompts import ChatPromptTemplate
-    from langchain_core.output_parsers import StrOutputParser
-    import os
+    from db_connection import get_combined_chat_users_with_profiles_on_date, get_ielts_user_profile, get_latest_shortlist_details
+    # LangChain/OpenAI/tiktoken are imported lazily where first needed (_get_chain etc.): a heavy import tree
+    # that page loads which never summarize shouldn't pay for
 except ImportError as e:
     st.error(f"(Koda Chats Tab) Failed to import required modules: {e}. Check file structure.")
     logging.error(f"(Koda Chats Tab) Module import error: {e}", exc_info=True)
@@ -24,64 +27,406 @@ except ImportError as e:
 
 # --- Helper Functions ---
 
-# Intent classification (remains the same)
+# Intent classification: a keyword counts once if it appears anywhere (substring, case-insensitive), like `keyword in text.lower()`.
+# One compiled pass finds them all; the zero-width lookahead also catches keywords that overlap another match.
+IELTS_KEYWORDS = frozenset(["ielts", "band", "score", "test", "exam", "listening", "reading", "writing", "speaking", "english proficiency"])
+STUDY_ABROAD_KEYWORDS = frozenset(["university", "college", "course", "country", "visa", "apply", "admission", "study abroad", "program", "korea", "usa", "canada", "uk", "australia", "germany", "shortlist"])
+_INTENT_KEYWORD_RE = re.compile("(?=(" + "|".join(map(re.escape, sorted(IELTS_KEYWORDS | STUDY_ABROAD_KEYWORDS, key=len, reverse=True))) + "))", re.IGNORECASE)
+
 def classify_intent(conv_history_str: Optional[str]) -> str:
     if not conv_history_str: return "Unknown"
-    text = conv_history_str.lower()
-    ielts_keywords = ["ielts", "band", "score", "test", "exam", "listening", "reading", "writing", "speaking", "english proficiency"]
-    study_abroad_keywords = ["university", "college", "course", "country", "visa", "apply", "admission", "study abroad", "program", "korea", "usa", "canada", "uk", "australia", "germany", "shortlist"]
-    ielts_score = sum(keyword in text for keyword in ielts_keywords)
-    study_abroad_score = sum(keyword in text for keyword in study_abroad_keywords)
+    found_keywords = set()
+    ielts_score = study_abroad_score = 0
+    for match in _INTENT_KEYWORD_RE.finditer(conv_history_str): # Counted incrementally so the scan can stop early
+        keyword = match.group(1).lower()
+        if keyword in found_keywords: continue
+        found_keywords.add(keyword)
+        if keyword in IELTS_KEYWORDS: ielts_score += 1
+        if keyword in STUDY_ABROAD_KEYWORDS: study_abroad_score += 1
+        if study_abroad_score >= len(IELTS_KEYWORDS): break # IELTS can no longer score strictly higher: Study Abroad wins
     if ielts_score > study_abroad_score and ielts_score > 0: return "IELTS"
     elif study_abroad_score > 0: return "Study Abroad"
     else: return "General/Unknown"
 
+USER_TURN_SEPARATOR = "\n---\n"
+
+def extract_user_turns(conv_history_str: Optional[str]) -> str:
+    """User-role messages of a Koda conversation, separated by '---' ("" if none or the history can't be parsed)."""
+    try:
+        conv_data = (orjson.loads if orjson is not None else json.loads)(conv_history_str or '{}')
+        history_list = conv_data if type(conv_data) is list else conv_data.get("conv_history", []) if isinstance(conv_data, dict) else []
+        # Separate turns clearly
+        return USER_TURN_SEPARATOR.join(turn['content'] for turn in history_list if isinstance(turn, dict) and turn.get('role') == 'user' and turn.get('content'))
+    except Exception as e:
+        logging.error(f"Error extracting user messages: {e}")
+        return ""
+
+# Persistent LLM-level cache for summaries: keyed on (model params, prompt), shared across reruns, sessions and restarts.
+# Passed per model (not set_llm_cache) so the RAG answer chain keeps its own caching.
+SUMMARY_LLM_CACHE_PATH = os.getenv("KODA_LLM_CACHE_PATH", os.path.join(".cache", "koda_llm_cache.db"))
+_summary_llm_cache = None
+
+def _get_summary_llm_cache():
+    global _summary_llm_cache
+    if _summary_llm_cache is None:
+        from langchain_community.cache import SQLiteCache
+        os.makedirs(os.path.dirname(SUMMARY_LLM_CACHE_PATH) or ".", exist_ok=True)
+        _summary_llm_cache = SQLiteCache(database_path=SUMMARY_LLM_CACHE_PATH)
+    return _summary_llm_cache
+
+def conversation_hash(conv_history_str: Optional[str]) -> str:
+    """Content key for a conversation: identical histories (any user, any date) share extracted text and summary."""
+    return hashlib.sha1((conv_history_str or "").encode("utf-8")).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=2048)
+def _cached_user_turns(conv_hash: str, _conv_history_str: Optional[str]) -> str:
+    # Leading underscore: Streamlit keys the cache on the hash only, not the (long) history string
+    return extract_user_turns(_conv_history_str)
+
+SUMMARY_SYSTEM_PROMPT = "You are an expert assistant analyzing chat logs between a student and an AI counselor (Koda). Your task is to carefully read ONLY the messages from the 'user' role provided below and identify the user's primary questions, goals, problems, or points of confusion regarding their study abroad journey or IELTS preparation. Ignore the assistant's responses. Synthesize these user points into a concise 2-4 sentence summary. Focus on *what the user was trying to achieve or figure out*. Do not just list topics."
+SUMMARY_INPUT_TOKEN_BUDGET = 2500 # Most recent user turns that fit are summarized; older ones are dropped whole
+SUMMARY_FAST_PATH_CHARS = 2000 # Shorter inputs are always within budget, skip tokenizing them
+SUMMARY_BATCH_SIZE = 6 # Users per batched prompt; larger batches degrade per-item quality
+_JSON_ARRAY_RE = re.compile(r"\[.*\]", re.DOTALL) # Outermost [...], ignoring any ```json fence
+
+# Chains (prompt | ChatOpenAI | parser) are built lazily once per model and reused,
+# so each summary only pays for .invoke() and keeps the same pooled HTTP client
+_SUMMARY_MESSAGES = [
+    ("system", SUMMARY_SYSTEM_PROMPT),
+    ("human", "User Messages:\n---\n{user_input}\n---\nSummary of User's Key Points:")
+]
+_BATCH_SUMMARY_MESSAGES = [
+    ("system", SUMMARY_SYSTEM_PROMPT + " You will receive several users, each in a numbered [USER n] block; summarize each one independently. Respond ONLY with a JSON array of summary strings, one per user block, in the same order."),
+    ("human", "{user_blocks}")
+]
+_OPENAI_KEY = os.getenv("OPENAI_API_KEY") # Read once at import (app.py loads .env before importing the tabs)
+# Fixed ChatOpenAI settings; the explicit timeout keeps a stuck request from hanging the whole rerun
+_SUMMARY_LLM_KWARGS = {"temperature": 0.1, "timeout": 20, "max_retries": 2}
+_summary_chains: Dict[tuple, Any] = {} # (model_name, batched) -> chain
+_summary_chains_lock = threading.Lock()
+
+def _get_chain(model_name: str, batched: bool = False):
+    chain = _summary_chains.get((model_name, batched))
+    if chain is None:
+        with _summary_chains_lock:
+            chain = _summary_chains.get((model_name, batched))
+            if chain is None:
+                from langchain_openai import ChatOpenAI # Deferred: first summary pays the import, not every page load
+                from langchain_core.prompts import ChatPromptTemplate
+                from langchain_core.output_parsers import StrOutputParser
+                prompt = ChatPromptTemplate.from_messages(_BATCH_SUMMARY_MESSAGES if batched else _SUMMARY_MESSAGES)
+                max_tokens = 200 * SUMMARY_BATCH_SIZE if batched else 200 # Increase tokens slightly
+                llm = ChatOpenAI(model_name=model_name, openai_api_key=_OPENAI_KEY, max_tokens=max_tokens, cache=_get_summary_llm_cache(), **_SUMMARY_LLM_KWARGS)
+                chain = _summary_chains[(model_name, batched)] = prompt | llm | StrOutputParser()
+    return chain
+
+_token_encoding = None
+
+def _get_token_encoding():
+    global _token_encoding
+    if _token_encoding is None:
+        import tiktoken
+        _token_encoding = tiktoken.encoding_for_model("gpt-4o") # Same encoding for gpt-4o-mini
+    return _token_encoding
+
+def _truncate_summary_input(user_messages: str) -> str:
+    """Keeps whole user turns, newest first, within SUMMARY_INPUT_TOKEN_BUDGET (instead of cutting mid-sentence)."""
+    if len(user_messages) < SUMMARY_FAST_PATH_CHARS: return user_messages
+    encoding = _get_token_encoding()
+    turns = user_messages.split(USER_TURN_SEPARATOR)
+    separator_tokens = len(encoding.encode(USER_TURN_SEPARATOR))
+    kept_turns, used_tokens = [], 0
+    for turn in reversed(turns):
+        turn_tokens = len(encoding.encode(turn)) + (separator_tokens if kept_turns else 0)
+        if used_tokens + turn_tokens > SUMMARY_INPUT_TOKEN_BUDGET: break
+        kept_turns.append(turn); used_tokens += turn_tokens
+    if not kept_turns: return encoding.decode(encoding.encode(turns[-1])[:SUMMARY_INPUT_TOKEN_BUDGET]) + "..." # Latest turn alone is over budget
+    kept_turns.reverse()
+    return ("..." + USER_TURN_SEPARATOR if len(kept_turns) < len(turns) else "") + USER_TURN_SEPARATOR.join(kept_turns)
+
+# Model routing: short histories go to the cheaper/faster model; the requested model handles long ones
+# and re-does any small-model summary that comes back implausibly short
+SUMMARY_SMALL_MODEL = "gpt-4o-mini"
+SUMMARY_SMALL_MODEL_MAX_CHARS = 4000
+SUMMARY_MIN_CHARS = 40
+
+def _route_summary_model(user_messages: str, model_name: str) -> str:
+    return SUMMARY_SMALL_MODEL if len(user_messages) < SUMMARY_SMALL_MODEL_MAX_CHARS else model_name
+
+def _needs_fallback(summary: Optional[str], chosen_model: str, model_name: str) -> bool:
+    return chosen_model != model_name and len((summary or "").strip()) < SUMMARY_MIN_CHARS
+
+def get_chat_summaries_batch(user_messages_list: List[str], model_name: str = "gpt-4o") -> List[str]:
+    """
+    Summaries for many users with one LLM request per SUMMARY_BATCH_SIZE users (batches sent concurrently).
+    A batch whose reply isn't a JSON array of the right length falls back to per-user get_chat_summary_v2.
+    """
+    if not _OPENAI_KEY: return ["Error: OPENAI_API_KEY not configured."] * len(user_messages_list)
+    batches = [user_messages_list[i:i + SUMMARY_BATCH_SIZE] for i in range(0, len(user_messages_list), SUMMARY_BATCH_SIZE)]
+    inputs = [{"user_blocks": "\n\n".join(f"[USER {n}]\n{_truncate_summary_input(text)}" for n, text in enumerate(batch, 1))} for batch in batches]
+    batch_models = [_route_summary_model(max(batch, key=len), model_name) for batch in batches] # A batch is routed by its longest history
+    replies: List[Any] = [None] * len(batches)
+    for chosen_model in set(batch_models):
+        positions = [i for i, batch_model in enumerate(batch_models) if batch_model == chosen_model]
+        logging.info(f"Requesting summaries in {len(positions)} batched calls using model: {chosen_model}")
+        try: results = _get_chain(chosen_model, batched=True).batch([inputs[i] for i in positions], config={"max_concurrency": 4}, return_exceptions=True)
+        except Exception as e:
+            logging.error(f"Batched chat summarization failed: {e}", exc_info=True); results = [e] * len(positions)
+        for i, result in zip(positions, results): replies[i] = result
+    summaries: List[Optional[str]] = []
+    fallback_positions = [] # Users whose batch reply was unusable; summarized individually, all at once
+    for batch, reply in zip(batches, replies):
+        parsed = None
+        if isinstance(reply, str) and (match := _JSON_ARRAY_RE.search(reply)):
+            try: parsed = json.loads(match.group(0))
+            except ValueError: parsed = None
+        if isinstance(parsed, list) and len(parsed) == len(batch) and all(isinstance(item, str) and len(item.strip()) >= SUMMARY_MIN_CHARS for item in parsed):
+            summaries.extend(item.strip() for item in parsed)
+        else:
+            logging.warning(f"Batched summary reply unusable ({type(reply).__name__}); summarizing {len(batch)} users individually.")
+            fallback_positions.extend(range(len(summaries), len(summaries) + len(batch)))
+            summaries.extend([None] * len(batch))
+    if fallback_positions:
+        for i, summary in zip(fallback_positions, _get_chat_summaries_concurrently([user_messages_list[i] for i in fallback_positions], model_name)):
+            summaries[i] = summary
+    return summaries
+
+def _get_chat_summaries_concurrently(user_messages_list: List[str], model_name: str = "gpt-4o") -> List[str]:
+    """
+    get_chat_summary_v2 for each text (same routing and small-model fallback), with all requests in flight together
+    via the chains' batch (thread pool) instead of one round-trip after another.
+    """
+    chosen_models = [_route_summary_model(text, model_name) for text in user_messages_list]
+    results: List[Any] = [None] * len(user_messages_list)
+
+    def _summarize_with(chain_model: str, positions: List[int]) -> None:
+        try: replies = _get_chain(chain_model).batch([{"user_input": _truncate_summary_input(user_messages_list[i])} for i in positions], config={"max_concurrency": 8}, return_exceptions=True)
+        except Exception as e:
+            logging.error(f"Concurrent chat summarization failed: {e}", exc_info=True); replies = [e] * len(positions)
+        for i, reply in zip(positions, replies): results[i] = reply
+
+    logging.info(f"Requesting {len(user_messages_list)} individual summaries concurrently")
+    for chosen_model in set(chosen_models): _summarize_with(chosen_model, [i for i, m in enumerate(chosen_models) if m == chosen_model])
+    retry_positions = [i for i, result in enumerate(results) if not isinstance(result, Exception) and _needs_fallback(result, chosen_models[i], model_name)]
+    if retry_positions:
+        logging.info(f"{len(retry_positions)} small-model summaries too short; retrying with {model_name}")
+        _summarize_with(model_name, retry_positions)
+    summaries = []
+    for result in results:
+        if isinstance(result, Exception):
+            logging.error(f"Error during chat summarization V2: {result}")
+            summaries.append(f"Error generating summary: {result}")
+        else: summaries.append(result if result else "Could not generate summary.")
+    return summaries
+
 # V2 Summarization function - Improved Prompt & Model
-@st.cache_data(show_spinner=False) # Cache the summary result
 def get_chat_summary_v2(user_messages: str, model_name: str = "gpt-4o") -> str: # Use gpt-4o
     """Generates a refined summary focusing on user's questions/goals using OpenAI."""
     if not user_messages:
         return "No user messages found in the conversation history."
-    logging.info(f"Requesting summary using model: {model_name}")
+    chosen_model = _route_summary_model(user_messages, model_name)
+    logging.info(f"Requesting summary using model: {chosen_model}")
     try:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key: return "Error: OPENAI_API_KEY not configured."
-
-        llm = ChatOpenAI(model_name=model_name, temperature=0.1, openai_api_key=api_key, max_tokens=200) # Increase tokens slightly
-
-        # Refined prompt
-        prompt_template = ChatPromptTemplate.from_messages([
-            ("system", "You are an expert assistant analyzing chat logs between a student and an AI counselor (Koda). Your task is to carefully read ONLY the messages from the 'user' role provided below and identify the user's primary questions, goals, problems, or points of confusion regarding their study abroad journey or IELTS preparation. Ignore the assistant's responses. Synthesize these user points into a concise 2-4 sentence summary. Focus on *what the user was trying to achieve or figure out*. Do not just list topics."),
-            ("human", "User Messages:\n---\n{user_input}\n---\nSummary of User's Key Points:")
-        ])
-
-        chain = prompt_template | llm | StrOutputParser()
-        max_input_length = 10000 # Allow longer input for potentially combined history
-        truncated_input = user_messages[:max_input_length] + ("..." if len(user_messages) > max_input_length else "")
-        summary = chain.invoke({"user_input": truncated_input})
+        if not _OPENAI_KEY: return "Error: OPENAI_API_KEY not configured."
+        summary = _get_chain(chosen_model).invoke({"user_input": _truncate_summary_input(user_messages)})
+        if _needs_fallback(summary, chosen_model, model_name):
+            logging.info(f"{chosen_model} summary too short; retrying with {model_name}")
+            summary = _get_chain(model_name).invoke({"user_input": _truncate_summary_input(user_messages)})
         return summary if summary else "Could not generate summary."
 
     except Exception as e:
         logging.error(f"Error during chat summarization V2: {e}", exc_info=True)
         return f"Error generating summary: {e}"
 
+def _stream_cached_summary(model_name: str, user_input: str) -> str:
+    """
+    One summary from the SQLite LLM cache if present, else streamed onto the page and written back.
+    chain.stream() bypasses the model's cache, so the lookup/update mirrors what .invoke() does (same keys).
+    """
+    from langchain_core.load import dumps
+    from langchain_core.messages import AIMessage
+    from langchain_core.outputs import ChatGeneration
+    chain = _get_chain(model_name)
+    prompt, llm = chain.first, chain.steps[1]
+    prompt_key, llm_string = dumps(prompt.invoke({"user_input": user_input}).to_messages()), llm._get_llm_string()
+    cache = _get_summary_llm_cache()
+    cached = cache.lookup(prompt_key, llm_string)
+    if cached: return cached[0].text
+    summary = st.write_stream(chain.stream({"user_input": user_input}))
+    if summary: cache.update(prompt_key, llm_string, [ChatGeneration(message=AIMessage(content=summary))])
+    return summary
+
+def _stream_chat_summary(user_messages: str, model_name: str = "gpt-4o") -> str:
+    """Like get_chat_summary_v2, but writes tokens to the page as they arrive; returns the full summary."""
+    if not _OPENAI_KEY: return "Error: OPENAI_API_KEY not configured."
+    chosen_model = _route_summary_model(user_messages, model_name)
+    logging.info(f"Streaming summary using model: {chosen_model}")
+    try:
+        summary = _stream_cached_summary(chosen_model, _truncate_summary_input(user_messages))
+        if _needs_fallback(summary, chosen_model, model_name):
+            logging.info(f"{chosen_model} summary too short; retrying with {model_name}")
+            summary = _stream_cached_summary(model_name, _truncate_summary_input(user_messages))
+        return summary if summary else "Could not generate summary."
+    except Exception as e:
+        logging.error(f"Error during streamed chat summarization: {e}", exc_info=True)
+        return f"Error generating summary: {e}"
+
+_UNCACHEABLE_SUMMARIES = ("Error", "Could not generate summary.") # Failure/fallback text: retried on the next Find/selection
+
+def _is_cacheable_summary(summary: Optional[str]) -> bool:
+    return bool(summary) and not summary.startswith(_UNCACHEABLE_SUMMARIES)
+
+def _fetch_ielts_profile(user_id: str) -> Dict[str, Any]:
+    try: return get_ielts_user_profile(user_id) or {"status": "Not Found"}
+    except Exception as e:
+        logging.error(f"Error fetching IELTS profile for {user_id}: {e}")
+        return {"status": "Error"}
+
+def _fetch_shortlist_profile(user_id: str) -> Dict[str, Any]:
+    try:
+        latest_shortlist = get_latest_shortlist_details(user_id)
+        if latest_shortlist and 'query_profile_data' in latest_shortlist: return latest_shortlist['query_profile_data']
+        return {"status": "Not Found"}
+    except Exception as e:
+        logging.error(f"Error fetching shortlist details for {user_id}: {e}")
+        return {"status": "Error"}
+
+def _prefetched_or_not_found(profile: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"status": "Not Found"} if profile is None else profile
+
+def _fetch_user_details(selected_user_data: Dict[str, Any], summary: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Summary (unless already batched), IELTS profile and shortlist profile for one user. The two DB lookups run
+    in the background while a missing summary is streamed onto the page from the script thread.
+    """
+    user_id = selected_user_data.get('user_id')
+    with ThreadPoolExecutor(max_workers=2) as executor: # DB round-trips not covered by the bulk prefetch overlap with the OpenAI stream
+        # Keys set by get_combined_chat_users_with_profiles_on_date (None = no record); missing if the bulk fetch failed
+        ielts_future = None if 'ielts_profile' in selected_user_data else executor.submit(_fetch_ielts_profile, user_id)
+        shortlist_future = None if 'shortlist_profile_data' in selected_user_data else executor.submit(_fetch_shortlist_profile, user_id)
+        if not summary:
+            conv_history_str = selected_user_data.get('latest_conv_history_str')
+            user_messages_text = _cached_user_turns(selected_user_data.get('conv_hash') or conversation_hash(conv_history_str), conv_history_str)
+            if not user_messages_text.strip(): summary = "Could not extract user messages for summary."
+            else:
+                st.markdown("**Chat Summary (User's Input Focus):**")
+                summary = _stream_chat_summary(user_messages_text)
+        with st.spinner("Loading IELTS profile and shortlist data..."):
+            return {
+                "summary": summary,
+                "ielts_profile": ielts_future.result() if ielts_future else _prefetched_or_not_found(selected_user_data['ielts_profile']),
+                "shortlist_profile": shortlist_future.result() if shortlist_future else _prefetched_or_not_found(selected_user_data['shortlist_profile_data']),
+            }
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _build_date_options(today_iso: str) -> tuple[Dict[str, datetime.date], List[str], int]:
+    """Last 30 days as {"YYYY-MM-DD (Weekday)": date}, newest first, its label list and yesterday's position. Built once per day."""
+    today = datetime.date.fromisoformat(today_iso)
+    date_keys = [(today - datetime.timedelta(days=x)).strftime("%Y-%m-%d (%A)") for x in range(30)] # Newest first
+    date_options = {label: today - datetime.timedelta(days=x) for x, label in enumerate(date_keys)}
+    return date_options, date_keys, 1 # Default to yesterday
+
+
+def _ielts_profile_markdown(ielts_profile: Dict[str, Any]) -> str:
+    if ielts_profile and ielts_profile.get("status") != "Not Found" and ielts_profile.get("status") != "Error":
+        return "\n".join([
+            f"- **Target Country:** {ielts_profile.get('DreamCountry', 'N/A')}",
+            f"- **IELTS Status:** {ielts_profile.get('ielts_status', 'N/A')}",
+            f"- **Study Abroad Status:** {ielts_profile.get('study_abroad_status', 'N/A')}",
+            f"- **Funds:** {ielts_profile.get('Funds', 'N/A')}",
+            f"- **Goal:** {ielts_profile.get('goal', 'N/A')}",
+            f"- **Category/SubCategory:** {ielts_profile.get('category', 'N/A')} / {ielts_profile.get('subCategory', 'N/A')}",
+            f"- **IELTS Attempts:** {ielts_profile.get('ielts_attempts', 'N/A')}",
+            f"- **Work Status:** {ielts_profile.get('work_status', 'N/A')}"
+        ])
+    elif ielts_profile.get("status") == "Not Found": return "*No specific IELTS profile found.*"
+    else: return "*Error loading IELTS profile.*"
+
+def _shortlist_profile_markdown(shortlist_profile_data: Dict[str, Any]) -> str:
+    if shortlist_profile_data and shortlist_profile_data.get("status") != "Not Found" and shortlist_profile_data.get("status") != "Error":
+        query_items = [f"- **{k.replace('_', ' ').title()}:** {v}" for k, v in shortlist_profile_data.items() if k != 'error' and v]
+        return "\n".join(query_items) if query_items else "*No details found in latest shortlist query.*"
+    elif shortlist_profile_data.get("status") == "Not Found": return "*No shortlist record found for this user.*"
+    else: return "*Error loading shortlist profile.*"
+
+
+@st.fragment
+def _render_user_activity(loaded_date: str) -> None:
+    """User list + details panel. A fragment, so picking a user reruns only this part, not the date/fetch controls."""
+    chat_users_list = st.session_state["koda_chats_user_list"].get(loaded_date, []) # From session state, not an argument
+    col_users, col_details = st.columns([1, 2])
+
+    with col_users:
+        st.markdown("**Select User:**")
+        display_list = st.session_state["koda_chats_display_list"].get(loaded_date, [])
+
+        # Options are positions, so the widget value is the selected index (no label -> index lookup)
+        st.session_state["koda_chats_selected_user_index"] = st.radio( "Users with Activity:", options=range(len(display_list)),
+            format_func=display_list.__getitem__,
+            key="koda_chats_user_selector_radio",
+            index=st.session_state["koda_chats_selected_user_index"],
+        )
+
+    # --- Right Column: Summary & Profiles ---
+    with col_details:
+        selected_index = st.session_state["koda_chats_selected_user_index"]
+
+        if selected_index is not None and selected_index < len(chat_users_list):
+            selected_user_data = chat_users_list[selected_index]
+            cache_key = f"{selected_index}_{loaded_date}" # Cache key
+
+            st.subheader(f"Details for {selected_user_data.get('username', 'N/A')}")
+
+            # --- Fetch (once, concurrently) then Display Summary & Profiles ---
+            summary_slot = st.empty() # A streamed summary is replaced in place by the final rendering below
+            combined = st.session_state["koda_chats_combined"].get(cache_key)
+            if combined is None:
+                conv_hash = selected_user_data.get('conv_hash') or conversation_hash(selected_user_data.get('latest_conv_history_str'))
+                with summary_slot.container():
+                    combined = _fetch_user_details(selected_user_data, st.session_state["koda_chats_summary"].get(conv_hash))
+                combined["ielts_md"] = _ielts_profile_markdown(combined["ielts_profile"])
+                combined["shortlist_md"] = _shortlist_profile_markdown(combined["shortlist_profile"])
+                st.session_state["koda_chats_combined"][cache_key] = combined
+                if _is_cacheable_summary(combined["summary"]): st.session_state["koda_chats_summary"][conv_hash] = combined["summary"]
+
+            summary = combined["summary"]
+            with summary_slot.container():
+                st.markdown("**Chat Summary (User's Input Focus):**")
+                st.markdown(f"> {summary}")
+                st.markdown("---")
+
+            # --- Display IELTS User Profile & Shortlist Query Profile (markdown built once per user, at fetch) ---
+            st.markdown("**IELTS Profile Data:**")
+            st.markdown(combined["ielts_md"])
+            st.markdown("---")
+            st.markdown("**Latest Shortlist Query Profile:**")
+            st.markdown(combined["shortlist_md"])
+
+        else:
+            st.info("Select a user from the list on the left to view chat summary and profile details.")
+
+
 # --- Main Rendering Function for the Tab ---
 def render():
     st.header("Koda Chat Interactions Review")
     st.markdown("Review user interactions from Koda chats and shortlists, view profiles, and understand user intent.")
 
+    # --- Session State (initialized once per session; later access is direct) ---
+    if "koda_chats_initialized" not in st.session_state:
+        st.session_state["koda_chats_user_list"] = {} # date label -> processed users
+        st.session_state["koda_chats_display_list"] = {} # date label -> radio labels, built once per fetch
+        st.session_state["koda_chats_summary"] = {} # conv_hash -> summary; content-keyed, so kept across dates
+        st.session_state["koda_chats_combined"] = {} # cache_key -> {"summary", "ielts_profile", "shortlist_profile"}
+        st.session_state["koda_chats_selected_user_index"] = None
+        st.session_state["koda_chats_loaded_date"] = None
+        st.session_state["koda_chats_initialized"] = True
+
     # --- Date Selection ---
     st.subheader("Select Activity Date")
-    today = datetime.date.today()
-    thirty_days_ago = today - relativedelta(days=29)
-    date_range = [thirty_days_ago + datetime.timedelta(days=x) for x in range((today - thirty_days_ago).days + 1)]
-    date_options = {d.strftime("%Y-%m-%d (%A)"): d for d in sorted(date_range, reverse=True)}
-    yesterday_str = (today - relativedelta(days=1)).strftime("%Y-%m-%d (%A)")
-    default_index = 0
-    if yesterday_str in date_options: default_index = list(date_options.keys()).index(yesterday_str)
+    date_options, date_keys, default_index = _build_date_options(datetime.date.today().isoformat())
 
     selected_date_str = st.selectbox(
-        "Select Date:", options=list(date_options.keys()),
+        "Select Date:", options=date_keys,
         key="koda_chats_date_selector", index=default_index
     )
     selected_date_obj = date_options[selected_date_str]
@@ -90,171 +435,66 @@ def render():
     if st.button(f"Find User Activity for {selected_date_str}", key="koda_chats_find_button"):
         # Reset state for new date
         st.session_state["koda_chats_selected_user_index"] = None
-        st.session_state["koda_chats_ielts_profile"] = {}
-        st.session_state["koda_chats_shortlist_profile"] = {}
-        st.session_state["koda_chats_summary"] = {}
+        st.session_state.pop("koda_chats_user_selector_radio", None) # Positions repeat across dates, so drop the old pick
+        st.session_state["koda_chats_combined"] = {}
         st.session_state["koda_chats_loaded_date"] = selected_date_str
 
         with st.spinner(f"Searching for user activity on {selected_date_str}..."):
             try:
                 # Call the NEW combined function
-                combined_users = get_combined_chat_users_on_date(selected_date_obj)
+                combined_users = get_combined_chat_users_with_profiles_on_date(selected_date_obj) # Profiles prefetched in bulk
                 # Process users to add intent and time string
                 processed_users = []
                 for user_data in combined_users:
                     user_data['intent'] = classify_intent(user_data.get('latest_conv_history_str'))
+                    user_data['conv_hash'] = conversation_hash(user_data.get('latest_conv_history_str'))
                     ts = user_data.get('overall_latest_ts')
                     user_data['interaction_time'] = ts.strftime("%H:%M") if isinstance(ts, datetime.datetime) else "N/A"
                     processed_users.append(user_data)
 
-                st.session_state.setdefault("koda_chats_user_list", {})[selected_date_str] = processed_users
+                st.session_state["koda_chats_user_list"][selected_date_str] = processed_users
+                st.session_state["koda_chats_display_list"][selected_date_str] = [
+                    f"{u.get('username', 'N/A')} ({u.get('phone', 'N/A')}) - [{u['intent']}] @ {u['interaction_time']}" for u in processed_users
+                ]
                 if not processed_users: st.info(f"No user activity found in Koda chats or Shortlists for {selected_date_str}.")
 
             except Exception as e:
                 st.error(f"Database error fetching combined user activity: {e}")
-                logging.error(f"Error calling get_combined_chat_users_on_date for {selected_date_obj}: {e}", exc_info=True)
-                st.session_state.setdefault("koda_chats_user_list", {})[selected_date_str] = []
+                logging.error(f"Error calling get_combined_chat_users_with_profiles_on_date for {selected_date_obj}: {e}", exc_info=True)
+                st.session_state["koda_chats_user_list"][selected_date_str] = []
+                st.session_state["koda_chats_display_list"][selected_date_str] = []
+                processed_users = []
+
+        # Summarize everyone up front in a few batched LLM calls instead of one call per selected user
+        if processed_users:
+            with st.spinner(f"AI is summarizing {len(processed_users)} conversations..."):
+                try:
+                    summary_cache = st.session_state["koda_chats_summary"]
+                    to_summarize = {} # conv_hash -> user text (identical histories summarized once)
+                    for user_data in processed_users:
+                        conv_hash = user_data['conv_hash']
+                        if conv_hash in summary_cache or conv_hash in to_summarize: continue
+                        user_messages_text = _cached_user_turns(conv_hash, user_data.get('latest_conv_history_str'))
+                        if user_messages_text.strip(): to_summarize[conv_hash] = user_messages_text
+                        else: summary_cache[conv_hash] = "Could not extract user messages for summary."
+                    if to_summarize:
+                        for conv_hash, summary in zip(to_summarize, get_chat_summaries_batch(list(to_summarize.values()))):
+                            if _is_cacheable_summary(summary): summary_cache[conv_hash] = summary # Failures are retried on selection / next Find
+                except Exception as e:
+                    # Per-user summaries are still generated on selection
+                    st.warning(f"Could not pre-generate chat summaries: {e}")
+                    logging.error(f"Batched summary generation failed for {selected_date_str}: {e}", exc_info=True)
 
     # --- Display User List and Details Area ---
-    loaded_date = st.session_state.get("koda_chats_loaded_date")
+    loaded_date = st.session_state["koda_chats_loaded_date"]
     chat_users_list = []
     if loaded_date == selected_date_str:
-        chat_users_list = st.session_state.get("koda_chats_user_list", {}).get(selected_date_str, [])
+        chat_users_list = st.session_state["koda_chats_user_list"].get(selected_date_str, [])
 
     if loaded_date == selected_date_str:
         if chat_users_list:
             st.subheader(f"User Activity from {selected_date_str}")
-            col_users, col_details = st.columns([1, 2])
-
-            with col_users:
-                st.markdown("**Select User:**")
-                user_options = {}
-                display_list = []
-                for i, user_data in enumerate(chat_users_list):
-                    display_name = f"{user_data.get('username', 'N/A')} ({user_data.get('phone', 'N/A')}) - [{user_data.get('intent', 'N/A')}] @ {user_data.get('interaction_time', '--:--')}"
-                    user_options[display_name] = i
-                    display_list.append(display_name)
-
-                def handle_koda_user_selection_change():
-                    selected_display_name = st.session_state.koda_chats_user_selector_radio
-                    new_selected_index = None
-                    if selected_display_name in display_list:
-                        try: new_selected_index = display_list.index(selected_display_name)
-                        except ValueError: new_selected_index = None
-                    if new_selected_index is not None and st.session_state.get("koda_chats_selected_user_index") != new_selected_index:
-                        st.session_state["koda_chats_selected_user_index"] = new_selected_index
-
-                st.radio( "Users with Activity:", options=display_list,
-                    key="koda_chats_user_selector_radio",
-                    index=st.session_state.get("koda_chats_selected_user_index"),
-                    on_change=handle_koda_user_selection_change
-                )
-
-            # --- Right Column: Summary & Profiles ---
-            with col_details:
-                selected_index = st.session_state.get("koda_chats_selected_user_index")
-
-                if selected_index is not None and selected_index < len(chat_users_list):
-                    selected_user_data = chat_users_list[selected_index]
-                    user_id = selected_user_data.get('user_id')
-                    cache_key = f"{selected_index}_{loaded_date}" # Cache key
-
-                    st.subheader(f"Details for {selected_user_data.get('username', 'N/A')}")
-
-                    # --- Generate/Display Chat Summary ---
-                    summary = st.session_state.get("koda_chats_summary", {}).get(cache_key)
-                    if not summary:
-                        st.info("Generating chat summary...")
-                        with st.spinner("AI is summarizing the conversation..."):
-                            conv_history_str = selected_user_data.get('latest_conv_history_str', '{}')
-                            user_messages_text = ""
-                            try:
-                                conv_data = json.loads(conv_history_str)
-                                history_list = conv_data.get("conv_history", conv_data if isinstance(conv_data, list) else [])
-                                user_turns = [turn['content'] for turn in history_list if isinstance(turn, dict) and turn.get('role') == 'user' and turn.get('content')]
-                                user_messages_text = "\n---\n".join(user_turns) # Separate turns clearly
-                            except Exception as e:
-                                user_messages_text = f"Error processing history: {e}"
-                                logging.error(f"Error extracting user messages for {user_id}: {e}")
-
-                            if not user_messages_text.strip() or "Error" in user_messages_text:
-                                 summary = "Could not extract user messages for summary."
-                            else:
-                                 # Call V2 summary function
-                                 summary = get_chat_summary_v2(user_messages_text)
-
-                            st.session_state.setdefault("koda_chats_summary", {})[cache_key] = summary
-                            st.rerun()
-                    else:
-                        st.markdown("**Chat Summary (User's Input Focus):**")
-                        st.markdown(f"> {summary}")
-                        st.markdown("---")
-
-                    # --- Fetch/Display IELTS User Profile ---
-                    ielts_profile = st.session_state.get("koda_chats_ielts_profile", {}).get(cache_key)
-                    if ielts_profile is None: # Check for None specifically, as {} means not found
-                         st.info("Fetching IELTS profile details...")
-                         with st.spinner("Loading IELTS profile..."):
-                              try:
-                                   ielts_profile = get_ielts_user_profile(user_id)
-                                   st.session_state.setdefault("koda_chats_ielts_profile", {})[cache_key] = ielts_profile if ielts_profile else {"status": "Not Found"}
-                                   st.rerun()
-                              except Exception as e:
-                                   st.error(f"Failed to fetch IELTS profile: {e}")
-                                   st.session_state.setdefault("koda_chats_ielts_profile", {})[cache_key] = {"status": "Error"}
-                    else: # Display cached IELTS profile
-                        st.markdown("**IELTS Profile Data:**")
-                        if ielts_profile and ielts_profile.get("status") != "Not Found" and ielts_profile.get("status") != "Error":
-                             profile_items = [
-                                 f"- **Target Country:** {ielts_profile.get('DreamCountry', 'N/A')}",
-                                 f"- **IELTS Status:** {ielts_profile.get('ielts_status', 'N/A')}",
-                                 f"- **Study Abroad Status:** {ielts_profile.get('study_abroad_status', 'N/A')}",
-                                 f"- **Funds:** {ielts_profile.get('Funds', 'N/A')}",
-                                 f"- **Goal:** {ielts_profile.get('goal', 'N/A')}",
-                                 f"- **Category/SubCategory:** {ielts_profile.get('category', 'N/A')} / {ielts_profile.get('subCategory', 'N/A')}",
-                                 f"- **IELTS Attempts:** {ielts_profile.get('ielts_attempts', 'N/A')}",
-                                 f"- **Work Status:** {ielts_profile.get('work_status', 'N/A')}"
-                             ]
-                             st.markdown("\n".join(profile_items))
-                        elif ielts_profile.get("status") == "Not Found":
-                             st.markdown("*No specific IELTS profile found.*")
-                        else:
-                             st.markdown("*Error loading IELTS profile.*")
-                        st.markdown("---")
-
-
-                    # --- Fetch/Display Shortlist Query Profile ---
-                    shortlist_profile_data = st.session_state.get("koda_chats_shortlist_profile", {}).get(cache_key)
-                    if shortlist_profile_data is None:
-                         st.info("Fetching latest shortlist profile data...")
-                         with st.spinner("Loading shortlist data..."):
-                              try:
-                                   latest_shortlist = get_latest_shortlist_details(user_id)
-                                   if latest_shortlist and 'query_profile_data' in latest_shortlist:
-                                        shortlist_profile_data = latest_shortlist['query_profile_data']
-                                   else:
-                                        shortlist_profile_data = {"status": "Not Found"}
-                                   st.session_state.setdefault("koda_chats_shortlist_profile", {})[cache_key] = shortlist_profile_data
-                                   st.rerun()
-                              except Exception as e:
-                                   st.error(f"Failed to fetch shortlist details: {e}")
-                                   logging.error(f"Error fetching shortlist details for {user_id}: {e}")
-                                   st.session_state.setdefault("koda_chats_shortlist_profile", {})[cache_key] = {"status": "Error"}
-                    else: # Display cached shortlist profile
-                        st.markdown("**Latest Shortlist Query Profile:**")
-                        if shortlist_profile_data and shortlist_profile_data.get("status") != "Not Found" and shortlist_profile_data.get("status") != "Error":
-                             query_items = [f"- **{k.replace('_', ' ').title()}:** {v}" for k, v in shortlist_profile_data.items() if k != 'error' and v]
-                             if query_items:
-                                 st.markdown("\n".join(query_items))
-                             else:
-                                 st.markdown("*No details found in latest shortlist query.*")
-                        elif shortlist_profile_data.get("status") == "Not Found":
-                             st.markdown("*No shortlist record found for this user.*")
-                        else:
-                             st.markdown("*Error loading shortlist profile.*")
-
-                else:
-                    st.info("Select a user from the list on the left to view chat summary and profile details.")
+            _render_user_activity(loaded_date)
 
         # Handle case where user list is empty after fetch
         elif loaded_date == selected_date_str and not chat_users_list:
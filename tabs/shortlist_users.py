@@ -3,14 +3,21 @@
 import streamlit as st
 import logging
 import datetime
-from dateutil.relativedelta import relativedelta
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
 import json # Might be needed if passing complex data
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List
 
 # --- Import Core Logic ---
 try:
     # get_users_shortlisted_on_date now returns the enhanced dictionary
     from db_connection import get_users_shortlisted_on_date
-    from rag_utils import do_rag_query
+    from rag_utils import do_rag_query, is_rag_failure
 except ImportError as e:
     st.error(f"(Shortlist Tab) Failed to import required modules: {e}. Check file structure.")
     logging.error(f"(Shortlist Tab) Module import error: {e}", exc_info=True)
@@ -18,12 +25,171 @@ except ImportError as e:
     st.write("Error: Core modules not found. Tab cannot function.") # Display error within tab
 
 
+# --- Persistent (L2) RAG answer cache ---
+# st.cache_data is per process and lost on restart; answers are also kept in SQLite so redeploys and other
+# workers start warm. One shared connection (WAL mode), serialized by a lock since the RAG pool writes from threads.
+SHORTLIST_RAG_CACHE_PATH = os.getenv("SHORTLIST_RAG_CACHE_PATH", os.path.join(".cache", "shortlist_rag_cache.sqlite"))
+RAG_DISK_CACHE_TTL_S = 86400
+_rag_disk_cache = None
+_rag_disk_cache_lock = threading.Lock()
+
+def _get_rag_disk_cache() -> sqlite3.Connection:
+    global _rag_disk_cache
+    if _rag_disk_cache is None:
+        os.makedirs(os.path.dirname(SHORTLIST_RAG_CACHE_PATH) or ".", exist_ok=True)
+        conn = sqlite3.connect(SHORTLIST_RAG_CACHE_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, ts INTEGER)")
+        conn.commit()
+        _rag_disk_cache = conn
+    return _rag_disk_cache
+
+def _rag_disk_cache_get(key: str) -> Optional[str]:
+    try:
+        with _rag_disk_cache_lock:
+            row = _get_rag_disk_cache().execute("SELECT value FROM kv WHERE key = ? AND ts > ?", (key, int(time.time()) - RAG_DISK_CACHE_TTL_S)).fetchone()
+        return row[0] if row else None
+    except sqlite3.Error as e:
+        logging.warning(f"RAG disk cache read failed: {e}")
+        return None
+
+def _rag_disk_cache_put(key: str, value: str) -> None:
+    try:
+        with _rag_disk_cache_lock:
+            conn = _get_rag_disk_cache()
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, ts) VALUES (?, ?, ?)", (key, value, int(time.time())))
+            conn.commit()
+    except sqlite3.Error as e:
+        logging.warning(f"RAG disk cache write failed: {e}")
+
+
+# --- Cached RAG lookups ---
+# The job-outlook and visa answers depend only on (country, degree[, specializations]), which a day's shortlisted
+# users share heavily, so each distinct combination is asked once and reused across users and sessions.
+@st.cache_data(ttl=3600, max_entries=1024, show_spinner=False)
+def _cached_rag(query_kind: str, country_key: str, degree_key: str, specs_key: tuple, _country: str, _degree: str, _specializations: list) -> str:
+    """
+    RAG answer for the "job" (job outlook) or "visa" (post-study work visa) follow-up question.
+    Keyed on the normalized args only; the underscore args are the values the prompt is built from (first caller's casing).
+    Failures raise instead of returning, so error text isn't cached.
+    """
+    disk_key = hashlib.sha1("\x00".join([query_kind, country_key, degree_key, *specs_key]).encode("utf-8")).hexdigest()
+    cached_answer = _rag_disk_cache_get(disk_key)
+    if cached_answer is not None: return cached_answer
+    if query_kind == "job":
+        user_query = f"Briefly, what's the job outlook for {_degree} graduates (specializing in {', '.join(_specializations) if _specializations else 'general'}) in {_country}?"
+        rag_profile_context = {
+            "DreamCountry": _country,
+            "MajorSubject": _degree,
+            "Specializations": _specializations,
+            # Add other relevant fields if RAG prompt uses them
+        }
+    else:
+        user_query = f"What are the general post-study work visa options in {_country} for international students graduating in {_degree}?"
+        rag_profile_context = {"DreamCountry": _country, "MajorSubject": _degree} # Simplified context for this query
+    answer = do_rag_query(user_query=user_query, user_profile=rag_profile_context, top_k=2)
+    if is_rag_failure(answer): raise RuntimeError(answer) # Not cached in memory or on disk
+    if answer: _rag_disk_cache_put(disk_key, answer)
+    return answer
+
+_RAG_POOL = ThreadPoolExecutor(max_workers=4) # Shared; the job and visa questions for a user run side by side
+RAG_RESULT_TIMEOUT_S = 15 # Past this the message falls back to its generic wording
+
+def _rag_cache_key(query_kind: str, country: str, degree: str, specializations: list) -> tuple:
+    # Normalized so "USA" and " usa " share a cache slot; the visa question doesn't depend on specializations
+    specs_key = tuple(sorted(str(spec).strip().lower() for spec in specializations)) if query_kind == "job" and specializations else ()
+    return (query_kind, str(country).strip().lower(), str(degree).strip().lower(), specs_key)
+
+def _rag_answer(query_kind: str, country: str, degree: str, specializations: list) -> str:
+    return _cached_rag(*_rag_cache_key(query_kind, country, degree, specializations), country, degree, specializations or [])
+
+def _profile_rag_subject(user_profile: dict) -> tuple[str, str, list]:
+    """(country, degree, specializations) the follow-up RAG questions are asked about."""
+    # Prioritize country from user state, fallback to query JSON
+    country = user_profile.get('state_dream_country')
+    query_countries = user_profile.get('query_countries', [])
+    if not country and query_countries:
+        country = query_countries[0] # Take the first country from query if state is missing
+    country = country or "your target country" # Final fallback
+    return country, user_profile.get('query_degreeTitle', 'your desired field'), user_profile.get('query_specializations', [])
+
+_RAG_PREFETCH_POOL = ThreadPoolExecutor(max_workers=4) # Separate from _RAG_POOL, so a selected user's questions never queue behind prefetches
+PREFETCH_RAG_USERS = 10 # Only the first users in the list: operators usually open a few, not the whole day
+
+def _log_prefetch_failure(future) -> None:
+    if future.exception() is not None: logging.warning(f"RAG prefetch failed (retried on selection): {future.exception()}")
+
+def _prefetch_rag_answers(users: list[dict]) -> None:
+    """
+    Starts the distinct RAG questions of the first PREFETCH_RAG_USERS users in the background (not joined),
+    so their later generation usually hits the cache. A selection racing a prefetch waits on the same cache entry.
+    """
+    pending = {}
+    for user_profile in users[:PREFETCH_RAG_USERS]:
+        country, degree, specializations = _profile_rag_subject(user_profile)
+        for query_kind in ("job", "visa"):
+            pending.setdefault(_rag_cache_key(query_kind, country, degree, specializations), (query_kind, country, degree, specializations))
+    if not pending: return
+    logging.info(f"Prefetching {len(pending)} RAG answers in the background for {min(len(users), PREFETCH_RAG_USERS)} shortlisted users")
+    for args in pending.values(): _RAG_PREFETCH_POOL.submit(_rag_answer, *args).add_done_callback(_log_prefetch_failure)
+
+
+RAG_ANSWER_SCAN_CHARS = 256 # "not available"/error wording shows up at the start of a RAG reply
+
+def _is_usable_rag_answer(answer: Optional[str]) -> bool:
+    if not answer: return False
+    head = answer[:RAG_ANSWER_SCAN_CHARS].lower() # Don't lowercase a multi-KB answer for this
+    return "not available" not in head and "error" not in head
+
+def _first_line_capped(s: str, cap: int = 200) -> str:
+    """First line of s, at most cap chars, plus '...' if s is longer than cap (without splitting all of s into lines)."""
+    nl = s.find('\n')
+    end = nl if 0 <= nl < cap else cap
+    return s[:end] + ('...' if len(s) > cap else '')
+
+
+@functools.lru_cache(maxsize=4096)
+def _static_messages(country: str, degree: str, query_countries: tuple, specializations: tuple, ielts_status: Optional[str], study_abroad_status: Optional[str],
+                     budget_signal: str, n_top_courses: int, top_course_name: Optional[str], top_uni_display: Optional[str],
+                     top_uni: Optional[str], second_uni: Optional[str]) -> tuple[Optional[str], ...]:
+    """
+    Messages 2, 3, 4, 5, 8 and 9: they use no username or RAG answer, so users with the same profile shape share them.
+    n_top_courses is capped at 2; top_uni_display is the first course's university defaulting to 'N/A', top_uni without the default.
+    """
+    # Joined once, reused by every message that mentions them
+    specs_str = ", ".join(specializations)
+    countries_str = ", ".join(query_countries)
+    has_ielts_status = ielts_status and ielts_status != 'N/A' and ielts_status != 'Score Not Required'
+    return (
+        # 2. Country Focus
+        f"Focusing on {country}? It's a great choice for {degree}. We can delve deeper into university options or visa processes there."
+        + (f" (We also noted your query mentioned {countries_str}.)" if query_countries and country not in query_countries and country != "your target country" else ""),
+        # 3. Course & Specialization Focus
+        f"For your interest in {degree}"
+        + (f", especially focusing on {specs_str}" if specializations else "")
+        + (f". How did you feel about options like '{top_course_name}' at {top_uni_display}?" if n_top_courses else ". Let's explore specific programs that match your goals."),
+        # 4. IELTS Status / Prep
+        ("Great to see your IELTS status is updated! Does your score meet the requirements for your preferred universities?" if 'Completed' in ielts_status or 'Score Added' in ielts_status
+         else f"How is the IELTS preparation going (status: {ielts_status})? Kandor has resources that might help boost your score!" if 'In Progress' in ielts_status or 'Planning' in ielts_status
+         else f"Noticed your IELTS status is '{ielts_status}'. Need any guidance or practice materials?") if has_ielts_status # Catch other statuses
+        else "Are you planning to take the IELTS or another English proficiency test for admission to universities in {country}?",
+        # 5. Study Abroad Status / Next Steps
+        f"Your current study abroad status is '{study_abroad_status}'. What's the next big step you're focusing on? Application essays? University selection?" if study_abroad_status and study_abroad_status != 'N/A'
+        else "What stage are you at in your study abroad journey? Researching, applying, or waiting for offers? Let us know how we can help.",
+        # 8. University Reminder (using top shortlisted)
+        f"Let's revisit your shortlisted universities like {top_uni} and {second_uni}. We can check specific admission requirements or campus life details." if n_top_courses >= 2
+        else f"Let's take a closer look at {top_uni} from your shortlist. We can find detailed admission info for the '{top_course_name}' program." if n_top_courses
+        else None,
+        # 9. Budget Signal
+        f"Considering your indicated budget ({budget_signal}), we can help find quality programs for {degree} in {country} that align with your financial plan." if budget_signal != 'N/A' else None,
+    )
+
+
 # --- Updated Helper Function for Message Generation ---
 def generate_shortlist_followup_messages(user_profile: dict) -> list[str]:
     """
     Generates ~10 helpful follow-up messages using the enhanced user profile.
     """
-    messages = []
     if not user_profile:
         return ["Error: Cannot generate messages without user profile data."]
 
@@ -31,15 +197,8 @@ def generate_shortlist_followup_messages(user_profile: dict) -> list[str]:
     username = user_profile.get('username', 'there')
     user_id = user_profile.get('user_id') # For logging/debugging
 
-    # Prioritize country from user state, fallback to query JSON
-    country = user_profile.get('state_dream_country')
+    country, degree, specializations = _profile_rag_subject(user_profile)
     query_countries = user_profile.get('query_countries', [])
-    if not country and query_countries:
-        country = query_countries[0] # Take the first country from query if state is missing
-    country = country or "your target country" # Final fallback
-
-    degree = user_profile.get('query_degreeTitle', 'your desired field')
-    specializations = user_profile.get('query_specializations', [])
     education_level = user_profile.get('query_educationLevel', 'your current education level')
     budget_signal = user_profile.get('query_budget', 'N/A')
     ielts_status = user_profile.get('ielts_status', 'N/A')
@@ -48,110 +207,173 @@ def generate_shortlist_followup_messages(user_profile: dict) -> list[str]:
     creation_time = user_profile.get('shortlist_creation_time', 'recently')
     top_courses = user_profile.get('top_shortlisted_courses', [])
 
-    logging.info(f"Generating messages for user {user_id} ({username}) with profile: {user_profile}") # Log profile data
-
-    # --- Message Templates using Enhanced Data ---
+    # Both RAG questions are network-bound: start them now, collect them where messages 6 and 7 are built
+    job_future = _RAG_POOL.submit(_rag_answer, "job", country, degree, specializations)
+    imm_future = _RAG_POOL.submit(_rag_answer, "visa", country, degree, specializations)
 
-    # 1. Intro / Shortlist Context
-    messages.append(f"Hi {username}, following up on the shortlist for {degree} you generated around {creation_time}. Kandor is here to help you take the next steps!")
-
-    # 2. Country Focus
-    country_msg = f"Focusing on {country}? It's a great choice for {degree}. We can delve deeper into university options or visa processes there."
-    if query_countries and country not in query_countries and country != "your target country":
-         country_msg += f" (We also noted your query mentioned {', '.join(query_countries)}.)"
-    messages.append(country_msg)
-
-    # 3. Course & Specialization Focus
-    course_msg = f"For your interest in {degree}"
-    if specializations:
-        course_msg += f", especially focusing on {', '.join(specializations)}"
-    if top_courses:
-         course_msg += f". How did you feel about options like '{top_courses[0].get('name')}' at {top_courses[0].get('university', 'N/A')}?"
-    else:
-         course_msg += ". Let's explore specific programs that match your goals."
-    messages.append(course_msg)
-
-    # 4. IELTS Status / Prep
-    if ielts_status and ielts_status != 'N/A' and ielts_status != 'Score Not Required':
-        if 'Completed' in ielts_status or 'Score Added' in ielts_status:
-             messages.append("Great to see your IELTS status is updated! Does your score meet the requirements for your preferred universities?")
-        elif 'In Progress' in ielts_status or 'Planning' in ielts_status:
-             messages.append(f"How is the IELTS preparation going (status: {ielts_status})? Kandor has resources that might help boost your score!")
-        else: # Catch other statuses
-             messages.append(f"Noticed your IELTS status is '{ielts_status}'. Need any guidance or practice materials?")
-    else:
-        messages.append("Are you planning to take the IELTS or another English proficiency test for admission to universities in {country}?")
-
-    # 5. Study Abroad Status / Next Steps
-    if study_abroad_status and study_abroad_status != 'N/A':
-        messages.append(f"Your current study abroad status is '{study_abroad_status}'. What's the next big step you're focusing on? Application essays? University selection?")
-    else:
-        messages.append("What stage are you at in your study abroad journey? Researching, applying, or waiting for offers? Let us know how we can help.")
+    logging.info(f"Generating messages for user {user_id} ({username}) with profile: {user_profile}") # Log profile data
 
     # 6. Job Focus (RAG - pass enhanced profile)
-    job_query = f"Briefly, what's the job outlook for {degree} graduates (specializing in {', '.join(specializations) if specializations else 'general'}) in {country}?"
     try:
-        # Create a context profile subset for RAG if needed, or pass the whole dict
-        rag_profile_context = {
-            "DreamCountry": country,
-            "MajorSubject": degree,
-            "Specializations": specializations,
-            # Add other relevant fields if RAG prompt uses them
-        }
-        job_info = do_rag_query(user_query=job_query, user_profile=rag_profile_context, top_k=2)
-        if job_info and "not available" not in job_info.lower() and "error" not in job_info.lower():
-             concise_job_info = job_info.split('\n')[0][:200] + ('...' if len(job_info) > 200 else '') # Keep it brief
-             messages.append(f"Career outlook in {country} for {degree}: {concise_job_info}")
+        job_info = job_future.result(timeout=RAG_RESULT_TIMEOUT_S)
+        if _is_usable_rag_answer(job_info):
+             job_msg = f"Career outlook in {country} for {degree}: {_first_line_capped(job_info)}" # Keep it brief
         else:
-             messages.append(f"Thinking about careers after studying {degree} in {country}? We can explore job market trends for your specializations.")
+             job_msg = f"Thinking about careers after studying {degree} in {country}? We can explore job market trends for your specializations."
     except Exception as e:
         logging.warning(f"RAG query failed for job outlook (User: {username}): {e}")
-        messages.append(f"Interested in job prospects for {degree} in {country}? Let's research that together.")
+        job_msg = f"Interested in job prospects for {degree} in {country}? Let's research that together."
 
     # 7. Immigration Focus (RAG - pass enhanced profile)
-    immigration_query = f"What are the general post-study work visa options in {country} for international students graduating in {degree}?"
     try:
-        rag_profile_context = {"DreamCountry": country, "MajorSubject": degree} # Simplified context for this query
-        imm_info = do_rag_query(user_query=immigration_query, user_profile=rag_profile_context, top_k=2)
-        if imm_info and "not available" not in imm_info.lower() and "error" not in imm_info.lower():
-             concise_imm_info = imm_info.split('\n')[0][:200] + ('...' if len(imm_info) > 200 else '')
-             messages.append(f"Post-study work options in {country} related to {degree}: {concise_imm_info}")
+        imm_info = imm_future.result(timeout=RAG_RESULT_TIMEOUT_S)
+        if _is_usable_rag_answer(imm_info):
+             imm_msg = f"Post-study work options in {country} related to {degree}: {_first_line_capped(imm_info)}"
         else:
-             messages.append(f"Understanding visa options after graduation in {country} is key. We can clarify pathways relevant to {degree}.")
+             imm_msg = f"Understanding visa options after graduation in {country} is key. We can clarify pathways relevant to {degree}."
     except Exception as e:
         logging.warning(f"RAG query failed for immigration info (User: {username}): {e}")
-        messages.append(f"Navigating post-study visa options in {country}? We're here to guide you based on your interest in {degree}.")
-
-    # 8. University Reminder (using top shortlisted)
-    if len(top_courses) >= 2:
-         messages.append(f"Let's revisit your shortlisted universities like {top_courses[0].get('university')} and {top_courses[1].get('university')}. We can check specific admission requirements or campus life details.")
-    elif top_courses:
-         messages.append(f"Let's take a closer look at {top_courses[0].get('university')} from your shortlist. We can find detailed admission info for the '{top_courses[0].get('name')}' program.")
-
-    # 9. Budget Signal
-    if budget_signal != 'N/A':
-        messages.append(f"Considering your indicated budget ({budget_signal}), we can help find quality programs for {degree} in {country} that align with your financial plan.")
+        imm_msg = f"Navigating post-study visa options in {country}? We're here to guide you based on your interest in {degree}."
+
+    # --- Message Templates using Enhanced Data (None = section skipped for this profile) ---
+    # Sections 2-5, 8 and 9 depend only on the profile's shape, which many users share: built once per shape
+    static_args = (
+        country, degree, tuple(query_countries) if query_countries else (), tuple(specializations) if specializations else (),
+        ielts_status, study_abroad_status, budget_signal, min(len(top_courses), 2),
+        top_courses[0].get('name') if top_courses else None, top_courses[0].get('university', 'N/A') if top_courses else None,
+        top_courses[0].get('university') if top_courses else None, top_courses[1].get('university') if len(top_courses) >= 2 else None,
+    )
+    try: country_msg, course_msg, ielts_msg, status_msg, uni_msg, budget_msg = _static_messages(*static_args)
+    except TypeError: country_msg, course_msg, ielts_msg, status_msg, uni_msg, budget_msg = _static_messages.__wrapped__(*static_args) # Unhashable profile value
+    message_slots = (
+        # 1. Intro / Shortlist Context
+        f"Hi {username}, following up on the shortlist for {degree} you generated around {creation_time}. Kandor is here to help you take the next steps!",
+        country_msg, course_msg, ielts_msg, status_msg,
+        # 6. / 7. RAG-backed messages (built above)
+        job_msg,
+        imm_msg,
+        uni_msg, budget_msg,
+        # 10. Platform Engagement / General Support
+        f"Great work on the {total_practice} IELTS practice questions on Kandor! Keep it up! Remember, the team is here for any support you need." if total_practice > 10 # Example threshold
+        else f"Don't hesitate to reach out, {username}! The Kandor platform and team are ready to assist with any questions about your study abroad journey.",
+    )
+    messages = [message for message in message_slots if message is not None]
+
+    # Ensure we have 10 messages: only sections 8 and 9 can be skipped, so at most two generic ones are added
+    if len(messages) < 10:
+        generic_messages = (
+            f"Planning study abroad is a journey! What's the next milestone for you, {username}?",
+            f"Need help comparing universities for {degree} in {country}? Let us know your criteria!",
+            "Application deadlines can sneak up! Let's ensure you're on track for your target intake.",
+            f"Remember, choosing the right course like {degree} is crucial for your future goals. Let's ensure it's the perfect fit!"
+        )
+        seen = set(messages)
+        for generic_message in generic_messages:
+            if len(messages) >= 10: break
+            if generic_message not in seen: # Avoid duplicates
+                messages.append(generic_message); seen.add(generic_message)
+
+    return messages # At most 10: one slot per section
+
+
+def _build_user_index(users_list: list[dict]) -> tuple[dict[str, str], dict[str, dict]]:
+    """
+    (radio label -> user_id, user_id -> profile), built once per fetch. Labels include the shortlist creation time;
+    users without an id are left out, and a repeated id keeps its first profile.
+    """
+    user_options = {
+        f"{user.get('username', 'N/A')} ({user.get('phone', 'N/A')}) @ {user.get('shortlist_creation_time', '--:--')}": user['user_id']
+        for user in users_list if user.get('user_id')
+    }
+    profiles_by_id = {}
+    for user in users_list:
+        if user.get('user_id'): profiles_by_id.setdefault(user['user_id'], user)
+    return user_options, profiles_by_id
+
+
+def _render_messages(user_profile: dict, messages_to_display: list[str]) -> None:
+    # Display user details briefly for context
+    st.markdown(f"**Messages for:** {user_profile.get('username', 'N/A')} ({user_profile.get('phone', 'N/A')})")
+    st.markdown(f"**Target:** {user_profile.get('state_dream_country', 'N/A')} | **Field:** {user_profile.get('query_degreeTitle', 'N/A')}")
+
+    st.success(f"Showing {len(messages_to_display)} messages:")
+    # st.code blocks instead of ten text_area widgets (copy button, no widget state). Not hand-built fences: a message
+    # containing ``` (the job/visa lines carry RAG text) would break out of its block
+    for i, msg in enumerate(messages_to_display, 1):
+        st.markdown(f"**Message {i}**")
+        st.code(msg, language=None, wrap_lines=True)
+
+
+@st.fragment
+def _render_user_messages() -> None:
+    """User list + messages panel. A fragment, so picking a user reruns only this part, not the date/fetch controls."""
+    user_options_dict, profiles_by_id = st.session_state.get("shortlist_user_index", ({}, {})) # Built once per fetch, read from session state
+    col_users, col_messages = st.columns([1, 2])
+
+    with col_users:
+        st.markdown("**Select User:**")
+
+        # Callback function remains structurally similar
+        def handle_user_selection():
+            selected_display_name = st.session_state.shortlist_user_selector
+            if selected_display_name and selected_display_name in user_options_dict:
+                newly_selected_user_id = user_options_dict[selected_display_name]
+                if st.session_state.get("shortlist_selected_user_id") != newly_selected_user_id:
+                    st.session_state["shortlist_selected_user_id"] = newly_selected_user_id
+                    st.session_state["shortlist_generated_messages"] = [] # Clear old messages
+                    # No need to fetch profile again, it's already in users_list
+                    # The full enhanced profile will be retrieved below before generating messages
+
+        # Radio button - options list now uses the new display names
+        st.radio(
+            "Select User to Generate Follow-up Messages:",
+            options=list(user_options_dict.keys()),
+            key="shortlist_user_selector",
+            index=None,
+            on_change=handle_user_selection
+        )
+
+    with col_messages:
+        st.subheader("Generated Follow-up Messages")
+        selected_user_id = st.session_state.get("shortlist_selected_user_id")
+
+        if selected_user_id:
+            # Full enhanced profile for the selected user (O(1) lookup in the per-fetch index)
+            selected_user_profile = profiles_by_id.get(selected_user_id)
+
+            if not selected_user_profile:
+                 st.error("Error: Could not find details for the selected user in the loaded list.")
+                 st.session_state["shortlist_generated_messages"] = ["Error: User details missing."]
+
+            # Check if messages are already generated FOR THIS USER
+            elif st.session_state.get("shortlist_generated_messages"):
+                _render_messages(selected_user_profile, st.session_state["shortlist_generated_messages"])
+            else:
+                # Messages not generated yet, generate them now using the full profile and show them in this same run
+                status_slot = st.empty()
+                status_slot.info(f"Generating messages for {selected_user_profile.get('username', 'N/A')}...")
+                with st.spinner("AI is crafting helpful messages..."):
+                     try:
+                         # Call the UPDATED message generation function with the ENHANCED profile
+                         messages = generate_shortlist_followup_messages(selected_user_profile)
+                     except Exception as e:
+                         logging.error(f"Message generation error for user {selected_user_id}: {e}", exc_info=True)
+                         messages = [f"Failed to generate messages due to an error: {e}"]
+                st.session_state["shortlist_generated_messages"] = messages
+                status_slot.empty()
+                _render_messages(selected_user_profile, messages)
 
-    # 10. Platform Engagement / General Support
-    if total_practice > 10: # Example threshold
-         messages.append(f"Great work on the {total_practice} IELTS practice questions on Kandor! Keep it up! Remember, the team is here for any support you need.")
-    else:
-         messages.append(f"Don't hesitate to reach out, {username}! The Kandor platform and team are ready to assist with any questions about your study abroad journey.")
+        else:
+            st.info("Select a user from the list on the left to generate and view suggested follow-up messages.")
 
-    # Ensure we have 10 messages (add generic ones if needed)
-    generic_messages = [
-        f"Planning study abroad is a journey! What's the next milestone for you, {username}?",
-        f"Need help comparing universities for {degree} in {country}? Let us know your criteria!",
-        "Application deadlines can sneak up! Let's ensure you're on track for your target intake.",
-        f"Remember, choosing the right course like {degree} is crucial for your future goals. Let's ensure it's the perfect fit!"
-    ]
-    idx = 0
-    while len(messages) < 10 and idx < len(generic_messages):
-        if generic_messages[idx] not in messages: # Avoid duplicates
-             messages.append(generic_messages[idx])
-        idx += 1
 
-    return messages[:10] # Return exactly 10
+@st.cache_data(ttl=3600, show_spinner=False)
+def _build_date_options(today_iso: str) -> tuple[Dict[str, datetime.date], List[str]]:
+    """Last 30 days as {"YYYY-MM-DD (Weekday)": date}, newest first, and its label list. Built once per day."""
+    today = datetime.date.fromisoformat(today_iso)
+    date_keys = [(today - datetime.timedelta(days=x)).strftime("%Y-%m-%d (%A)") for x in range(30)] # Newest first
+    date_options = {label: today - datetime.timedelta(days=x) for x, label in enumerate(date_keys)}
+    return date_options, date_keys
 
 
 # --- Main Rendering Function for the Tab ---
@@ -159,14 +381,10 @@ def render():
     st.header("Follow-up Messages for Shortlisted Users")
 
     # --- Date Selection ---
-    # (Date selection logic remains the same)
-    today = datetime.date.today()
-    thirty_days_ago = today - relativedelta(days=29)
-    date_range = [thirty_days_ago + datetime.timedelta(days=x) for x in range((today - thirty_days_ago).days + 1)]
-    date_options = {d.strftime("%Y-%m-%d (%A)"): d for d in sorted(date_range, reverse=True)}
+    date_options, date_keys = _build_date_options(datetime.date.today().isoformat())
     selected_date_str = st.selectbox(
         "Select Shortlist Creation Date:",
-        options=list(date_options.keys()),
+        options=date_keys,
         key="shortlist_date_selector", # Keep key consistent
         index=0
     )
@@ -178,15 +396,19 @@ def render():
         st.session_state["shortlist_selected_user_id"] = None
         st.session_state["shortlist_generated_messages"] = []
         st.session_state["shortlisted_users_list"] = [] # Clear before fetch
+        st.session_state["shortlist_user_index"] = ({}, {})
 
         with st.spinner(f"Searching for users shortlisted on {selected_date_str}..."):
             try:
                 # Call the REVISED DB function
                 users = get_users_shortlisted_on_date(selected_date_obj)
                 st.session_state["shortlisted_users_list"] = users # Store the enhanced list
+                st.session_state["shortlist_user_index"] = _build_user_index(users)
                 # Log fetched data structure for debugging
                 if users:
                     logging.debug(f"Fetched user details structure: {users[0]}")
+                    # Warm the RAG cache for the first users without holding up Find
+                    _prefetch_rag_answers(users)
 
             except Exception as e:
                 st.error(f"Database error fetching shortlisted users: {e}")
@@ -205,79 +427,7 @@ def render():
                 st.info(f"No users found with shortlists created on {st.session_state['shortlist_selected_date'].strftime('%Y-%m-%d')}.")
         else:
             st.subheader(f"Users Shortlisted on {st.session_state['shortlist_selected_date'].strftime('%Y-%m-%d')}")
-            col_users, col_messages = st.columns([1, 2])
-
-            with col_users:
-                st.markdown("**Select User:**")
-                # --- UPDATED User Options ---
-                # Create display names including the creation time
-                user_options_dict = {}
-                for user in users_list:
-                    # Use the new enhanced dictionary fields
-                    display_name = f"{user.get('username', 'N/A')} ({user.get('phone', 'N/A')}) @ {user.get('shortlist_creation_time', '--:--')}"
-                    user_id = user.get('user_id')
-                    if user_id: # Only add if user_id is valid
-                        user_options_dict[display_name] = user_id
-
-                # Callback function remains structurally similar
-                def handle_user_selection():
-                    selected_display_name = st.session_state.shortlist_user_selector
-                    if selected_display_name and selected_display_name in user_options_dict:
-                        newly_selected_user_id = user_options_dict[selected_display_name]
-                        if st.session_state.get("shortlist_selected_user_id") != newly_selected_user_id:
-                            st.session_state["shortlist_selected_user_id"] = newly_selected_user_id
-                            st.session_state["shortlist_generated_messages"] = [] # Clear old messages
-                            # No need to fetch profile again, it's already in users_list
-                            # The full enhanced profile will be retrieved below before generating messages
-
-                # Radio button - options list now uses the new display names
-                st.radio(
-                    "Select User to Generate Follow-up Messages:",
-                    options=list(user_options_dict.keys()),
-                    key="shortlist_user_selector",
-                    index=None,
-                    on_change=handle_user_selection
-                )
-
-            with col_messages:
-                st.subheader("Generated Follow-up Messages")
-                selected_user_id = st.session_state.get("shortlist_selected_user_id")
-
-                if selected_user_id:
-                    # Find the full enhanced profile for the selected user from the list in session state
-                    selected_user_profile = next((user for user in users_list if user.get('user_id') == selected_user_id), None)
-
-                    if not selected_user_profile:
-                         st.error("Error: Could not find details for the selected user in the loaded list.")
-                         st.session_state["shortlist_generated_messages"] = ["Error: User details missing."]
-
-                    # Check if messages are already generated FOR THIS USER
-                    elif st.session_state.get("shortlist_generated_messages"):
-                        messages_to_display = st.session_state["shortlist_generated_messages"]
-                        # Display user details briefly for context
-                        st.markdown(f"**Messages for:** {selected_user_profile.get('username', 'N/A')} ({selected_user_profile.get('phone', 'N/A')})")
-                        st.markdown(f"**Target:** {selected_user_profile.get('state_dream_country', 'N/A')} | **Field:** {selected_user_profile.get('query_degreeTitle', 'N/A')}")
-
-                        st.success(f"Showing {len(messages_to_display)} messages:")
-                        for i, msg in enumerate(messages_to_display, 1):
-                            st.text_area(f"Message {i}", value=msg, height=110, key=f"shortlist_msg_{selected_user_id}_{i}", help="You can copy this message.")
-                    else:
-                        # Messages not generated yet, generate them now using the full profile
-                        st.info(f"Generating messages for {selected_user_profile.get('username', 'N/A')}...")
-                        with st.spinner("AI is crafting helpful messages..."):
-                             try:
-                                 # Call the UPDATED message generation function with the ENHANCED profile
-                                 messages = generate_shortlist_followup_messages(selected_user_profile)
-                                 st.session_state["shortlist_generated_messages"] = messages
-                                 st.rerun() # Rerun to display the newly generated messages
-                             except Exception as e:
-                                 st.error(f"Error generating messages: {e}")
-                                 logging.error(f"Message generation error for user {selected_user_id}: {e}", exc_info=True)
-                                 st.session_state["shortlist_generated_messages"] = [f"Failed to generate messages due to an error: {e}"]
-                                 st.rerun() # Rerun to display the error message
-
-                else:
-                    st.info("Select a user from the list on the left to generate and view suggested follow-up messages.")
+            _render_user_messages()
 
     # else: # Initial state before date is searched - handled by button logic
     #     pass
\ No newline at end of file
@@ -3,27 +3,52 @@
 import streamlit as st
 import logging
 import datetime
-import json 
-from typing import Optional, Dict, Any, List
-import pandas as pd # Need pandas if using get_all_records effectively
+import time
+import threading
+from collections import OrderedDict
+import itertools
+from typing import Optional, Dict, Any, List, Tuple
 
 # --- Import Core Logic ---
 try:
-    # Import gspread utils and necessary DB/RAG functions
+    # Import gspread utils and necessary DB functions (rag_utils and its LangChain/OpenAI chain are imported on first use)
     import gspread_utils
-    from db_connection import get_user_by_phone, get_ielts_user_profile, get_latest_shortlist_details
-    from rag_utils import do_rag_query
+    from db_connection import get_user_by_phone, get_ielts_user_profile, get_latest_shortlist_details, get_users_by_phones, get_ielts_profiles_by_userids
 except ImportError as e:
     st.error(f"(Student Follow-up Tab) Failed to import required modules: {e}. Check file structure.")
     logging.error(f"(Student Follow-up Tab) Module import error: {e}", exc_info=True)
     st.write("Error: Core modules not found. Tab cannot function.")
     st.stop()
 
+# --- Negative cache: users known to have no ielts_users_profile row (process-wide, all sessions) ---
+IELTS_MISS_TTL_S = 600
+IELTS_MISS_MAX_ENTRIES = 10000
+_ielts_misses: "OrderedDict[str, float]" = OrderedDict() # userid -> when the miss was seen
+_ielts_misses_lock = threading.Lock()
+
+def _ielts_known_missing(user_id: str) -> bool:
+    with _ielts_misses_lock:
+        seen_at = _ielts_misses.get(user_id)
+        if seen_at is None: return False
+        if time.monotonic() - seen_at < IELTS_MISS_TTL_S: return True
+        del _ielts_misses[user_id]
+        return False
+
+def _remember_ielts_miss(user_id: str) -> None:
+    with _ielts_misses_lock:
+        _ielts_misses[user_id] = time.monotonic()
+        _ielts_misses.move_to_end(user_id)
+        while len(_ielts_misses) > IELTS_MISS_MAX_ENTRIES: _ielts_misses.popitem(last=False)
+
 # --- Helper to get combined DB profile ---
-# @st.cache_data(ttl=300) # Optional caching
-def get_combined_db_profile(phone_number: str) -> Optional[Dict[str, Any]]:
-    """Fetches user_latest_state and ielts_profile data."""
-    if not phone_number: return None
+class _IncompleteProfiles(Exception):
+    """Raised out of the cached fetchers when the IELTS lookup failed, so the incomplete result isn't cached."""
+    def __init__(self, result):
+        super().__init__("IELTS profile lookup failed")
+        self.result = result
+
+@st.cache_data(ttl=300, show_spinner=False) # Reruns reuse the two lookups instead of repeating them
+def _cached_combined_db_profile(phone_number: str) -> Optional[Dict[str, Any]]:
     logging.info(f"Fetching DB profile for phone: {phone_number}")
     user_state = get_user_by_phone(phone_number)
     if not user_state:
@@ -32,13 +57,202 @@ def get_combined_db_profile(phone_number: str) -> Optional[Dict[str, Any]]:
 
     user_id = user_state.get('userid')
     ielts_profile = None
-    if user_id:
-        ielts_profile = get_ielts_user_profile(user_id)
+    if user_id and not _ielts_known_missing(user_id): # Most users have no IELTS profile: skip re-asking for the TTL
+        try: ielts_profile = get_ielts_user_profile(user_id, raise_errors=True)
+        except Exception: raise _IncompleteProfiles(dict(user_state)) # Not a miss: retried on the next load
+        if not ielts_profile: _remember_ielts_miss(user_id) # Query succeeded with no row
 
     # Combine profiles (ielts_profile overrides user_state if keys overlap, unlikely here)
     combined = {**(user_state or {}), **(ielts_profile or {})}
     return combined if combined else None
 
+def get_combined_db_profile(phone_number: str) -> Optional[Dict[str, Any]]:
+    """Fetches user_latest_state and ielts_profile data (without the IELTS part, uncached, if that lookup failed)."""
+    if not phone_number: return None
+    try: return _cached_combined_db_profile(phone_number)
+    except _IncompleteProfiles as e: return e.result
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_combined_db_profiles_bulk(phones: Tuple[str, ...]) -> Dict[str, Optional[Dict[str, Any]]]:
+    logging.info(f"Fetching DB profiles for {len(phones)} phones")
+    users_by_phone = get_users_by_phones(list(phones))
+    ielts_user_ids = [user.get('userid') for user in users_by_phone.values() if user.get('userid') and not _ielts_known_missing(user.get('userid'))]
+    ielts_failed = False
+    try:
+        ielts_profiles = get_ielts_profiles_by_userids(ielts_user_ids, raise_errors=True)
+        for user_id in ielts_user_ids:
+            if user_id not in ielts_profiles: _remember_ielts_miss(user_id) # Query succeeded with no row for this user
+    except Exception:
+        ielts_profiles, ielts_failed = {}, True
+    combined_profiles = {}
+    for phone in phones:
+        user_state = users_by_phone.get(phone)
+        if not user_state:
+            logging.warning(f"No user found in users_latest_state for phone {phone}")
+            combined_profiles[phone] = None
+        else:
+            # Combine profiles (ielts_profile overrides user_state if keys overlap, unlikely here)
+            combined_profiles[phone] = {**user_state, **(ielts_profiles.get(user_state.get('userid')) or {})}
+    if ielts_failed: raise _IncompleteProfiles(combined_profiles)
+    return combined_profiles
+
+def get_combined_db_profiles_bulk(phones: Tuple[str, ...]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """get_combined_db_profile for many phones with two queries in total (users, then their IELTS profiles)."""
+    if not phones: return {}
+    try: return _cached_combined_db_profiles_bulk(phones)
+    except _IncompleteProfiles as e: return e.result
+
+
+ACTION_MEDIA = ("WhatsApp", "Email") # Action Medium options, in selectbox order
+_ACTION_MEDIUM_INDEX = {medium: i for i, medium in enumerate(ACTION_MEDIA)}
+
+
+def _profile_context_markdown(profile: Optional[Dict[str, Any]]) -> str:
+    """Key DB profile points for the editor's context expander, as one markdown blob."""
+    if not profile: return ""
+    return "\n\n".join([
+        f"**User ID:** {profile.get('userid', 'N/A')}",
+        f"**Target Country:** {profile.get('DreamCountry', 'N/A')}",
+        f"**IELTS Status:** {profile.get('ielts_status', 'N/A')}",
+        f"**Study Abroad Status:** {profile.get('study_abroad_status', 'N/A')}",
+        f"**Funds:** {profile.get('Funds', 'N/A')}",
+        f"**Goal:** {profile.get('goal', 'N/A')}",
+        f"**Category/SubCategory:** {profile.get('category', 'N/A')} / {profile.get('subCategory', 'N/A')}",
+    ])
+
+
+# --- CRM record lookup via a cached phone -> row index ---
+PHONE_INDEX_TTL_S = 60 # Rows added from elsewhere show up within this window
+
+def find_followup(worksheet, phone_number: str) -> Optional[Tuple[Dict[str, Any], int]]:
+    """Like gspread_utils.find_followup_by_phone, but resolves the row from a PhoneNumber index kept in session state."""
+    if not phone_number: return None
+    cached = st.session_state.get("followup_phone_index")
+    if not cached or time.monotonic() - cached[0] > PHONE_INDEX_TTL_S:
+        phone_index = gspread_utils.build_phone_index(worksheet)
+        if phone_index is None: return None
+        cached = st.session_state["followup_phone_index"] = (time.monotonic(), phone_index)
+    row_index = cached[1].get(phone_number)
+    if not row_index: return None
+    crm_data = gspread_utils.get_followup_by_row(worksheet, row_index)
+    return (crm_data, row_index) if crm_data else None
+
+
+# --- Create / Edit Follow-up Plan editor ---
+@st.fragment # Editor widgets (typing, Suggest Plan) rerun only this block, not the activities list above
+def _render_editor(worksheet):
+    """Create / Edit Follow-up Plan area for the user loaded from the sidebar."""
+    loaded_phone = st.session_state.get("followup_loaded_user_phone")
+    db_profile = st.session_state.get("followup_db_profile")
+    crm_record = st.session_state.get("followup_crm_record")
+    crm_row_index = st.session_state.get("followup_crm_row_index")
+
+    if loaded_phone:
+        st.markdown(f"#### Editing Plan for: {db_profile.get('username', 'N/A') if db_profile else 'N/A'} ({loaded_phone})")
+        if not db_profile:
+             st.warning("Cannot proceed without basic user profile from database.")
+             return # Stop if no DB profile
+
+        # Display key DB profile points for context
+        with st.expander("Show/Hide User Profile Context", expanded=False):
+             # Built once when the profile was loaded; one element instead of one per field
+             profile_md = st.session_state.get("followup_profile_md")
+             if not profile_md: profile_md = st.session_state["followup_profile_md"] = _profile_context_markdown(db_profile)
+             st.markdown(profile_md)
+             # Add latest shortlist info? Fetch if needed
+             # latest_shortlist = get_latest_shortlist_details(db_profile['userid'])
+
+        # --- Input Fields ---
+        plan_default = crm_record.get("Plan_of_Action", "") if crm_record else ""
+        next_date_default = crm_record.get("Next_Action_Date") if crm_record else None # Should be date object or None
+        medium_default_index = _ACTION_MEDIUM_INDEX.get((crm_record or {}).get("Current_Action_Medium"), 0)
+        message_default = crm_record.get("Message", "") if crm_record else ""
+
+        st.markdown("**Plan Strategy**")
+        plan_action = st.text_area("Plan of Action (Long term strategy, notes)", value=plan_default, height=200, key="followup_plan")
+
+        # --- RAG Suggestion Button ---
+        suggestion_streamed = False
+        if st.button("Suggest Plan Strategy (using AI)", key="followup_suggest_plan"):
+             # Create prompt for RAG (do_rag_query_stream serializes db_profile into the prompt itself)
+             rag_query = f"Based on the user profile, suggest a multi-step follow-up plan (over several weeks/months) to guide this student towards their study abroad goal. Consider their status (IELTS, Study Abroad), target country/field, and potential budget. Outline key communication points and potential topics."
+             try:
+                  with st.spinner("AI is thinking about a strategy..."):
+                       from rag_utils import do_rag_query_stream # Deferred: only this handler needs the RAG stack
+                       suggestion_stream = do_rag_query_stream(user_query=rag_query, user_profile=db_profile, top_k=3) # Pass profile for context
+                       first_chunk = next(suggestion_stream, "") # Spinner covers routing/retrieval until the first token
+                  st.markdown("**AI Suggested Strategy:**")
+                  st.session_state["followup_rag_suggestion"] = st.write_stream(itertools.chain([first_chunk], suggestion_stream))
+                  suggestion_streamed = True
+             except Exception as e:
+                  st.error(f"Failed to get AI suggestion: {e}")
+                  logging.error(f"RAG query failed for plan suggestion: {e}")
+
+        rag_suggestion = st.session_state.get("followup_rag_suggestion")
+        if rag_suggestion and not suggestion_streamed: # Just-streamed answers are already on screen
+            st.markdown("**AI Suggested Strategy:**")
+            st.info(rag_suggestion)
+            # Add button to potentially append suggestion to plan?
+            # if st.button("Append Suggestion to Plan"):
+            #    st.session_state['followup_plan_value'] = plan_action + "\n\n-- AI Suggestion --\n" + rag_suggestion # Needs state management for text_area value
+
+        st.markdown("---")
+        st.markdown("**Next Action**")
+        col1, col2 = st.columns(2)
+        with col1:
+            next_action_date = st.date_input("Next Action Date", value=next_date_default, key="followup_next_date")
+        with col2:
+            action_medium = st.selectbox("Action Medium", ACTION_MEDIA, index=medium_default_index, key="followup_medium")
+
+        message_action = st.text_area("Message / Task for Next Action", value=message_default, height=150, key="followup_message")
+
+        # --- Save Button ---
+        if st.button("Save Plan / Update Action", key="followup_save"):
+            # Prepare data dictionary matching sheet headers
+            save_data = {
+                "Userid": db_profile.get("userid"), # Get Userid from DB profile
+                "PhoneNumber": loaded_phone,
+                "Plan_of_Action": st.session_state.followup_plan, # Get current value from widget state
+                "Next_Action_Date": next_action_date, # Already a date object from date_input
+                "Current_Action_Medium": action_medium,
+                "Message": st.session_state.followup_message,
+                # Current_Action_Date is set automatically by update/add functions
+            }
+
+            # Validate required fields
+            if not save_data["Userid"]:
+                 st.error("Cannot save: Userid is missing from the loaded database profile.")
+            else:
+                 with st.spinner("Saving to Google Sheet..."):
+                      success = False
+                      if crm_row_index: # Existing record, update it
+                           success = gspread_utils.update_followup(worksheet, crm_row_index, save_data)
+                      else: # New record, append it
+                           success = gspread_utils.add_followup(worksheet, save_data)
+
+                      if success:
+                           st.success("Follow-up plan saved successfully!")
+                           # Clear suggestion and potentially refresh CRM record state?
+                           st.session_state["followup_rag_suggestion"] = None
+                           # Build the saved record locally instead of re-reading the sheet (dates kept as date objects, like a fetched row)
+                           st.session_state["followup_crm_record"] = {**(crm_record or {}), **save_data, "Current_Action_Date": datetime.date.today(), "Next_Action_Date": next_action_date}
+                           if not crm_row_index: # New row: take its index from the append response and keep the phone index in step
+                                new_row_index = success if success is not True else None
+                                cached = st.session_state.get("followup_phone_index")
+                                if cached and new_row_index: cached[1][loaded_phone] = new_row_index
+                                else: st.session_state.pop("followup_phone_index", None)
+                                if not new_row_index: # Range not reported: look the row up, or the next Save would append a duplicate
+                                     new_row_index = (find_followup(worksheet, loaded_phone) or (None, None))[1]
+                                st.session_state["followup_crm_row_index"] = new_row_index
+                           st.rerun() # Refresh to show updated state
+                      else:
+                           st.error("Failed to save follow-up plan to Google Sheet.")
+
+
+    else: # No user loaded in editor
+        st.info("⬅️ Load a user using their phone number in the sidebar to create or edit their follow-up plan.")
+
 
 # --- Main Rendering Function for the Tab ---
 def render():
@@ -59,12 +273,14 @@ def render():
         return
 
     # --- Section 1: Today's Activities ---
-    st.subheader(f"Activities Due Today ({datetime.date.today().strftime('%Y-%m-%d')})")
+    today_iso = datetime.date.today().isoformat() # Once per run: heading and the due-today lookup share it
+    st.subheader(f"Activities Due Today ({today_iso})")
     with st.spinner("Loading activities due today..."):
         try:
-            due_today_records = gspread_utils.get_followups_due_today(worksheet)
+            due_today_records = gspread_utils.get_due_today_fast(worksheet, today_iso)
         except Exception as e:
             st.error(f"Error fetching activities: {e}")
+            logging.error(f"Error in get_due_today_fast: {e}", exc_info=True)
             due_today_records = []
 
     if not due_today_records:
@@ -76,32 +292,46 @@ def render():
         user_profiles_today = {} # phone -> profile dict
         if user_phones_today:
              with st.spinner("Fetching user details for today's activities..."):
-                for phone in user_phones_today:
-                     if phone not in user_profiles_today: # Avoid refetching
-                         profile = get_combined_db_profile(phone)
-                         user_profiles_today[phone] = profile if profile else {} # Store profile or empty dict
-
-        # Display activities
-        for i, record in enumerate(due_today_records):
+                # One bulk fetch for all of today's phones (deduplicated, order kept) instead of two queries per phone
+                profiles = get_combined_db_profiles_bulk(tuple(dict.fromkeys(user_phones_today)))
+                user_profiles_today = {phone: profile or {} for phone, profile in profiles.items()} # Store profile or empty dict
+
+        # Display activities: one grid for the list, details + load button only for the selected row
+        due_rows = [{
+            "Username": user_profiles_today.get(record.get("PhoneNumber"), {}).get('username', 'N/A'),
+            "PhoneNumber": record.get("PhoneNumber"),
+            "Action": record.get('Current_Action_Medium', 'N/A'),
+            "Next Action Date": record.get('Next_Action_Date', 'N/A'),
+            "Plan": record.get('Plan_of_Action', 'N/A'),
+        } for record in due_today_records] # st.dataframe takes the row dicts as-is, no pandas import needed here
+        due_selection = st.dataframe(due_rows, key="followup_due_today_df", on_select="rerun", selection_mode="single-row", hide_index=True, use_container_width=True)
+        selected_rows = due_selection.selection.rows
+        if selected_rows:
+            i = selected_rows[0]
+            record = due_today_records[i]
             phone = record.get("PhoneNumber")
             profile = user_profiles_today.get(phone, {})
             username = profile.get('username', 'N/A')
 
-            with st.expander(f"{username} ({phone}) - Action: {record.get('Current_Action_Medium', 'N/A')}", expanded=False):
-                st.markdown(f"**Plan:** {record.get('Plan_of_Action', 'N/A')}")
-                st.markdown(f"**Message/Task:** {record.get('Message', 'N/A')}")
-                st.markdown(f"**Next Action Date:** {record.get('Next_Action_Date', 'N/A')}") # Should be today
-                st.markdown(f"**Last Updated:** {record.get('Current_Action_Date', 'N/A')}")
-                st.markdown(f"**User ID:** {record.get('Userid', 'N/A')}")
+            with st.expander(f"{username} ({phone}) - Action: {record.get('Current_Action_Medium', 'N/A')}", expanded=True):
+                st.markdown(
+                    f"**Plan:** {record.get('Plan_of_Action', 'N/A')}  \n"
+                    f"**Message/Task:** {record.get('Message', 'N/A')}  \n"
+                    f"**Next Action Date:** {record.get('Next_Action_Date', 'N/A')}  \n" # Should be today
+                    f"**Last Updated:** {record.get('Current_Action_Date', 'N/A')}  \n"
+                    f"**User ID:** {record.get('Userid', 'N/A')}"
+                )
                 # Add a button to load this user into the editor below?
                 if st.button("Load this User in Editor", key=f"load_today_{i}"):
                     st.session_state["followup_loaded_user_phone"] = phone
                     st.session_state["followup_db_profile"] = profile # Store fetched profile
-                    # Find the CRM record again (could optimize by passing index)
-                    crm_data, crm_index = gspread_utils.find_followup_by_phone(worksheet, phone)
+                    st.session_state["followup_profile_md"] = _profile_context_markdown(profile)
+                    # Find the CRM record (index lookup + one row read)
+                    crm_data, crm_index = find_followup(worksheet, phone) or (None, None)
                     st.session_state["followup_crm_record"] = crm_data
                     st.session_state["followup_crm_row_index"] = crm_index
                     st.rerun() # Rerun to populate editor
+        else: st.caption("Select a row to see its details and load the user in the editor.")
 
     st.divider()
 
@@ -128,12 +358,13 @@ def render():
                     # Fetch DB Profile
                     profile = get_combined_db_profile(phone_input)
                     st.session_state["followup_db_profile"] = profile
+                    st.session_state["followup_profile_md"] = _profile_context_markdown(profile)
 
                     # Fetch CRM Record from Sheet
                     crm_data = None
                     crm_index = None
                     # Assign result to a temporary variable first
-                    find_result = gspread_utils.find_followup_by_phone(worksheet, phone_input)
+                    find_result = find_followup(worksheet, phone_input)
 
                     # Check if the result is not None before unpacking
                     if find_result is not None:
@@ -153,107 +384,4 @@ def render():
                     else: st.success(f"Loaded existing follow-up plan for {phone_input}.")
 
     # --- Display and Edit Area ---
-    loaded_phone = st.session_state.get("followup_loaded_user_phone")
-    db_profile = st.session_state.get("followup_db_profile")
-    crm_record = st.session_state.get("followup_crm_record")
-    crm_row_index = st.session_state.get("followup_crm_row_index")
-
-    if loaded_phone:
-        st.markdown(f"#### Editing Plan for: {db_profile.get('username', 'N/A') if db_profile else 'N/A'} ({loaded_phone})")
-        if not db_profile:
-             st.warning("Cannot proceed without basic user profile from database.")
-             return # Stop if no DB profile
-
-        # Display key DB profile points for context
-        with st.expander("Show/Hide User Profile Context", expanded=False):
-             st.markdown(f"**User ID:** {db_profile.get('userid', 'N/A')}")
-             st.markdown(f"**Target Country:** {db_profile.get('DreamCountry', 'N/A')}")
-             st.markdown(f"**IELTS Status:** {db_profile.get('ielts_status', 'N/A')}")
-             st.markdown(f"**Study Abroad Status:** {db_profile.get('study_abroad_status', 'N/A')}")
-             st.markdown(f"**Funds:** {db_profile.get('Funds', 'N/A')}")
-             st.markdown(f"**Goal:** {db_profile.get('goal', 'N/A')}")
-             st.markdown(f"**Category/SubCategory:** {db_profile.get('category', 'N/A')} / {db_profile.get('subCategory', 'N/A')}")
-             # Add latest shortlist info? Fetch if needed
-             # latest_shortlist = get_latest_shortlist_details(db_profile['userid'])
-
-        # --- Input Fields ---
-        plan_default = crm_record.get("Plan_of_Action", "") if crm_record else ""
-        next_date_default = crm_record.get("Next_Action_Date") if crm_record else None # Should be date object or None
-        medium_default_index = ["WhatsApp", "Email"].index(crm_record["Current_Action_Medium"]) if crm_record and crm_record.get("Current_Action_Medium") in ["WhatsApp", "Email"] else 0
-        message_default = crm_record.get("Message", "") if crm_record else ""
-
-        st.markdown("**Plan Strategy**")
-        plan_action = st.text_area("Plan of Action (Long term strategy, notes)", value=plan_default, height=200, key="followup_plan")
-
-        # --- RAG Suggestion Button ---
-        if st.button("Suggest Plan Strategy (using AI)", key="followup_suggest_plan"):
-             with st.spinner("AI is thinking about a strategy..."):
-                  # Create prompt for RAG
-                  prompt_context = f"User Profile:\n{json.dumps(db_profile, indent=2, default=str)}\n\n"
-                  # Add shortlist context if needed (fetch first)
-                  # prompt_context += f"Latest Shortlist: {...}\n\n"
-                  rag_query = f"Based on the user profile, suggest a multi-step follow-up plan (over several weeks/months) to guide this student towards their study abroad goal. Consider their status (IELTS, Study Abroad), target country/field, and potential budget. Outline key communication points and potential topics."
-                  try:
-                       suggestion = do_rag_query(user_query=rag_query, user_profile=db_profile, top_k=3) # Pass profile for context
-                       st.session_state["followup_rag_suggestion"] = suggestion
-                  except Exception as e:
-                       st.error(f"Failed to get AI suggestion: {e}")
-                       logging.error(f"RAG query failed for plan suggestion: {e}")
-
-        rag_suggestion = st.session_state.get("followup_rag_suggestion")
-        if rag_suggestion:
-            st.markdown("**AI Suggested Strategy:**")
-            st.info(rag_suggestion)
-            # Add button to potentially append suggestion to plan?
-            # if st.button("Append Suggestion to Plan"):
-            #    st.session_state['followup_plan_value'] = plan_action + "\n\n-- AI Suggestion --\n" + rag_suggestion # Needs state management for text_area value
-
-        st.markdown("---")
-        st.markdown("**Next Action**")
-        col1, col2 = st.columns(2)
-        with col1:
-            next_action_date = st.date_input("Next Action Date", value=next_date_default, key="followup_next_date")
-        with col2:
-            action_medium = st.selectbox("Action Medium", ["WhatsApp", "Email"], index=medium_default_index, key="followup_medium")
-
-        message_action = st.text_area("Message / Task for Next Action", value=message_default, height=150, key="followup_message")
-
-        # --- Save Button ---
-        if st.button("Save Plan / Update Action", key="followup_save"):
-            # Prepare data dictionary matching sheet headers
-            save_data = {
-                "Userid": db_profile.get("userid"), # Get Userid from DB profile
-                "PhoneNumber": loaded_phone,
-                "Plan_of_Action": st.session_state.followup_plan, # Get current value from widget state
-                "Next_Action_Date": next_action_date, # Already a date object from date_input
-                "Current_Action_Medium": action_medium,
-                "Message": st.session_state.followup_message,
-                # Current_Action_Date is set automatically by update/add functions
-            }
-
-            # Validate required fields
-            if not save_data["Userid"]:
-                 st.error("Cannot save: Userid is missing from the loaded database profile.")
-            else:
-                 with st.spinner("Saving to Google Sheet..."):
-                      success = False
-                      if crm_row_index: # Existing record, update it
-                           success = gspread_utils.update_followup(worksheet, crm_row_index, save_data)
-                      else: # New record, append it
-                           success = gspread_utils.add_followup(worksheet, save_data)
-
-                      if success:
-                           st.success("Follow-up plan saved successfully!")
-                           # Clear suggestion and potentially refresh CRM record state?
-                           st.session_state["followup_rag_suggestion"] = None
-                           # Refetch CRM record after save
-                           crm_data, crm_index = gspread_utils.find_followup_by_phone(worksheet, loaded_phone)
-                           st.session_state["followup_crm_record"] = crm_data
-                           st.session_state["followup_crm_row_index"] = crm_index
-                           st.rerun() # Refresh to show updated state
-                      else:
-                           st.error("Failed to save follow-up plan to Google Sheet.")
-
-
-    else: # No user loaded in editor
-        st.info("⬅️ Load a user using their phone number in the sidebar to create or edit their follow-up plan.")
\ No newline at end of file
+    _render_editor(worksheet)
@@ -1,19 +1,53 @@
 import streamlit as st
 import logging
 import os
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # --- Import Core Logic ---
 # Assuming these modules are accessible from the main project directory
 try:
     from db_connection import get_user_by_phone, get_shortlists_by_user
     from usecase_templates import generate_all_use_cases # If still needed
-    from rag_utils import do_rag_query
+    # rag_utils (LangChain/OpenAI) is imported inside the functions that call it, so opening the app doesn't pay for it
 except ImportError as e:
     st.error(f"(Student Report Tab) Failed to import required modules: {e}. Check file structure.")
     logging.error(f"(Student Report Tab) Module import error: {e}", exc_info=True)
     st.stop()
 
 
+# --- Report section prompts ({country}: target country, {notes}: optional extra-notes suffix) ---
+_REPORT_SECTION_TEMPLATES = {
+    "Career Outlook": "Provide a detailed career outlook for professions relevant to the user's profile and potential fields of study in {country}. Mention typical salary ranges and job prospects if available.{notes}",
+    "University Options": "Suggest 3-5 suitable universities in {country} based on the user's profile (e.g., academic background, interests) and potential fields of interest. Include brief reasons for each suggestion, mentioning any specializations or strengths.{notes}",
+    "Admission Requirements": "Summarize general academic and language admission requirements (e.g., common tests like IELTS/TOEFL/GRE/GMAT, typical GPA ranges, prerequisite subjects) for universities in {country} relevant to the user's likely field of study.{notes}",
+    "Immigration Pathways": "Briefly outline potential post-study work visa options or relevant immigration pathways in {country} for international students completing studies in fields relevant to the user.{notes}",
+    "Cost of Living & Tuition": "Provide a general estimate of the average annual tuition fees and living costs for an international student in {country}.{notes}"
+}
+
+def _build_sections(country: str, notes: str) -> dict:
+    """Section title -> RAG query for the report, in report order."""
+    suffix = f"\n\nAdditional context: {notes}" if notes else ""
+    return {title: template.format(country=country, notes=suffix) for title, template in _REPORT_SECTION_TEMPLATES.items()}
+
+
+# --- Cached report sections ---
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False) # Re-generating the same report (same user, notes) costs no LLM calls
+def _cached_report_section(user_query: str, user_id: str, top_k: int, _user_profile: dict) -> str:
+    """do_rag_query keyed on the section query (which carries the notes) and the user id. Failures raise, so error text isn't cached."""
+    from rag_utils import do_rag_query, is_rag_failure
+    answer = do_rag_query(user_query=user_query, user_profile=_user_profile, top_k=top_k)
+    if is_rag_failure(answer): raise RuntimeError(answer)
+    return answer
+
+def _report_section(user_query: str, user_profile: dict, top_k: int) -> str:
+    user_id = user_profile.get("id") or user_profile.get("userid") or user_profile.get("user_id")
+    if not user_id: # No stable key for this profile: don't risk serving another user's answer
+        from rag_utils import do_rag_query
+        return do_rag_query(user_query=user_query, user_profile=user_profile, top_k=top_k)
+    return _cached_report_section(user_query, str(user_id), top_k, user_profile)
+
+
 # --- Main Rendering Function for the Tab ---
 def render():
     st.header("Student Profile & AI Report Generation")
@@ -81,17 +115,22 @@ def render():
         st.markdown("Ask the AI counselor about study abroad topics.")
         top_k_report = st.number_input("Number of Documents to Retrieve (Top K)", min_value=1, max_value=10, value=5, key="report_rag_top_k")
         user_query_report = st.text_area("Your Question:", key="report_rag_query_input", height=100)
+        answer_streamed = False
         if st.button("Get Answer", key="report_rag_button"):
              if not user_query_report: st.warning("Please enter a question.")
              else:
-                  with st.spinner("Thinking..."):
-                       try:
-                           logging.info(f"Calling RAG with query: '{user_query_report}', top_k: {top_k_report}")
+                  try:
+                      logging.info(f"Calling RAG with query: '{user_query_report}', top_k: {top_k_report}")
+                      with st.spinner("Thinking..."):
+                           from rag_utils import do_rag_query_stream
                            # Ensure user_data (profile) is passed correctly
-                           answer = do_rag_query(user_query=user_query_report, user_profile=st.session_state["current_user_data"], top_k=top_k_report)
-                           st.session_state["rag_answer"] = answer
-                       except Exception as e: st.error(f"RAG system error: {e}"); logging.error(f"RAG query error: {e}", exc_info=True); st.session_state["rag_answer"] = f"Sorry, an error occurred: {e}"
-        if st.session_state["rag_answer"]: st.markdown("**AI Counselor's Answer:**"); st.markdown(st.session_state["rag_answer"])
+                           answer_stream = do_rag_query_stream(user_query=user_query_report, user_profile=st.session_state["current_user_data"], top_k=top_k_report, semantic_cache=True) # Free-form question
+                           first_chunk = next(answer_stream, "") # Spinner covers routing/retrieval until the first token
+                      st.markdown("**AI Counselor's Answer:**")
+                      st.session_state["rag_answer"] = st.write_stream(itertools.chain([first_chunk], answer_stream))
+                      answer_streamed = True
+                  except Exception as e: st.error(f"RAG system error: {e}"); logging.error(f"RAG query error: {e}", exc_info=True); st.session_state["rag_answer"] = f"Sorry, an error occurred: {e}"
+        if st.session_state["rag_answer"] and not answer_streamed: st.markdown("**AI Counselor's Answer:**"); st.markdown(st.session_state["rag_answer"])
 
         st.divider()
 
@@ -111,15 +150,7 @@ def render():
                 st.warning("Target country info missing. Report context might be limited.")
                 dream_country_report = "the user's target country"
 
-            report_sections = { # Use the full definitions
-                "Career Outlook": f"Provide a detailed career outlook for professions relevant to the user's profile and potential fields of study in {dream_country_report}. Mention typical salary ranges and job prospects if available.",
-                "University Options": f"Suggest 3-5 suitable universities in {dream_country_report} based on the user's profile (e.g., academic background, interests) and potential fields of interest. Include brief reasons for each suggestion, mentioning any specializations or strengths.",
-                "Admission Requirements": f"Summarize general academic and language admission requirements (e.g., common tests like IELTS/TOEFL/GRE/GMAT, typical GPA ranges, prerequisite subjects) for universities in {dream_country_report} relevant to the user's likely field of study.",
-                "Immigration Pathways": f"Briefly outline potential post-study work visa options or relevant immigration pathways in {dream_country_report} for international students completing studies in fields relevant to the user.",
-                "Cost of Living & Tuition": f"Provide a general estimate of the average annual tuition fees and living costs for an international student in {dream_country_report}."
-            }
-            if extra_notes_report:
-                 for key in report_sections: report_sections[key] += f"\n\nAdditional context: {extra_notes_report}"
+            report_sections = _build_sections(dream_country_report, extra_notes_report)
 
             report_texts = {}
             report_top_k_gen = 5
@@ -127,20 +158,20 @@ def render():
             with st.spinner("Generating report sections... This may take a moment."):
                  progress_bar = st.progress(0.0, text="Initializing report generation...")
                  total_sections = len(report_sections)
-                 for i, (section_title, section_query) in enumerate(report_sections.items()):
-                      progress_text = f"Generating section ({i+1}/{total_sections}): {section_title}..."
-                      st.info(progress_text) # Show progress step
-                      progress_bar.progress(float(i) / total_sections, text=progress_text) # Update progress bar
-                      logging.info(f"Calling RAG for report section '{section_title}', top_k: {report_top_k_gen}")
-                      try:
-                           # Ensure profile_report (user_data) is passed
-                           section_answer = do_rag_query(user_query=section_query, user_profile=profile_report, top_k=report_top_k_gen)
-                           report_texts[section_title] = section_answer
-                           logging.info(f"Successfully generated section: {section_title}")
-                      except Exception as e:
-                           error_message = f"Error generating section '{section_title}': {e}"; st.error(error_message); logging.error(f"Report section error '{section_title}': {e}", exc_info=True); report_texts[section_title] = f"Could not generate this section due to an error: {e}"; generation_successful = False
-                 progress_bar.progress(1.0, text="Report generation complete.") # Final progress update
-                 st.info("Report generation process finished.") # Keep info message for clarity
+                 # Sections are independent RAG calls (network-bound): run them all at once, report progress as they finish
+                 with ThreadPoolExecutor(max_workers=total_sections) as executor:
+                      logging.info(f"Calling RAG for {total_sections} report sections concurrently, top_k: {report_top_k_gen}")
+                      futures = {executor.submit(_report_section, user_query=section_query, user_profile=profile_report, top_k=report_top_k_gen): section_title for section_title, section_query in report_sections.items()}
+                      for i, future in enumerate(as_completed(futures), 1):
+                           section_title = futures[future]
+                           try:
+                                report_texts[section_title] = future.result()
+                                logging.info(f"Successfully generated section: {section_title}")
+                           except Exception as e:
+                                error_message = f"Error generating section '{section_title}': {e}"; st.error(error_message); logging.error(f"Report section error '{section_title}': {e}", exc_info=True); report_texts[section_title] = f"Could not generate this section due to an error: {e}"; generation_successful = False
+                           progress_bar.progress(i / total_sections, text=f"Generated section ({i}/{total_sections}): {section_title}")
+                 report_texts = {section_title: report_texts[section_title] for section_title in report_sections} # Completion order -> report order
+                 progress_bar.progress(1.0, text="Report generation complete.") # Final progress update (the bar's text is the only status element)
 
             # Combine and store results (Copied)
             final_report_text = f"Personalized Study Abroad Report for {username_report}\nTarget Country: {dream_country_report}\n{'=' * 40}\n\n"
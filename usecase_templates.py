@@ -1,3 +1,4 @@
+import functools
 import random
 
 USE_CASES = {
@@ -7,20 +8,22 @@ USE_CASES = {
     # ...
     # Up to 30 different topics
 }
+_USE_CASE_ITEMS = tuple(USE_CASES.items()) # (key, base_text) pairs, materialized once at import
+
+def _greeting_prefix(user_profile):
+    # Simple personalization example
+    user_name = (user_profile or {}).get("username") or "Aspirant"
+    return f"Hey {user_name}, "
 
 def generate_use_case_message(use_case_key, user_profile):
     """
-    Returns a short text message for the specified use case, 
+    Returns a short text message for the specified use case,
     optionally personalizing it with 'user_profile'.
     """
-    if use_case_key not in USE_CASES:
+    base_text = USE_CASES.get(use_case_key)
+    if base_text is None:
         return "No template found for that use case."
-
-    base_text = USE_CASES[use_case_key]
-    # Simple personalization example
-    user_name = user_profile.get("username", "Aspirant")
-    personalized_text = f"Hey {user_name}, {base_text}"
-    return personalized_text
+    return _greeting_prefix(user_profile) + base_text
 
 
 def generate_all_use_cases(user_profile):
@@ -28,12 +31,12 @@ def generate_all_use_cases(user_profile):
     Returns a list of 30 text messages for all use cases,
     or you can pick specific ones as needed.
     """
-    messages = []
-    for use_case_key in USE_CASES.keys():
-        msg = generate_use_case_message(use_case_key, user_profile)
-        messages.append(msg)
-
-    # If you truly have 30 templates, store them in the dictionary 
+    # If you truly have 30 templates, store them in the dictionary
     # or create a structure that holds all 30, then generate them all.
     # This is just an example.
-    return messages
+    return list(_all_for_prefix(_greeting_prefix(user_profile))) # Copy, so callers can't mutate the cached tuple
+
+
+@functools.lru_cache(maxsize=256) # The greeting (i.e. the username) is the only part that varies per user
+def _all_for_prefix(prefix):
+    return tuple(prefix + base_text for _, base_text in _USE_CASE_ITEMS)